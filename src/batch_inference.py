@@ -0,0 +1,243 @@
+import time
+import llama_cpp
+from collections import deque
+from typing import List, Optional
+from llama_cpp import Llama, LlamaGrammar, LLAMA_DEFAULT_SEED
+from llama_cpp._internals import LlamaBatch, LlamaContext, LlamaSampler
+
+
+class SequenceSlot:
+    """
+    State of one parallel slot (one sequence of the shared KV cache).
+    """
+
+    def __init__(self, seq_id: int) -> None:
+        """
+        Initialises an idle slot for the given sequence ID.
+        """
+        self.seq_id = seq_id
+        self.request_index = None
+        self.sampler = None
+        self.pending_tokens = []
+        self.next_token = None
+        self.n_past = 0
+        self.n_generated = 0
+        self.text = b""
+        self.json_tracker = None
+        self.start_time = None
+        self.first_token_time = None
+        self.stats = None
+
+    @property
+    def is_active(self) -> bool:
+        return self.request_index is not None
+
+
+class BatchInferenceEngine:
+    """
+    Runs several prompts concurrently on one llama.cpp context using multi-sequence batching.
+    Every slot owns one sequence of the shared KV cache, and finished slots are immediately
+    refilled with pending prompts (continuous batching). A common prompt prefix is evaluated once
+    into its own sequence and copied to the slots instead of being re-evaluated.
+    """
+
+    def __init__(self, llama: Llama, n_parallel: int, context_window_size: int, n_batch: int = 512,
+                 n_ubatch: int = 512, sampling_params: Optional[dict] = None, grammar: Optional[LlamaGrammar] = None,
+                 stop_token_ids: Optional[List[int]] = None, json_tracker_class: Optional[type] = None,
+                 seed: int = LLAMA_DEFAULT_SEED, verbose: bool = False) -> None:
+        """
+        Creates a separate context (sharing the weights of the given model) with room for
+        'n_parallel' sequences of 'context_window_size' tokens each.
+
+        'json_tracker_class' (if provided) is used to stop every sequence as soon as its JSON object is closed.
+        Every sequence samples with the given 'seed' (random by default).
+
+        Every generating sequence adds one token to each decode call, so at most 'n_batch' sequences
+        are decoded in parallel.
+        """
+        if n_parallel > n_batch:
+            print(f"Decoding {n_batch} sequences in parallel instead of {n_parallel} (n_batch is {n_batch})...")
+        self.llama = llama
+        self.n_parallel = min(n_parallel, n_batch)
+        self.context_window_size = context_window_size
+        self.n_batch = n_batch
+        self.sampling_params = sampling_params or {}
+        self.grammar = grammar
+        self.stop_token_ids = set(stop_token_ids or []) | {llama.token_eos()}
+        self.json_tracker_class = json_tracker_class
+        self.seed = seed
+
+        params = llama_cpp.llama_context_default_params()
+        params.n_ctx = context_window_size * self.n_parallel
+        params.n_batch = n_batch
+        params.n_ubatch = min(n_ubatch, n_batch)
+        params.n_seq_max = self.n_parallel + 1
+        params.n_threads = llama.context_params.n_threads
+        params.n_threads_batch = llama.context_params.n_threads_batch
+        self.ctx = LlamaContext(model=llama._model, params=params, verbose=verbose)
+        self.batch = LlamaBatch(n_tokens=n_batch, embd=0, n_seq_max=1, verbose=verbose)
+
+        # THE LAST SEQUENCE ID HOLDS THE SHARED PROMPT PREFIX
+        self.prefix_seq_id = self.n_parallel
+        self.prefix_tokens = []
+        self.request_stats = []
+
+    def add_token(self, token: int, pos: int, seq_id: int, logits: bool) -> int:
+        """
+        Adds a token to the current batch and returns its index in the batch.
+        """
+        batch = self.batch.batch
+        index = batch.n_tokens
+        batch.token[index] = token
+        batch.pos[index] = pos
+        batch.n_seq_id[index] = 1
+        batch.seq_id[index][0] = seq_id
+        batch.logits[index] = logits
+        batch.n_tokens += 1
+        return index
+
+    def set_prefix(self, prefix_tokens: List[int]) -> None:
+        """
+        Evaluates the shared prompt prefix once into its own sequence.
+        """
+        self.ctx.kv_cache_seq_rm(self.prefix_seq_id, -1, -1)
+        for start in range(0, len(prefix_tokens), self.n_batch):
+            self.batch.batch.n_tokens = 0
+            for pos, token in enumerate(prefix_tokens[start:start + self.n_batch], start=start):
+                self.add_token(token=token, pos=pos, seq_id=self.prefix_seq_id, logits=False)
+            self.ctx.decode(self.batch)
+        self.prefix_tokens = list(prefix_tokens)
+
+    def create_sampler(self) -> LlamaSampler:
+        """
+        Returns a new sampler chain (grammar, top-k, top-p, min-p, temperature) for one sequence.
+        """
+        sampler = LlamaSampler()
+        if self.grammar is not None:
+            sampler.add_grammar(self.llama._model, self.grammar)
+        sampler.add_top_k(self.sampling_params.get('top_k', 40))
+        sampler.add_top_p(self.sampling_params.get('top_p', 0.95), 1)
+        sampler.add_min_p(self.sampling_params.get('min_p', 0.05), 1)
+        sampler.add_temp(self.sampling_params.get('temperature', 0.2))
+        sampler.add_dist(self.seed)
+        return sampler
+
+    def start_sequence(self, slot: SequenceSlot, request_index: int, prompt_tokens: List[int]) -> None:
+        """
+        Assigns a prompt to the slot, reusing the shared prefix if the prompt starts with it.
+        """
+        self.ctx.kv_cache_seq_rm(slot.seq_id, -1, -1)
+        n_prefix_tokens = len(self.prefix_tokens)
+        if n_prefix_tokens > 0 and prompt_tokens[:n_prefix_tokens] == self.prefix_tokens:
+            self.ctx.kv_cache_seq_cp(self.prefix_seq_id, slot.seq_id, -1, -1)
+            slot.n_past = n_prefix_tokens
+        else:
+            slot.n_past = 0
+
+        # THE LAST PROMPT TOKEN IS ALWAYS EVALUATED TO GET LOGITS FOR THE FIRST GENERATED TOKEN
+        if slot.n_past == len(prompt_tokens):
+            slot.n_past -= 1
+            self.ctx.kv_cache_seq_rm(slot.seq_id, slot.n_past, -1)
+
+        slot.request_index = request_index
+        slot.pending_tokens = prompt_tokens[slot.n_past:]
+        slot.sampler = self.create_sampler()
+        slot.next_token = None
+        slot.n_generated = 0
+        slot.text = b""
+        slot.json_tracker = self.json_tracker_class() if self.json_tracker_class is not None else None
+        slot.start_time = time.perf_counter()
+        slot.first_token_time = None
+        slot.stats = {'prompt_tokens': len(prompt_tokens), 'cached_prompt_tokens': slot.n_past}
+
+    def finish_sequence(self, slot: SequenceSlot, results: List[Optional[str]], text: Optional[str]) -> None:
+        """
+        Stores the result of the slot and frees its sequence.
+        """
+        results[slot.request_index] = text
+        # SEQUENCES SHARE EVERY DECODE CALL, SO THEIR TIMES OVERLAP
+        end_time = time.perf_counter()
+        first_token_time = slot.first_token_time or end_time
+        self.request_stats[slot.request_index] = {
+            **slot.stats,
+            'generated_tokens': slot.n_generated,
+            'prompt_eval_time': first_token_time - slot.start_time,
+            'generation_time': end_time - first_token_time
+        }
+        self.ctx.kv_cache_seq_rm(slot.seq_id, -1, -1)
+        slot.sampler = None
+        slot.request_index = None
+
+    def accept_token(self, slot: SequenceSlot, token: int, max_tokens: Optional[int]) -> bool:
+        """
+        Appends the sampled token to the output of the slot. Returns True if the sequence is finished.
+        """
+        if slot.first_token_time is None:
+            slot.first_token_time = time.perf_counter()
+        if token in self.stop_token_ids:
+            return True
+        token_text = self.llama.detokenize([token])
+        slot.text += token_text
+        slot.n_generated += 1
+        slot.next_token = token
+        if slot.json_tracker is not None and slot.json_tracker.feed(token_text.decode('utf-8', errors='ignore')) != -1:
+            return True
+        if max_tokens is not None and slot.n_generated >= max_tokens:
+            return True
+        return slot.n_past + 1 >= self.context_window_size
+
+    def __call__(self, prompts_tokens: List[List[int]], max_tokens: Optional[int] = None) -> List[Optional[str]]:
+        """
+        Generates a completion for every tokenized prompt and returns them in the same order.
+        Prompts that do not fit in the per-sequence context window get None. Token counts and
+        timings of every prompt are kept in 'request_stats' (None for skipped prompts).
+        """
+        results = [None] * len(prompts_tokens)
+        self.request_stats = [None] * len(prompts_tokens)
+        pending_requests = deque()
+        for request_index, prompt_tokens in enumerate(prompts_tokens):
+            if len(prompt_tokens) >= self.context_window_size:
+                print(f"Skipping prompt {request_index + 1}: {len(prompt_tokens)} tokens exceed the context window!")
+                continue
+            pending_requests.append((request_index, prompt_tokens))
+
+        slots = [SequenceSlot(seq_id=seq_id) for seq_id in range(self.n_parallel)]
+        while pending_requests or any(slot.is_active for slot in slots):
+            for slot in slots:
+                if not slot.is_active and pending_requests:
+                    request_index, prompt_tokens = pending_requests.popleft()
+                    self.start_sequence(slot=slot, request_index=request_index, prompt_tokens=prompt_tokens)
+
+            self.batch.batch.n_tokens = 0
+            sampling_slots = []
+
+            # ONE TOKEN FOR EVERY GENERATING SEQUENCE
+            for slot in slots:
+                if slot.is_active and not slot.pending_tokens:
+                    batch_index = self.add_token(token=slot.next_token, pos=slot.n_past, seq_id=slot.seq_id, logits=True)
+                    slot.n_past += 1
+                    sampling_slots.append((slot, batch_index))
+
+            # REMAINING BATCH CAPACITY IS FILLED WITH PROMPT TOKENS
+            for slot in slots:
+                capacity = self.n_batch - self.batch.batch.n_tokens
+                if capacity <= 0:
+                    break
+                if not slot.is_active or not slot.pending_tokens:
+                    continue
+                chunk = slot.pending_tokens[:capacity]
+                slot.pending_tokens = slot.pending_tokens[len(chunk):]
+                for position, token in enumerate(chunk):
+                    is_last_prompt_token = not slot.pending_tokens and position == len(chunk) - 1
+                    batch_index = self.add_token(token=token, pos=slot.n_past, seq_id=slot.seq_id, logits=is_last_prompt_token)
+                    slot.n_past += 1
+                if not slot.pending_tokens:
+                    sampling_slots.append((slot, batch_index))
+
+            self.ctx.decode(self.batch)
+
+            for slot, batch_index in sampling_slots:
+                token = slot.sampler.sample(self.ctx, batch_index)
+                if self.accept_token(slot=slot, token=token, max_tokens=max_tokens):
+                    self.finish_sequence(slot=slot, results=results, text=slot.text.decode('utf-8', errors='ignore'))
+        return results
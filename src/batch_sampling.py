@@ -0,0 +1,106 @@
+import random
+import numpy as np
+from typing import Iterator, List, Optional
+from torch.utils.data import Sampler
+
+
+def get_dataset_lengths(dataset) -> List[int]:
+    """
+    Returns the token count of every example (packed datasets report their own row lengths,
+    tokenized datasets are measured by their 'input_ids').
+    """
+    if hasattr(dataset, 'get_length'):
+        return [dataset.get_length(index) for index in range(len(dataset))]
+    return [len(input_ids) for input_ids in dataset['input_ids']]
+
+
+class TokenBudgetBatchSampler(Sampler):
+    """
+    Batch sampler that groups examples of similar length into buckets (length quantiles) and fills
+    every batch with as many examples as fit in 'max_tokens' once padded to the longest example of
+    the batch. Short examples get large batches and long ones get small batches, instead of one
+    fixed batch size for all of them.
+
+    The batches are created once (from the seed) and only their order is shuffled every epoch, so
+    that the number of batches (and the max_steps and learning rate schedule the Trainer derives
+    from it) is the same in every epoch. The order only depends on the seed and the epoch given to
+    set_epoch() (the Trainer calls it before every epoch, resumed runs included).
+    """
+
+    def __init__(self, lengths: List[int], max_tokens: int, num_buckets: int = 8, max_batch_size: Optional[int] = None,
+                 shuffle: bool = True, seed: int = 0) -> None:
+        """
+        Assigns every example to a length bucket. Examples longer than 'max_tokens' get a batch of their own.
+        """
+        self.lengths = lengths
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+        boundaries = np.quantile(lengths, np.linspace(0, 1, num_buckets + 1)[1:-1]) if len(lengths) > 0 else []
+        bucket_ids = np.searchsorted(boundaries, lengths, side='right')
+        self.buckets = [np.flatnonzero(bucket_ids == bucket_id).tolist() for bucket_id in range(num_buckets)]
+        self.batches = self.create_batches(generator=random.Random(seed))
+
+    def set_epoch(self, epoch: int) -> None:
+        """
+        Sets the epoch whose batch order is returned by the following iterations.
+        """
+        self.epoch = epoch
+
+    def create_batches(self, generator: random.Random) -> List[List[int]]:
+        """
+        Splits every (shuffled) bucket into batches within the token budget.
+        """
+        batches = []
+        for bucket in self.buckets:
+            bucket = list(bucket)
+            if self.shuffle:
+                generator.shuffle(bucket)
+            batch, batch_max_length = [], 0
+            for index in bucket:
+                max_length = max(batch_max_length, self.lengths[index])
+                is_full = self.max_batch_size is not None and len(batch) >= self.max_batch_size
+                if batch and (max_length * (len(batch) + 1) > self.max_tokens or is_full):
+                    batches.append(batch)
+                    batch, max_length = [], self.lengths[index]
+                batch.append(index)
+                batch_max_length = max_length
+            if batch:
+                batches.append(batch)
+        return batches
+
+    def __iter__(self) -> Iterator[List[int]]:
+        if not self.shuffle:
+            yield from self.batches
+            return
+        # NEW BATCH ORDER EVERY EPOCH, REPRODUCIBLE FROM THE SEED
+        batches = list(self.batches)
+        random.Random(self.seed + self.epoch).shuffle(batches)
+        yield from batches
+
+    def __len__(self) -> int:
+        return len(self.batches)
+
+    def get_padding_ratio(self) -> float:
+        """
+        Returns the fraction of padding tokens over all batches.
+        """
+        real_tokens = sum(self.lengths)
+        padded_tokens = sum(max(self.lengths[index] for index in batch) * len(batch) for batch in self.batches)
+        return 1 - real_tokens / padded_tokens if padded_tokens else 0.0
+
+
+if __name__ == '__main__':
+    ##############################
+    # USE BELOW CODE FOR TESTING #
+    ##############################
+    generator = random.Random(0)
+    lengths = [generator.randint(300, 4500) for _ in range(2000)]
+    batch_sampler = TokenBudgetBatchSampler(lengths=lengths, max_tokens=9000)
+    batches = list(batch_sampler)
+    assert sorted(index for batch in batches for index in batch) == list(range(len(lengths)))
+    assert all(max(lengths[index] for index in batch) * len(batch) <= 9000 or len(batch) == 1 for batch in batches)
+    print(f"{len(batches)} batches, {batch_sampler.get_padding_ratio():.1%} padding")
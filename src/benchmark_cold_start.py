@@ -0,0 +1,129 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+from datetime import datetime
+from typing import List
+from benchmark_extraction import get_percentile
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "evaluate_resume.py")
+
+# MODULES OF THE INFERENCE PATH AND THE HEAVY LIBRARIES THEY MUST NOT IMPORT UP FRONT
+INFERENCE_MODULES = ['models', 'preprocessing', 'predict_scores', 'evaluation_service']
+HEAVY_LIBRARIES = ['torch', 'cv2', 'pytesseract', 'pymupdf4llm', 'pdf2image', 'docx', 'pandas']
+
+
+def measure_import(module: str) -> dict:
+    """
+    Imports the module in a fresh interpreter and returns the import time and the heavy libraries it loaded.
+    """
+    code = (
+        "import sys, time, json\n"
+        "start_time = time.perf_counter()\n"
+        f"import {module}\n"
+        "print(json.dumps({'import_time': time.perf_counter() - start_time, "
+        f"'heavy_libraries': [name for name in {HEAVY_LIBRARIES!r} if name in sys.modules]}}))\n"
+    )
+    process = subprocess.run(
+        [sys.executable, "-c", code], cwd=os.path.dirname(SCRIPT_PATH), capture_output=True, text=True
+    )
+    if process.returncode != 0:
+        return {'error': process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "Import failed!"}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def run_evaluation(resume: str, jd: str, mode: str, service_url: str) -> dict:
+    """
+    Runs evaluate_resume.py once in a fresh process and returns its timings along with the wall time
+    seen from outside (which includes interpreter startup).
+    """
+    command = [sys.executable, SCRIPT_PATH, resume, jd, '--json', '--service-url', service_url]
+    if mode == 'local':
+        command.append('--local')
+    start_time = time.perf_counter()
+    process = subprocess.run(command, cwd=os.path.dirname(SCRIPT_PATH), capture_output=True, text=True)
+    wall_time = time.perf_counter() - start_time
+    if process.returncode != 0:
+        return {'wall_time': wall_time, 'error': process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "Evaluation failed!"}
+    # THE JSON RESULT IS THE LAST LINE (MODEL LOADING AND EXTRACTION PRINT PROGRESS BEFORE IT)
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    if result['mode'] != mode:
+        return {'wall_time': wall_time, 'error': f"Expected the {mode} path but the {result['mode']} path was used!"}
+    return {'wall_time': wall_time, 'timings': result['timings'], 'error': None}
+
+
+def summarise_runs(runs: List[dict]) -> dict:
+    """
+    Returns the first (coldest) and median wall times and the mean time of every stage.
+    """
+    successful_runs = [run for run in runs if run['error'] is None]
+    wall_times = [run['wall_time'] for run in successful_runs]
+    stages = sorted({stage for run in successful_runs for stage in run['timings']})
+    return {
+        'runs': len(runs),
+        'failed': len(runs) - len(successful_runs),
+        'first_wall_time': wall_times[0] if wall_times else None,
+        'wall_time_p50': get_percentile(wall_times, 50),
+        'mean_stage_timings': {
+            stage: sum(run['timings'].get(stage, 0.0) for run in successful_runs) / len(successful_runs)
+            for stage in stages
+        }
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks the cold-start time of a single resume evaluation.")
+    parser.add_argument('resume', help="Resume file (PDF/Docx/Image) or text.")
+    parser.add_argument('jd', help="JD file or text.")
+    parser.add_argument('--runs', type=int, default=3, help="Evaluations per mode (each in a fresh process).")
+    parser.add_argument('--service-url', default="http://localhost:8080", help="URL of a running evaluation service.")
+    parser.add_argument('--output', default="cold_start_benchmark.json", help="Machine-readable results (JSON).")
+    args = parser.parse_args()
+
+    from evaluate_resume import is_service_available
+
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'imports': {module: measure_import(module=module) for module in INFERENCE_MODULES},
+        'runs': {},
+        'summary': {}
+    }
+    for module, result in report['imports'].items():
+        if 'error' in result:
+            print(f"import {module}: {result['error']}")
+        else:
+            heavy_libraries = ", ".join(result['heavy_libraries']) or "none"
+            print(f"import {module}: {result['import_time']:.3f}s (heavy libraries loaded: {heavy_libraries})")
+
+    modes = ['local']
+    if is_service_available(service_url=args.service_url):
+        modes.append('service')
+    else:
+        print(f"No evaluation service running at {args.service_url}, only the local path is benchmarked.")
+
+    # THE FIRST LOCAL RUN READS THE WEIGHTS FROM DISK, LATER RUNS FIND THEM IN THE OS PAGE CACHE (MEMORY-MAPPED)
+    for mode in modes:
+        print(f"Benchmarking {args.runs} evaluations through the {mode} path...")
+        report['runs'][mode] = [
+            run_evaluation(resume=args.resume, jd=args.jd, mode=mode, service_url=args.service_url) for _ in range(args.runs)
+        ]
+        report['summary'][mode] = summarise_runs(runs=report['runs'][mode])
+
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=4)
+
+    for mode, summary in report['summary'].items():
+        if summary['first_wall_time'] is None:
+            print(f"{mode}: all {summary['runs']} runs failed ({report['runs'][mode][0]['error']})")
+            continue
+        print(f"{mode}: first run {summary['first_wall_time']:.2f}s, p50 {summary['wall_time_p50']:.2f}s "
+              f"({summary['failed']} of {summary['runs']} runs failed)")
+        for stage, timing in summary['mean_stage_timings'].items():
+            print(f"    {stage}: {timing:.3f}s")
+    print(f"Results saved to {args.output}")
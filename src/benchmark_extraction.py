@@ -0,0 +1,241 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import platform
+import multiprocessing
+import resource
+import difflib
+from datetime import datetime
+from typing import Dict, List
+from concurrent.futures import ProcessPoolExecutor
+from preprocessing import Preprocessor
+from ocr import get_ocr_engine
+
+# OCR SETTINGS COMPARED BY --ocr (ON TOP OF THE TARGET DPI)
+OCR_MODES = {
+    'default': {},
+    'fast': {'fast': True},
+    'psm6': {'psm': 6},
+    'lstm': {'oem': 1}
+}
+
+
+def get_percentile(values: List[float], percentile: float) -> float:
+    """
+    Returns the given percentile (0-100) of the values using linear interpolation.
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    position = (len(values) - 1) * percentile / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def benchmark_files(filepaths: List[str], repeat: int) -> dict:
+    """
+    Extracts the text of every given file 'repeat' times and returns per-file latencies and stage
+    timings. Meant to run in a freshly spawned process, so that the peak RSS belongs to this group of files only.
+    """
+    preprocessor = Preprocessor()
+    results = []
+    start_time = time.perf_counter()
+    for filepath in filepaths:
+        for _ in range(repeat):
+            result = {'filename': os.path.basename(filepath)}
+            file_start_time = time.perf_counter()
+            try:
+                text = preprocessor(input_str=filepath)
+                result.update({
+                    'method': preprocessor.extraction_method,
+                    'page_count': preprocessor.page_count,
+                    'characters': len(text),
+                    'error': None
+                })
+            except Exception as e:
+                result['error'] = str(e)
+            result['latency'] = time.perf_counter() - file_start_time
+            result['stage_timings'] = dict(preprocessor.stage_timings)
+            results.append(result)
+    return {
+        'results': results,
+        'wall_time': time.perf_counter() - start_time,
+        # KILOBYTES ON LINUX, BYTES ON MACOS
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+    }
+
+
+def summarise_group(group: dict) -> dict:
+    """
+    Returns files/sec, latency percentiles, mean stage timings and peak RSS for a group of files.
+    """
+    results = group['results']
+    latencies = [result['latency'] for result in results]
+    stages = sorted({stage for result in results for stage in result['stage_timings']})
+    return {
+        'files': len(results),
+        'failed': sum(1 for result in results if result['error'] is not None),
+        'files_per_sec': len(results) / group['wall_time'] if group['wall_time'] > 0 else 0.0,
+        'latency_p50': get_percentile(latencies, 50),
+        'latency_p95': get_percentile(latencies, 95),
+        'mean_stage_timings': {
+            stage: sum(result['stage_timings'].get(stage, 0.0) for result in results) / len(results)
+            for stage in stages
+        },
+        'peak_rss_mb': group['peak_rss_mb']
+    }
+
+
+def get_word_accuracy(reference: str, text: str) -> float:
+    """
+    Returns the similarity (0-1) of the word sequences of the OCR text and the reference text
+    (lower-cased, markdown and punctuation removed): 2 x matching words / total words.
+    """
+    reference_words = re.findall(r'\w+', reference.lower())
+    words = re.findall(r'\w+', text.lower())
+    if not reference_words and not words:
+        return 1.0
+    return difflib.SequenceMatcher(None, reference_words, words, autojunk=False).ratio()
+
+
+def benchmark_ocr(filepaths: List[str], modes: List[str], dpi: int, max_pages: int) -> dict:
+    """
+    Rasterizes the PDF pages that have a text layer (up to 'max_pages' per file) and OCRs them with
+    every OCR mode. The text layer is the reference for the accuracy. Meant to run in a freshly
+    spawned process, like benchmark_files.
+    """
+    import pdf2image
+    import pymupdf4llm
+
+    results = []
+    for filepath in filepaths:
+        page_chunks = pymupdf4llm.to_markdown(doc=filepath, page_chunks=True)
+        for page_no, page_chunk in enumerate(page_chunks[:max_pages]):
+            if len(page_chunk['text'].strip()) < 50:
+                continue
+            page_image = pdf2image.convert_from_path(
+                pdf_path=filepath, dpi=dpi, first_page=page_no + 1, last_page=page_no + 1, grayscale=True
+            )[0]
+            for mode in modes:
+                ocr_engine = get_ocr_engine(target_dpi=dpi, **OCR_MODES[mode])
+                start_time = time.perf_counter()
+                text = ocr_engine.page_to_text(page_image=page_image, source_dpi=dpi)
+                results.append({
+                    'filename': os.path.basename(filepath),
+                    'page_no': page_no + 1,
+                    'mode': mode,
+                    'backend': ocr_engine.backend,
+                    'latency': time.perf_counter() - start_time,
+                    'word_accuracy': get_word_accuracy(reference=page_chunk['text'], text=text)
+                })
+    return {'results': results}
+
+
+def summarise_ocr(results: List[dict]) -> Dict[str, dict]:
+    """
+    Returns the latency percentiles and mean word accuracy of every OCR mode.
+    """
+    summary = {}
+    for mode in sorted({result['mode'] for result in results}):
+        mode_results = [result for result in results if result['mode'] == mode]
+        latencies = [result['latency'] for result in mode_results]
+        summary[mode] = {
+            'pages': len(mode_results),
+            'backend': mode_results[0]['backend'],
+            'latency_p50': get_percentile(latencies, 50),
+            'latency_p95': get_percentile(latencies, 95),
+            'mean_word_accuracy': sum(result['word_accuracy'] for result in mode_results) / len(mode_results)
+        }
+    return summary
+
+
+def compare_with_baseline(summary: Dict[str, dict], baseline_path: str, tolerance: float) -> List[str]:
+    """
+    Returns the regressions (p50/p95 latency or files/sec worse than the baseline by more
+    than 'tolerance') for every file type present in both reports.
+    """
+    with open(baseline_path, 'r') as file:
+        baseline_summary = json.load(file)['summary']
+    regressions = []
+    for file_type, current in summary.items():
+        baseline = baseline_summary.get(file_type)
+        if baseline is None:
+            continue
+        for metric in ('latency_p50', 'latency_p95'):
+            if baseline[metric] > 0 and current[metric] > baseline[metric] * (1 + tolerance):
+                regressions.append(f"{file_type} {metric}: {baseline[metric]:.3f}s -> {current[metric]:.3f}s")
+        if baseline['files_per_sec'] > 0 and current['files_per_sec'] < baseline['files_per_sec'] * (1 - tolerance):
+            regressions.append(
+                f"{file_type} files_per_sec: {baseline['files_per_sec']:.3f} -> {current['files_per_sec']:.3f}"
+            )
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks text extraction (per stage) over a directory of resumes.")
+    parser.add_argument('--input-dir', default=os.path.join(os.path.dirname(__file__), '..', 'data', 'resumes'))
+    parser.add_argument('--output', default="extraction_benchmark.json", help="Machine-readable results (JSON).")
+    parser.add_argument('--repeat', type=int, default=1, help="Number of times every file is extracted.")
+    parser.add_argument('--baseline', default=None, help="Previous results to check for regressions against.")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed slowdown relative to the baseline.")
+    parser.add_argument('--ocr', action='store_true', help="Also measure OCR latency and accuracy on PDF pages with a text layer.")
+    parser.add_argument('--ocr-modes', default=",".join(OCR_MODES), help="Comma-separated OCR modes to compare.")
+    parser.add_argument('--ocr-dpi', type=int, default=300, help="Resolution the pages are rasterized and OCRed at.")
+    parser.add_argument('--ocr-max-pages', type=int, default=2, help="Pages OCRed per PDF.")
+    args = parser.parse_args()
+
+    # GROUPING FILES BY TYPE (PDF/Docx/Image)
+    groups = {}
+    for filename in sorted(os.listdir(args.input_dir)):
+        filepath = os.path.join(args.input_dir, filename)
+        is_supported, file_type = Preprocessor().validate_file_type(file_path=filepath)
+        if is_supported:
+            groups.setdefault(file_type, []).append(filepath)
+
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'extractor_version': Preprocessor.EXTRACTOR_VERSION,
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'files': {},
+        'summary': {}
+    }
+    for file_type, filepaths in groups.items():
+        print(f"Benchmarking {len(filepaths)} {file_type} files...")
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            group = executor.submit(benchmark_files, filepaths, args.repeat).result()
+        report['files'][file_type] = group['results']
+        report['summary'][file_type] = summarise_group(group=group)
+
+    if args.ocr and groups.get('PDF'):
+        modes = [mode.strip() for mode in args.ocr_modes.split(",") if mode.strip()]
+        print(f"Benchmarking OCR ({', '.join(modes)}) on {len(groups['PDF'])} PDF files...")
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            ocr_group = executor.submit(benchmark_ocr, groups['PDF'], modes, args.ocr_dpi, args.ocr_max_pages).result()
+        report['ocr'] = {'dpi': args.ocr_dpi, 'pages': ocr_group['results'], 'summary': summarise_ocr(results=ocr_group['results'])}
+
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=4)
+
+    for file_type, summary in report['summary'].items():
+        print(f"{file_type}: {summary['files']} files, {summary['files_per_sec']:.2f} files/sec, "
+              f"p50 {summary['latency_p50']:.3f}s, p95 {summary['latency_p95']:.3f}s, "
+              f"peak RSS {summary['peak_rss_mb']:.1f} MB")
+        for stage, timing in summary['mean_stage_timings'].items():
+            print(f"    {stage}: {timing:.3f}s/file")
+    for mode, summary in report.get('ocr', {}).get('summary', {}).items():
+        print(f"OCR {mode} ({summary['backend']}): {summary['pages']} pages, p50 {summary['latency_p50']:.3f}s, "
+              f"p95 {summary['latency_p95']:.3f}s, word accuracy {summary['mean_word_accuracy']:.1%}")
+    print(f"Results saved to {args.output}")
+
+    if args.baseline is not None:
+        regressions = compare_with_baseline(summary=report['summary'], baseline_path=args.baseline, tolerance=args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
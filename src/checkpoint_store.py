@@ -0,0 +1,204 @@
+import os
+import json
+import sqlite3
+import pyarrow as pa
+from typing import Callable, Iterator, Optional, Set
+from dataset_io import write_records
+
+
+class CheckpointStore:
+    """
+    Base class for append-only checkpoint stores. Every record is saved against a unique key
+    so that interrupted runs can be resumed by key lookup instead of by row position.
+    """
+
+    def __init__(self, store_path: str, fsync_every: int = 50) -> None:
+        """
+        Initialises the store path and the number of writes after which data is synced to disk.
+        """
+        self.store_path = store_path
+        self.fsync_every = max(1, fsync_every)
+        self.pending_writes = 0
+        self.completed_keys = set()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.completed_keys
+
+    def __len__(self) -> int:
+        return len(self.completed_keys)
+
+    def __enter__(self) -> 'CheckpointStore':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def append(self, key: str, record: dict) -> None:
+        """
+        Appends the given record against the key. Data is synced to disk once every
+        'fsync_every' writes.
+        """
+        self.write_record(key=key, record=record)
+        self.completed_keys.add(key)
+        self.pending_writes += 1
+        if self.pending_writes >= self.fsync_every:
+            self.flush()
+
+    def write_record(self, key: str, record: dict) -> None:
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        raise NotImplementedError
+
+    def iter_records(self) -> Iterator[dict]:
+        """
+        Yields every stored record (with its 'key') in insertion order. If a key was
+        written more than once, only its latest record is returned.
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        raise NotImplementedError
+
+    def export(self, output_path: str, schema: pa.Schema, transform: Optional[Callable[[dict], dict]] = None,
+               keys: Optional[Set[str]] = None) -> None:
+        """
+        Saves all stored records (optionally transformed, and only those of 'keys' if given) with the
+        columns of the given schema as a parquet, arrow or excel file, depending on the extension of
+        the output path.
+        """
+        self.flush()
+        records = self.iter_records()
+        if keys is not None:
+            records = (record for record in records if record['key'] in keys)
+        write_records(path=output_path, records=records, schema=schema, transform=transform)
+
+
+class JSONLCheckpointStore(CheckpointStore):
+    """
+    Checkpoint store that appends one JSON line per record.
+    """
+
+    def __init__(self, store_path: str, fsync_every: int = 50) -> None:
+        """
+        Loads already completed keys (if any) and opens the file in append mode (after repairing
+        a partially written last line).
+        """
+        super().__init__(store_path=store_path, fsync_every=fsync_every)
+        self.repair_last_line()
+        for record in self.iter_records():
+            self.completed_keys.add(record['key'])
+        self.file = open(self.store_path, 'a', encoding='utf-8')
+
+    def repair_last_line(self) -> None:
+        """
+        Truncates a partially written last line left by an interrupted run, so that the next record
+        does not get appended to it (a complete record only missing its line break is kept).
+        """
+        if not os.path.exists(self.store_path):
+            return
+        with open(self.store_path, 'rb+') as file:
+            file_size = file.seek(0, os.SEEK_END)
+            if file_size == 0:
+                return
+            file.seek(file_size - 1)
+            if file.read(1) == b"\n":
+                return
+            # SEARCHING BACKWARDS FOR THE END OF THE LAST COMPLETE LINE
+            line_start = file_size
+            while line_start > 0:
+                chunk_start = max(0, line_start - 65536)
+                file.seek(chunk_start)
+                newline_position = file.read(line_start - chunk_start).rfind(b"\n")
+                if newline_position != -1:
+                    line_start = chunk_start + newline_position + 1
+                    break
+                line_start = chunk_start
+            file.seek(line_start)
+            try:
+                json.loads(file.read().decode('utf-8'))
+                file.write(b"\n")
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                print(f"Removing a partially written record from {self.store_path}...")
+                file.truncate(line_start)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def write_record(self, key: str, record: dict) -> None:
+        self.file.write(json.dumps({'key': key, **record}, ensure_ascii=False) + "\n")
+
+    def flush(self) -> None:
+        if self.file.closed:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending_writes = 0
+
+    def iter_records(self) -> Iterator[dict]:
+        if not os.path.exists(self.store_path):
+            return
+        records = {}
+        with open(self.store_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # PARTIALLY WRITTEN LINE FROM AN INTERRUPTED RUN
+                    continue
+                records.pop(record['key'], None)
+                records[record['key']] = record
+        yield from records.values()
+
+    def close(self) -> None:
+        self.flush()
+        self.file.close()
+
+
+class SQLiteCheckpointStore(CheckpointStore):
+    """
+    Checkpoint store backed by a SQLite table with one row per key.
+    """
+
+    def __init__(self, store_path: str, fsync_every: int = 50) -> None:
+        """
+        Opens (or creates) the database and loads already completed keys (if any).
+        """
+        super().__init__(store_path=store_path, fsync_every=fsync_every)
+        self.connection = sqlite3.connect(self.store_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=FULL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS records (key TEXT PRIMARY KEY, record TEXT NOT NULL)"
+        )
+        self.connection.commit()
+        self.completed_keys = {key for (key,) in self.connection.execute("SELECT key FROM records")}
+
+    def write_record(self, key: str, record: dict) -> None:
+        self.connection.execute(
+            "INSERT OR REPLACE INTO records (key, record) VALUES (?, ?)",
+            (key, json.dumps(record, ensure_ascii=False))
+        )
+
+    def flush(self) -> None:
+        self.connection.commit()
+        self.pending_writes = 0
+
+    def iter_records(self) -> Iterator[dict]:
+        for key, record in self.connection.execute("SELECT key, record FROM records ORDER BY rowid"):
+            yield {'key': key, **json.loads(record)}
+
+    def close(self) -> None:
+        self.flush()
+        self.connection.close()
+
+
+def get_checkpoint_store(store_path: str, fsync_every: int = 50) -> CheckpointStore:
+    """
+    Returns the checkpoint store relevant to the extension of the given path (.jsonl or .sqlite/.db).
+    """
+    _, extension = os.path.splitext(store_path.lower())
+    if extension == '.jsonl':
+        return JSONLCheckpointStore(store_path=store_path, fsync_every=fsync_every)
+    if extension in ('.sqlite', '.db'):
+        return SQLiteCheckpointStore(store_path=store_path, fsync_every=fsync_every)
+    raise ValueError(f"Unsupported checkpoint store format: {extension}!")
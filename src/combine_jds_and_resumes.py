@@ -1,4 +1,9 @@
-import pandas as pd
+import os
+import json
+from typing import Iterator, Optional, Tuple
+from utils import get_json_data, get_text_hash, get_pair_key
+from near_duplicates import NearDuplicateDetector, DuplicateMapping
+from dataset_io import PAIR_SCHEMA, read_dataframe, write_records
 
 
 class JDResumeCombiner:
@@ -6,48 +11,155 @@ class JDResumeCombiner:
     Class for handling the combining of all resumes and JDs to form the dataset.
     """
 
-    def __init__(self, jd_excel_filepath: str, resume_excel_filepath: str, output_store_path: str) -> None:
+    def __init__(self, jd_excel_filepath: str, resume_excel_filepath: str, output_store_path: str,
+                 dedup_threshold: Optional[float] = None) -> None:
         """
         Initialises the JDs, Resumes and relevant directories.
+
+        The JD and resume files can be parquet, arrow or excel files. If the output store path is a
+        .json file, a pair index (every JD and resume stored once) is saved instead of the full
+        JD-Resume cross-product (written as parquet, arrow or excel).
+
+        If 'dedup_threshold' is provided, near-duplicate JDs and resumes (estimated Jaccard similarity
+        of their word shingles above the threshold) are left out of the pair index, keeping one
+        representative each. The duplicate -> representative mapping is saved next to the pair
+        index ('<name>.duplicates.json'), and DatasetCompleterAutomatic uses it to propagate the
+        labels back to the duplicates when exporting.
         """
         self.jd_excel_filepath = jd_excel_filepath
         self.resume_excel_filepath = resume_excel_filepath
 
-        self.jds = pd.read_excel(self.jd_excel_filepath).to_dict()
-        self.resumes = pd.read_excel(self.resume_excel_filepath).to_dict()
+        self.jds = read_dataframe(path=self.jd_excel_filepath, columns=['Job Description']).to_dict()
+        self.resumes = read_dataframe(path=self.resume_excel_filepath, columns=['Resume']).to_dict()
 
-        self.output_dict = {
-            'JD': [],
-            'Resume': []
-        }
         self.output_store_path = output_store_path
+        self.dedup_threshold = dedup_threshold
+
+    def save_pairs(self) -> None:
+        """
+        Streams every JD-Resume combination (one row each) to the output store path.
+        """
+        pairs = (
+            {'JD': jd, 'Resume': resume}
+            for jd in self.jds['Job Description'].values()
+            for resume in self.resumes['Resume'].values()
+        )
+        write_records(path=self.output_store_path, records=pairs, schema=PAIR_SCHEMA)
 
-    def save_current_output_dict(self) -> None:
+    def save_pair_index(self) -> None:
         """
-        Saves current version of the output as an excel file in the provided directory.
+        Saves every unique JD and resume once against its content hash ID as a JSON pair index.
         """
-        output_df = pd.DataFrame(self.output_dict)
-        output_df.to_excel(self.output_store_path, index=False)
+        pair_index = {
+            'jds': {get_text_hash(jd): jd for jd in self.jds['Job Description'].values()},
+            'resumes': {get_text_hash(resume): resume for resume in self.resumes['Resume'].values()}
+        }
+        if self.dedup_threshold is not None:
+            self.remove_near_duplicates(pair_index=pair_index)
+        with open(self.output_store_path, 'w', encoding='utf-8') as file:
+            json.dump(pair_index, file, ensure_ascii=False)
+        print(f"Saved pair index with {len(pair_index['jds'])} JDs and {len(pair_index['resumes'])} resumes.")
+
+    def remove_near_duplicates(self, pair_index: dict) -> None:
+        """
+        Keeps only the representative of every near-duplicate cluster of JDs and resumes in the pair
+        index and saves the duplicate -> representative mapping.
+        """
+        detector = NearDuplicateDetector(threshold=self.dedup_threshold)
+        jd_representatives = detector(documents=pair_index['jds'])
+        resume_representatives = detector(documents=pair_index['resumes'])
+        DuplicateMapping.save(
+            mapping_path=DuplicateMapping.get_mapping_path(pair_index_path=self.output_store_path),
+            threshold=self.dedup_threshold,
+            jd_representatives=jd_representatives,
+            resume_representatives=resume_representatives,
+            jds=pair_index['jds'],
+            resumes=pair_index['resumes']
+        )
+
+        for document_type, representatives in (('jds', jd_representatives), ('resumes', resume_representatives)):
+            n_documents = len(pair_index[document_type])
+            pair_index[document_type] = {
+                doc_id: text for doc_id, text in pair_index[document_type].items() if representatives[doc_id] == doc_id
+            }
+            print(f"Removed {n_documents - len(pair_index[document_type])} near-duplicate {document_type} "
+                  f"out of {n_documents}.")
 
     def __call__(self) -> None:
         """
-        Combines every JD-Resume combination as one row and finally stores everything 
-        in an excel file.
+        Combines every JD-Resume combination as one row and stores everything in a dataset
+        file (or saves a pair index to generate the combinations lazily).
+        """
+        if os.path.splitext(self.output_store_path.lower())[1] == '.json':
+            self.save_pair_index()
+            return
+
+        self.save_pairs()
+
+
+class PairIndex:
+    """
+    Class for lazily generating JD-Resume pairs from a pair index saved by JDResumeCombiner.
+    """
+
+    def __init__(self, index_path: str) -> None:
+        """
+        Loads the JDs and resumes (content hash ID -> text) from the given pair index. If the index
+        contains an explicit list of selected 'pairs', only those are generated instead of every combination.
+        """
+        pair_index = get_json_data(filepath=index_path)
+        self.jds = pair_index['jds']
+        self.resumes = pair_index['resumes']
+        self.pairs = pair_index.get('pairs')
+
+    def __len__(self) -> int:
+        if self.pairs is not None:
+            return len(self.pairs)
+        return len(self.jds) * len(self.resumes)
+
+    def iter_all_pairs(self) -> Iterator[Tuple[str, str]]:
+        """
+        Yields (jd_id, resume_id) for the selected pairs or (by default) for every JD-Resume combination.
+        """
+        if self.pairs is not None:
+            for jd_id, resume_id in self.pairs:
+                yield jd_id, resume_id
+            return
+        for jd_id in self.jds:
+            for resume_id in self.resumes:
+                yield jd_id, resume_id
+
+    @staticmethod
+    def get_hash_fraction(text: str) -> float:
+        """
+        Maps the given text to a deterministic value in [0, 1).
+        """
+        return int(get_text_hash(text)[:15], 16) / 16 ** 15
+
+    def iter_pairs(self, shard_index: int = 0, num_shards: int = 1, sample_fraction: float = 1.0,
+                   seed: int = 0) -> Iterator[Tuple[str, str]]:
+        """
+        Yields (jd_id, resume_id) for every pair of the shard. If 'sample_fraction' is below 1,
+        only a deterministic (seeded) sample of the pairs is yielded. Shard membership and sampling
+        depend only on the pair key, so they stay stable when documents are added.
         """
-        for jd in self.jds['Job Description'].values():
-            for resume in self.resumes['Resume'].values():
-                self.output_dict['JD'].append(jd)
-                self.output_dict['Resume'].append(resume)
-        self.save_current_output_dict()
+        for jd_id, resume_id in self.iter_all_pairs():
+            pair_key = get_pair_key(jd_id=jd_id, resume_id=resume_id)
+            if num_shards > 1 and int(pair_key[:15], 16) % num_shards != shard_index:
+                continue
+            if sample_fraction < 1.0 and self.get_hash_fraction(f"{seed}:{pair_key}") >= sample_fraction:
+                continue
+            yield jd_id, resume_id
 
 
 if __name__ == '__main__':
     JD_EXCEL_FILEPATH = "/home/om/code/Resume-Evaluator/data/JDs.xlsx"
     RESUME_EXCEL_FILEPATH = "/home/om/code/Resume-Evaluator/data/resumes.xlsx"
-    OUTPUT_STORE_PATH = "dataset_without_labels.xlsx"
+    OUTPUT_STORE_PATH = "pair_index.json"
     combiner = JDResumeCombiner(
         jd_excel_filepath=JD_EXCEL_FILEPATH,
         resume_excel_filepath=RESUME_EXCEL_FILEPATH,
-        output_store_path=OUTPUT_STORE_PATH
+        output_store_path=OUTPUT_STORE_PATH,
+        dedup_threshold=0.8
     )
-    combiner()
\ No newline at end of file
+    combiner()
@@ -0,0 +1,295 @@
+import os
+import re
+import json
+import pyarrow as pa
+import pyarrow.parquet as pq
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, List, Optional, Union
+from prompts import get_label_generation_output_schema
+
+# pyarrow.dataset AND pandas ARE SLOW TO IMPORT, SO THEY ARE ONLY IMPORTED WHEN USED
+if TYPE_CHECKING:
+    import pandas as pd
+    import pyarrow.dataset as ds
+
+# EXPRESSION (E.G. ds.field('jd_id') == jd_id) OR DNF LIST OF (COLUMN, OPERATOR, VALUE) TUPLES
+Filter = Union['ds.Expression', list, None]
+
+
+def get_dataset_format(path: str) -> str:
+    """
+    Returns the dataset format ('parquet', 'arrow' or 'excel') for the extension of the given path.
+    """
+    extension = os.path.splitext(path.lower())[1]
+    if extension == '.parquet':
+        return 'parquet'
+    if extension in ('.arrow', '.feather'):
+        return 'arrow'
+    if extension == '.xlsx':
+        return 'excel'
+    raise ValueError(f"Unsupported dataset format: {extension}!")
+
+
+def json_schema_to_arrow_type(schema: dict) -> pa.DataType:
+    """
+    Returns the arrow type for a JSON schema (objects become structs, arrays become lists and
+    values that can have several types are stored as strings).
+    """
+    schema_type = schema.get('type')
+    if schema_type == 'object':
+        return pa.struct([
+            pa.field(name, json_schema_to_arrow_type(schema=property_schema))
+            for name, property_schema in schema['properties'].items()
+        ])
+    if schema_type == 'array':
+        return pa.list_(json_schema_to_arrow_type(schema=schema['items']))
+    if schema_type == 'integer':
+        return pa.int32()
+    if schema_type == 'number':
+        return pa.float64()
+    if schema_type == 'boolean':
+        return pa.bool_()
+    return pa.string()
+
+
+PARSED_RESPONSE_TYPE = json_schema_to_arrow_type(schema=get_label_generation_output_schema())
+
+EXTRACTED_TEXT_SCHEMA = pa.schema([
+    pa.field('filename', pa.string()),
+    pa.field('text', pa.string())
+])
+
+PAIR_SCHEMA = pa.schema([
+    pa.field('JD', pa.string()),
+    pa.field('Resume', pa.string())
+])
+
+LABELED_PAIR_SCHEMA = pa.schema([
+    pa.field('JD', pa.string()),
+    pa.field('Resume', pa.string()),
+    pa.field('Response', pa.string()),
+    pa.field('jd_id', pa.string()),
+    pa.field('resume_id', pa.string()),
+    pa.field('parsed_response', PARSED_RESPONSE_TYPE)
+])
+
+
+def conform_value(value, arrow_type: pa.DataType):
+    """
+    Converts a parsed JSON value to the given arrow type. Values that cannot be converted become None.
+    """
+    if value is None:
+        return None
+    try:
+        if pa.types.is_struct(arrow_type):
+            if not isinstance(value, dict):
+                return None
+            return {
+                arrow_type.field(i).name: conform_value(value.get(arrow_type.field(i).name), arrow_type.field(i).type)
+                for i in range(arrow_type.num_fields)
+            }
+        if pa.types.is_list(arrow_type):
+            if not isinstance(value, list):
+                return None
+            return [conform_value(item, arrow_type.value_type) for item in value]
+        if pa.types.is_integer(arrow_type):
+            return int(value)
+        if pa.types.is_floating(arrow_type):
+            return float(value)
+        if pa.types.is_boolean(arrow_type):
+            return bool(value)
+        return value if isinstance(value, str) else json.dumps(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_response(response: Optional[str]) -> Optional[dict]:
+    """
+    Parses a model response into the parsed-response struct (None if it is not valid JSON).
+    """
+    try:
+        return conform_value(json.loads(response), PARSED_RESPONSE_TYPE)
+    except (TypeError, ValueError):
+        return None
+
+
+def remove_illegal_excel_chars(value):
+    """
+    Removes the control characters openpyxl refuses to write, while preserving newlines.
+    """
+    if isinstance(value, str):
+        return re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', value)  # Excludes \n (\x0A) and \r (\x0D)
+    return value
+
+
+def read_excel_table(path: str) -> pa.Table:
+    """
+    Loads an excel file as an arrow table. pandas is only imported for excel files.
+    """
+    import pandas as pd
+
+    return pa.Table.from_pandas(pd.read_excel(path), preserve_index=False)
+
+
+def get_filter_expression(filters: Filter) -> Optional['ds.Expression']:
+    import pyarrow.dataset as ds
+
+    if filters is None or isinstance(filters, ds.Expression):
+        return filters
+    return pq.filters_to_expression(filters)
+
+
+def open_dataset(path: str) -> 'ds.Dataset':
+    """
+    Opens a parquet or arrow (IPC) file as a pyarrow dataset (excel files are loaded in memory).
+    """
+    import pyarrow.dataset as ds
+
+    dataset_format = get_dataset_format(path=path)
+    if dataset_format == 'excel':
+        return ds.dataset(read_excel_table(path=path))
+    return ds.dataset(path, format='parquet' if dataset_format == 'parquet' else 'ipc')
+
+
+def count_rows(path: str, filters: Filter = None) -> int:
+    """
+    Returns the number of rows of the dataset (matching the filters). Parquet files answer this from their metadata.
+    """
+    return open_dataset(path=path).count_rows(filter=get_filter_expression(filters=filters))
+
+
+def iter_batches(path: str, columns: Optional[List[str]] = None, filters: Filter = None,
+                 batch_size: int = 10000) -> Iterator[pa.RecordBatch]:
+    """
+    Streams the dataset in record batches. Only the requested columns are read, and row groups
+    whose statistics rule out the filters are skipped without being read (predicate pushdown).
+    """
+    yield from open_dataset(path=path).to_batches(
+        columns=columns, filter=get_filter_expression(filters=filters), batch_size=batch_size
+    )
+
+
+def iter_records(path: str, columns: Optional[List[str]] = None, filters: Filter = None,
+                 batch_size: int = 10000) -> Iterator[dict]:
+    """
+    Streams the dataset row by row (as dicts).
+    """
+    for batch in iter_batches(path=path, columns=columns, filters=filters, batch_size=batch_size):
+        yield from batch.to_pylist()
+
+
+def read_table(path: str, columns: Optional[List[str]] = None, filters: Filter = None) -> pa.Table:
+    """
+    Reads the whole dataset (or the requested columns and matching rows). Parquet and arrow files
+    are memory-mapped, so arrow files are read without copying.
+    """
+    dataset_format = get_dataset_format(path=path)
+    if dataset_format == 'parquet':
+        return pq.read_table(path, columns=columns, filters=get_filter_expression(filters=filters), memory_map=True)
+    if dataset_format == 'arrow':
+        table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    else:
+        table = read_excel_table(path=path)
+    if filters is not None:
+        table = table.filter(get_filter_expression(filters=filters))
+    return table.select(columns) if columns is not None else table
+
+
+def read_dataframe(path: str, columns: Optional[List[str]] = None, filters: Filter = None) -> 'pd.DataFrame':
+    return read_table(path=path, columns=columns, filters=filters).to_pandas()
+
+
+class DatasetWriter:
+    """
+    Writes records to a parquet or arrow file in chunks, so that memory use stays bounded
+    (every chunk becomes one row group / record batch). Excel files are written once on close.
+    """
+
+    def __init__(self, path: str, schema: pa.Schema, row_group_size: int = 10000) -> None:
+        """
+        Opens the output file for the given schema.
+        """
+        self.path = path
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self.format = get_dataset_format(path=path)
+        self.pending_records = []
+        self.excel_tables = []
+        # THE TEMPORARY FILE KEEPS THE EXTENSION (REQUIRED BY THE EXCEL WRITER)
+        self.temp_path = "{0}.tmp{1}".format(*os.path.splitext(path))
+        if self.format == 'parquet':
+            self.writer = pq.ParquetWriter(self.temp_path, schema=schema, compression='zstd')
+        elif self.format == 'arrow':
+            self.sink = pa.OSFile(self.temp_path, 'wb')
+            self.writer = pa.ipc.new_file(self.sink, schema=schema)
+        else:
+            self.writer = None
+
+    def __enter__(self) -> 'DatasetWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is not None:
+            self.abort()
+            return
+        self.close()
+
+    def write(self, record: dict) -> None:
+        self.pending_records.append(record)
+        if len(self.pending_records) >= self.row_group_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes the pending records as one row group (or record batch).
+        """
+        if not self.pending_records:
+            return
+        table = pa.Table.from_pylist(self.pending_records, schema=self.schema)
+        self.pending_records = []
+        if self.writer is not None:
+            self.writer.write_table(table)
+        else:
+            self.excel_tables.append(table)
+
+    def close(self) -> None:
+        """
+        Writes the remaining records and moves the finished file into place.
+        """
+        self.flush()
+        if self.format == 'excel':
+            table = pa.concat_tables(self.excel_tables) if self.excel_tables else self.schema.empty_table()
+            # NESTED COLUMNS ARE NOT SUPPORTED BY EXCEL
+            flat_columns = [field.name for field in self.schema if not pa.types.is_nested(field.type)]
+            output_df = table.select(flat_columns).to_pandas()
+            for column in output_df.columns:
+                output_df[column] = output_df[column].map(remove_illegal_excel_chars)
+            output_df.to_excel(self.temp_path, index=False, engine='openpyxl')
+        else:
+            self.writer.close()
+            if self.format == 'arrow':
+                self.sink.close()
+        os.replace(self.temp_path, self.path)
+
+    def abort(self) -> None:
+        """
+        Closes the output without moving it into place and deletes the temporary file, so that
+        the previous output (if any) is kept.
+        """
+        try:
+            if self.writer is not None:
+                self.writer.close()
+            if self.format == 'arrow':
+                self.sink.close()
+        finally:
+            if os.path.exists(self.temp_path):
+                os.remove(self.temp_path)
+
+
+def write_records(path: str, records: Iterable[dict], schema: pa.Schema,
+                  transform: Optional[Callable[[dict], dict]] = None, row_group_size: int = 10000) -> None:
+    """
+    Writes the records (optionally transformed one by one) to the given path. The format follows the extension.
+    """
+    with DatasetWriter(path=path, schema=schema, row_group_size=row_group_size) as writer:
+        for record in records:
+            writer.write(transform(record) if transform is not None else record)
@@ -0,0 +1,190 @@
+import os
+import json
+import numpy as np
+from typing import Dict, List, Tuple
+from sentence_transformers import SentenceTransformer
+from combine_jds_and_resumes import PairIndex
+from utils import get_json_data
+
+
+class EmbeddingStore:
+    """
+    Class for caching document embeddings on disk. Vectors are kept in a memory-mapped .npy
+    file and their document IDs (content hashes) in a JSON file next to it.
+    """
+
+    def __init__(self, store_dir: str, model_name: str) -> None:
+        """
+        Loads the existing embeddings (if any) for the given model.
+        """
+        self.store_dir = store_dir
+        self.model_name = model_name
+        self.embeddings_path = os.path.join(store_dir, "embeddings.npy")
+        self.ids_path = os.path.join(store_dir, "ids.json")
+        os.makedirs(self.store_dir, exist_ok=True)
+
+        self.ids = []
+        self.embeddings = None
+        if os.path.exists(self.ids_path):
+            metadata = get_json_data(filepath=self.ids_path)
+            if metadata['model_name'] != self.model_name:
+                raise ValueError(f"Embedding store at {self.store_dir} was created with {metadata['model_name']}!")
+            self.ids = metadata['ids']
+            self.embeddings = np.load(self.embeddings_path, mmap_mode='r')
+        self.id_to_row = {doc_id: row for row, doc_id in enumerate(self.ids)}
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.id_to_row
+
+    def add(self, ids: List[str], embeddings: np.ndarray) -> None:
+        """
+        Appends the given embeddings to the store.
+        """
+        n_existing = len(self.ids)
+        temp_path = f"{self.embeddings_path}.tmp"
+        combined = np.lib.format.open_memmap(
+            temp_path, mode='w+', dtype=np.float32, shape=(n_existing + len(ids), embeddings.shape[1])
+        )
+        if n_existing > 0:
+            combined[:n_existing] = self.embeddings
+        combined[n_existing:] = embeddings
+        combined.flush()
+        del combined
+        os.replace(temp_path, self.embeddings_path)
+
+        self.ids = self.ids + list(ids)
+        with open(self.ids_path, 'w') as file:
+            json.dump({'model_name': self.model_name, 'ids': self.ids}, file)
+        self.embeddings = np.load(self.embeddings_path, mmap_mode='r')
+        self.id_to_row = {doc_id: row for row, doc_id in enumerate(self.ids)}
+
+    def get(self, ids: List[str]) -> np.ndarray:
+        """
+        Returns the embeddings of the given document IDs as a matrix (one row per ID).
+        """
+        return np.asarray(self.embeddings[[self.id_to_row[doc_id] for doc_id in ids]])
+
+
+class EmbeddingPrefilter:
+    """
+    Class for ranking and pruning the JD-Resume pairs of a pair index by embedding cosine similarity,
+    so that only the selected pairs are sent to the LLM for labeling.
+    """
+
+    def __init__(self, pair_index_path: str, embedding_store_dir: str,
+                 model_name: str = "sentence-transformers/all-MiniLM-L6-v2", batch_size: int = 32) -> None:
+        """
+        Initialises the pair index, the embedding store and the sentence-transformers model (on CPU).
+        """
+        self.pair_index_path = pair_index_path
+        self.pair_index = PairIndex(index_path=pair_index_path)
+        self.embedding_store = EmbeddingStore(store_dir=embedding_store_dir, model_name=model_name)
+        self.model = SentenceTransformer(model_name, device='cpu')
+        self.batch_size = batch_size
+
+    def encode_missing_documents(self, documents: Dict[str, str]) -> None:
+        """
+        Encodes the documents (ID -> text) that are not in the embedding store yet.
+        """
+        missing_ids = [doc_id for doc_id in documents if doc_id not in self.embedding_store]
+        if not missing_ids:
+            return
+        print(f"Encoding {len(missing_ids)} documents...")
+        embeddings = self.model.encode(
+            [str(documents[doc_id]) for doc_id in missing_ids],
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=True
+        )
+        self.embedding_store.add(ids=missing_ids, embeddings=embeddings.astype(np.float32))
+
+    def get_similarity_matrix(self) -> Tuple[List[str], List[str], np.ndarray]:
+        """
+        Returns (jd_ids, resume_ids, similarity) where similarity[i, j] is the cosine similarity
+        between JD i and resume j, computed with a single matrix multiplication.
+        """
+        self.encode_missing_documents(documents=self.pair_index.jds)
+        self.encode_missing_documents(documents=self.pair_index.resumes)
+        jd_ids = list(self.pair_index.jds)
+        resume_ids = list(self.pair_index.resumes)
+        jd_embeddings = self.embedding_store.get(ids=jd_ids)
+        resume_embeddings = self.embedding_store.get(ids=resume_ids)
+        return jd_ids, resume_ids, jd_embeddings @ resume_embeddings.T
+
+    @staticmethod
+    def select_top_k(similarity: np.ndarray, k: int) -> List[Tuple[int, int]]:
+        """
+        Selects the k most similar resumes for every JD.
+
+        Returns: [(jd_position, resume_position), ...]
+        """
+        k = min(k, similarity.shape[1])
+        top_k = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+        return [(jd_position, int(resume_position)) for jd_position, row in enumerate(top_k) for resume_position in row]
+
+    @staticmethod
+    def select_stratified(similarity: np.ndarray, pairs_per_jd: int, num_strata: int = 5,
+                          seed: int = 0) -> List[Tuple[int, int]]:
+        """
+        Selects 'pairs_per_jd' resumes for every JD evenly from 'num_strata' similarity strata (weak
+        to strong matches), so that the labeled dataset covers the whole range of match scores. The
+        remainder (and the share of strata with too few resumes) goes to randomly ordered strata.
+
+        Returns: [(jd_position, resume_position), ...]
+        """
+        rng = np.random.default_rng(seed)
+        selected = []
+        for jd_position, row in enumerate(similarity):
+            strata = np.array_split(np.argsort(row), num_strata)
+            # ONE RESUME PER STRATUM AT A TIME, SO THAT THE COUNTS DIFFER BY AT MOST ONE
+            counts = [0] * len(strata)
+            remaining = min(pairs_per_jd, len(row))
+            stratum_order = rng.permutation(len(strata))
+            while remaining > 0:
+                for stratum_no in stratum_order:
+                    if remaining > 0 and counts[stratum_no] < len(strata[stratum_no]):
+                        counts[stratum_no] += 1
+                        remaining -= 1
+            for stratum, count in zip(strata, counts):
+                chosen = rng.choice(stratum, size=count, replace=False)
+                selected.extend((jd_position, int(resume_position)) for resume_position in chosen)
+        return selected
+
+    def __call__(self, output_path: str, mode: str = 'stratified', pairs_per_jd: int = 100,
+                 num_strata: int = 5, seed: int = 0) -> None:
+        """
+        Selects the pairs ('top_k' or 'stratified' by similarity) and saves them as a new pair index
+        which can be passed to DatasetCompleterAutomatic.
+        """
+        jd_ids, resume_ids, similarity = self.get_similarity_matrix()
+
+        if mode == 'top_k':
+            selected = self.select_top_k(similarity=similarity, k=pairs_per_jd)
+        elif mode == 'stratified':
+            selected = self.select_stratified(
+                similarity=similarity, pairs_per_jd=pairs_per_jd, num_strata=num_strata, seed=seed
+            )
+        else:
+            raise ValueError(f"Unsupported selection mode: {mode}!")
+
+        pair_index = {
+            'jds': self.pair_index.jds,
+            'resumes': self.pair_index.resumes,
+            'pairs': [[jd_ids[jd_position], resume_ids[resume_position]] for jd_position, resume_position in selected],
+            'similarities': [float(similarity[jd_position, resume_position]) for jd_position, resume_position in selected]
+        }
+        with open(output_path, 'w', encoding='utf-8') as file:
+            json.dump(pair_index, file, ensure_ascii=False)
+        print(f"Selected {len(selected)} out of {similarity.size} pairs ({mode}).")
+
+
+if __name__ == '__main__':
+    PAIR_INDEX_PATH = "/home/om/code/Resume-Evaluator/data/pair_index.json"
+    EMBEDDING_STORE_DIR = "/home/om/code/Resume-Evaluator/data/embeddings"
+    OUTPUT_PATH = "filtered_pair_index.json"
+    prefilter = EmbeddingPrefilter(
+        pair_index_path=PAIR_INDEX_PATH,
+        embedding_store_dir=EMBEDDING_STORE_DIR
+    )
+    prefilter(output_path=OUTPUT_PATH, mode='stratified', pairs_per_jd=100)
@@ -0,0 +1,167 @@
+"""
+Scores a single resume against a JD from the command line.
+
+If the evaluation service (evaluation_service.py) is running, it is used as the model holder: the
+files are sent to it and the already loaded model answers right away. Otherwise (or with --local)
+the text is extracted and the model is loaded in this process, which pays the full cold start.
+
+python evaluate_resume.py resume.pdf jd.txt
+"""
+
+import time
+
+SCRIPT_START_TIME = time.perf_counter()
+
+import os
+import json
+import uuid
+import argparse
+import urllib.error
+import urllib.request
+from typing import Optional, Tuple
+
+DEFAULT_SERVICE_URL = "http://localhost:8080"
+
+
+def read_text_input(value: str) -> str:
+    """
+    Returns the content of .txt files (plain text is passed as is, other files are extracted later).
+    """
+    if value.lower().endswith('.txt') and os.path.isfile(value):
+        with open(value, 'r', encoding='utf-8') as file:
+            return file.read()
+    return value
+
+
+def is_service_available(service_url: str, timeout: float = 0.5) -> bool:
+    """
+    Returns True if the evaluation service answers its health check.
+    """
+    try:
+        with urllib.request.urlopen(f"{service_url}/health", timeout=timeout) as response:
+            return response.status == 200
+    except (urllib.error.URLError, OSError):
+        return False
+
+
+def encode_multipart_form(fields: dict) -> Tuple[bytes, str]:
+    """
+    Returns the multipart/form-data body and content type for the given fields. Values that are
+    paths of existing files are sent as file uploads, everything else as text.
+    """
+    boundary = uuid.uuid4().hex
+    body = b""
+    for name, value in fields.items():
+        body += f"--{boundary}\r\n".encode('utf-8')
+        if os.path.isfile(value):
+            with open(value, 'rb') as file:
+                content = file.read()
+            body += f'Content-Disposition: form-data; name="{name}"; filename="{os.path.basename(value)}"\r\n'.encode('utf-8')
+            body += b"Content-Type: application/octet-stream\r\n\r\n" + content + b"\r\n"
+        else:
+            body += f'Content-Disposition: form-data; name="{name}"\r\n\r\n'.encode('utf-8')
+            body += value.encode('utf-8') + b"\r\n"
+    body += f"--{boundary}--\r\n".encode('utf-8')
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def evaluate_with_service(service_url: str, resume: str, jd: str, timeout: float = 600) -> Tuple[dict, dict]:
+    """
+    Sends the resume and JD (file paths or text) to the evaluation service.
+
+    Returns: (evaluation, timings)
+    """
+    body, content_type = encode_multipart_form(fields={'resume': resume, 'jd': jd})
+    request = urllib.request.Request(
+        f"{service_url}/evaluate", data=body, headers={'Content-Type': content_type}, method='POST'
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            result = json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(f"The evaluation service returned {e.code}: {e.read().decode('utf-8', errors='ignore')}")
+    return result['evaluation'], result['timings']
+
+
+def evaluate_locally(resume: str, jd: str, model_kwargs: dict, cache_dir: Optional[str] = None) -> Tuple[dict, dict]:
+    """
+    Extracts the texts, loads the model and scores the resume in this process.
+
+    Returns: (evaluation, timings)
+    """
+    timings = {}
+    start_time = time.perf_counter()
+    from models import GGUFModel
+    from preprocessing import Preprocessor
+    from token_budget import TokenBudgeter
+    from predict_scores import validate_label_response
+    from prompts import get_label_generation_instruction_prompt
+    timings['imports'] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    preprocessor = Preprocessor(cache_dir=cache_dir)
+    resume_text = preprocessor(input_str=resume)
+    jd_text = preprocessor(input_str=jd) if os.path.isfile(jd) else jd
+    timings['extraction'] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    model = GGUFModel(**model_kwargs)
+    timings['model_load'] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    token_budgeter = TokenBudgeter(
+        gguf_model_path=model_kwargs['gguf_model_path'], max_context_size=model_kwargs['context_window_size']
+    )
+    # SYSTEM PROMPT, INSTRUCTIONS AND A MARGIN FOR THE CHAT TEMPLATE TOKENS
+    prompt_overhead_tokens = token_budgeter.count_tokens(model_kwargs['system_prompt']) \
+        + token_budgeter.count_tokens(get_label_generation_instruction_prompt(resume="", jd="")) + 32
+    resume_text, jd_text, _ = token_budgeter.fit(resume=resume_text, jd=jd_text, prompt_overhead_tokens=prompt_overhead_tokens)
+    instruction_prompt = get_label_generation_instruction_prompt(resume=resume_text, jd=jd_text)
+    timings['prompt_construction'] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    response = validate_label_response(response=model.perform_inference(instruction_prompt=instruction_prompt))
+    timings['inference'] = time.perf_counter() - start_time
+    return json.loads(response), timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Scores a resume against a JD (through the evaluation service if it is running).")
+    parser.add_argument('resume', help="Resume file (PDF/Docx/Image) or text.")
+    parser.add_argument('jd', help="JD file or text.")
+    parser.add_argument('--service-url', default=DEFAULT_SERVICE_URL, help="URL of the evaluation service.")
+    parser.add_argument('--local', action='store_true', help="Load the model in this process even if the service is running.")
+    parser.add_argument('--json', action='store_true', help="Print the evaluation, mode and timings as one JSON line.")
+    args = parser.parse_args()
+    args.resume, args.jd = read_text_input(value=args.resume), read_text_input(value=args.jd)
+
+    if not args.local and is_service_available(service_url=args.service_url):
+        mode = 'service'
+        evaluation, timings = evaluate_with_service(service_url=args.service_url, resume=args.resume, jd=args.jd)
+    else:
+        mode = 'local'
+        from prompts import get_label_generation_system_prompt, get_label_generation_instruction_prefix, \
+            get_label_generation_output_schema
+
+        evaluation, timings = evaluate_locally(
+            resume=args.resume,
+            jd=args.jd,
+            model_kwargs={
+                'gguf_model_path': "/home/omkanekar28/code/Resume-Evaluator/models/qwen2.5-7b-instruct-q5_k_m-00001-of-00002.gguf",
+                'system_prompt': get_label_generation_system_prompt(),
+                'context_window_size': 8000,
+                'instruction_prefix': get_label_generation_instruction_prefix(),
+                'output_schema': get_label_generation_output_schema()
+            },
+            cache_dir="/home/omkanekar28/code/Resume-Evaluator/data/extraction_cache"
+        )
+    # TIME SINCE THE SCRIPT STARTED (INTERPRETER STARTUP IS ONLY VISIBLE TO THE CALLER)
+    timings['script_total'] = time.perf_counter() - SCRIPT_START_TIME
+
+    if args.json:
+        print(json.dumps({'mode': mode, 'evaluation': evaluation, 'timings': timings}))
+    else:
+        print(json.dumps(evaluation, indent=4))
+        print(f"Evaluated through the {mode} model in {timings['script_total']:.2f} seconds:")
+        for stage, timing in timings.items():
+            print(f"    {stage}: {timing:.3f}s")
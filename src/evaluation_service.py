@@ -0,0 +1,359 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from typing import Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from aiohttp import web
+from models import GGUFModel, FakeGGUFModel
+from token_budget import TokenBudgeter
+from scoring_cache import ScoringCache
+from predict_scores import validate_label_response
+from unstructured_to_excel import extract_file_text, kill_pool
+from prompts import get_label_generation_system_prompt, get_label_generation_instruction_prompt, \
+    get_label_generation_instruction_prefix, get_label_generation_output_schema, LABEL_GENERATION_PROMPT_VERSION
+
+
+class RequestRejected(Exception):
+    """
+    Raised when a request cannot be admitted because the service is at capacity.
+    """
+
+
+class ExtractionFailed(Exception):
+    """
+    Raised when the process extracting the text of an uploaded file crashes.
+    """
+
+
+class EvaluationService:
+    """
+    Asynchronous HTTP service that scores a resume (file upload or text) against a JD.
+    Text extraction runs in a process pool and inference runs on a small pool of preloaded
+    models. Requests beyond the capacity of the service are rejected instead of piling up.
+    """
+
+    # TIME GIVEN TO THE EXTRACTION'S OWN TIMEOUT (A PYTHON EXCEPTION) BEFORE ITS PROCESS IS KILLED
+    EXTRACTION_KILL_GRACE_SECONDS = 10
+
+    def __init__(self, model_kwargs: dict, num_models: int = 1, fake_model: bool = False,
+                 preprocessing_workers: int = 2, max_queued_requests: int = 8, extraction_timeout: int = 120,
+                 cache_dir: Optional[str] = None, token_budgeting: bool = True,
+                 scoring_cache_path: Optional[str] = None, scoring_cache_ttl_seconds: Optional[float] = None,
+                 scoring_cache_max_entries: Optional[int] = None) -> None:
+        """
+        Initialises the worker pools and counters. Models are loaded when the service starts.
+
+        At most 'num_models' + 'max_queued_requests' requests are admitted at a time, every other
+        request gets a 503 response (with a Retry-After header) so that clients back off.
+
+        If 'fake_model' is True, FakeGGUFModel is used instead of the GGUF model (for load testing).
+
+        Extractions still running 'extraction_timeout' (plus a grace period) seconds after they
+        started (e.g. hung inside a C extension) are killed with their process pool, which is then
+        recreated. The same happens when an extraction crashes its process, after which the
+        extractions that were running are retried one per process, so only the request of the
+        offending file fails.
+
+        If 'scoring_cache_path' is provided, responses are cached (SQLite) and repeated evaluations of
+        the same resume and JD are answered without inference.
+        """
+        self.model_kwargs = model_kwargs
+        self.num_models = max(1, num_models)
+        self.fake_model = fake_model
+        self.max_admitted_requests = self.num_models + max(0, max_queued_requests)
+        self.extraction_timeout = extraction_timeout
+        self.cache_dir = cache_dir
+        self.token_budgeting = token_budgeting and not fake_model
+
+        self.preprocessing_workers = max(1, preprocessing_workers)
+        self.preprocessing_pool = ProcessPoolExecutor(max_workers=self.preprocessing_workers)
+        self.preprocessing_slots = asyncio.Semaphore(self.preprocessing_workers)
+        # ONE THREAD PER MODEL, LLAMA.CPP RELEASES THE GIL WHILE DECODING
+        self.inference_pool = ThreadPoolExecutor(max_workers=self.num_models)
+        self.model_pool = None
+        self.token_budgeter = None
+        self.prompt_overhead_tokens = 0
+        self.scoring_cache = None
+        # SCORES OF THE FAKE MODEL ARE NEVER CACHED
+        if scoring_cache_path is not None and not fake_model:
+            self.scoring_cache = ScoringCache(
+                cache_path=scoring_cache_path, gguf_model_path=model_kwargs['gguf_model_path'],
+                prompt_version=LABEL_GENERATION_PROMPT_VERSION, ttl_seconds=scoring_cache_ttl_seconds,
+                max_entries=scoring_cache_max_entries
+            )
+
+        self.admitted_requests = 0
+        self.waiting_for_model = 0
+        self.stats = {'completed': 0, 'failed': 0, 'rejected': 0}
+
+    def load_model(self):
+        """
+        Loads one model instance (GGUFModel or FakeGGUFModel).
+        """
+        if self.fake_model:
+            return FakeGGUFModel(**self.model_kwargs)
+        return GGUFModel(**self.model_kwargs)
+
+    async def start(self, app: web.Application) -> None:
+        """
+        Preloads all models (in parallel) before the service accepts requests.
+        """
+        loop = asyncio.get_running_loop()
+        print(f"Loading {self.num_models} models...")
+        models = await asyncio.gather(*[
+            loop.run_in_executor(self.inference_pool, self.load_model) for _ in range(self.num_models)
+        ])
+        self.model_pool = asyncio.Queue()
+        for model in models:
+            self.model_pool.put_nowait(model)
+
+        if self.token_budgeting:
+            self.token_budgeter = TokenBudgeter(
+                gguf_model_path=self.model_kwargs['gguf_model_path'],
+                max_context_size=self.model_kwargs['context_window_size']
+            )
+            # SYSTEM PROMPT, INSTRUCTIONS AND A MARGIN FOR THE CHAT TEMPLATE TOKENS
+            self.prompt_overhead_tokens = self.token_budgeter.count_tokens(self.model_kwargs['system_prompt']) \
+                + self.token_budgeter.count_tokens(get_label_generation_instruction_prompt(resume="", jd="")) + 32
+        print("Models loaded, accepting requests...")
+
+    async def stop(self, app: web.Application) -> None:
+        """
+        Shuts down the worker pools.
+        """
+        self.preprocessing_pool.shutdown(wait=False, cancel_futures=True)
+        self.inference_pool.shutdown(wait=False, cancel_futures=True)
+        if self.scoring_cache is not None:
+            self.scoring_cache.close()
+
+    def admit(self) -> None:
+        """
+        Admits a request or raises RequestRejected if the service is at capacity.
+        """
+        if self.admitted_requests >= self.max_admitted_requests:
+            self.stats['rejected'] += 1
+            raise RequestRejected(f"Service at capacity ({self.admitted_requests} requests in progress)!")
+        self.admitted_requests += 1
+
+    async def get_document_text(self, field) -> Tuple[str, float]:
+        """
+        Returns the text of a form field (plain text or uploaded file) and the time spent extracting it.
+        Uploaded files are extracted by the Preprocessor in the process pool.
+        """
+        if isinstance(field, str):
+            return field, 0.0
+
+        start_time = time.perf_counter()
+        # THE PREPROCESSOR DETECTS THE FILE TYPE FROM THE EXTENSION
+        extension = os.path.splitext(field.filename or '')[1].lower()
+        with tempfile.NamedTemporaryFile(suffix=extension, delete=False) as file:
+            file.write(field.file.read())
+            filepath = file.name
+        try:
+            text = await self.extract_text(filepath=filepath)
+        finally:
+            os.remove(filepath)
+        return text, time.perf_counter() - start_time
+
+    async def extract_text(self, filepath: str) -> str:
+        """
+        Extracts the text of the file in the process pool. Raises TimeoutError if the extraction
+        has to be killed and ExtractionFailed if it crashes its process.
+        """
+        # AT MOST ONE EXTRACTION PER WORKER, SO THAT THE TIMEOUT DOES NOT INCLUDE TIME SPENT QUEUED
+        async with self.preprocessing_slots:
+            pool = self.preprocessing_pool
+            try:
+                return await self.run_extraction(pool=pool, filepath=filepath)
+            except BrokenProcessPool:
+                self.kill_preprocessing_pool(pool=pool)
+
+            # EVERY EXTRACTION OF THE BROKEN POOL FAILS, SO EACH ONE IS RETRIED IN A PROCESS OF ITS OWN
+            pool = ProcessPoolExecutor(max_workers=1)
+            try:
+                return await self.run_extraction(pool=pool, filepath=filepath)
+            except BrokenProcessPool:
+                raise ExtractionFailed("The text extraction process crashed while processing the file!")
+            finally:
+                pool.shutdown(wait=False)
+
+    async def run_extraction(self, pool: ProcessPoolExecutor, filepath: str) -> str:
+        """
+        Runs extract_file_text in the given pool, killing the pool if the extraction hangs past its timeout.
+        """
+        timeout = self.extraction_timeout + self.EXTRACTION_KILL_GRACE_SECONDS if self.extraction_timeout else None
+        future = asyncio.get_running_loop().run_in_executor(
+            pool, extract_file_text, filepath, self.extraction_timeout, self.cache_dir
+        )
+        done, _ = await asyncio.wait({future}, timeout=timeout)
+        if not done:
+            future.cancel()
+            self.kill_preprocessing_pool(pool=pool)
+            raise TimeoutError(f"Text extraction did not finish within {self.extraction_timeout} seconds!")
+        return future.result()
+
+    def kill_preprocessing_pool(self, pool: ProcessPoolExecutor) -> None:
+        """
+        Kills the workers of the given (hung or broken) pool. The shared preprocessing pool is replaced,
+        unless another request already did.
+        """
+        kill_pool(executor=pool)
+        if pool is self.preprocessing_pool:
+            print("Restarting the preprocessing pool...")
+            self.preprocessing_pool = ProcessPoolExecutor(max_workers=self.preprocessing_workers)
+
+    def get_instruction_prompt(self, resume: str, jd: str) -> str:
+        """
+        Returns the instruction prompt, fitting the resume and JD to the context window if token budgeting is enabled.
+        """
+        if self.token_budgeter is not None:
+            resume, jd, _ = self.token_budgeter.fit(resume=resume, jd=jd, prompt_overhead_tokens=self.prompt_overhead_tokens)
+        return get_label_generation_instruction_prompt(resume=resume, jd=jd)
+
+    async def evaluate(self, resume: str, jd: str) -> Tuple[dict, dict]:
+        """
+        Scores the resume against the JD on the first free model.
+
+        Returns: (evaluation, timings)
+        """
+        loop = asyncio.get_running_loop()
+        timings = {}
+
+        cache_key = None
+        if self.scoring_cache is not None:
+            start_time = time.perf_counter()
+            cache_key = self.scoring_cache.get_key(resume=resume, jd=jd)
+            cached_response = await loop.run_in_executor(None, self.scoring_cache.get, cache_key)
+            timings['cache_lookup'] = time.perf_counter() - start_time
+            if cached_response is not None:
+                return json.loads(cached_response), timings
+
+        start_time = time.perf_counter()
+        instruction_prompt = await loop.run_in_executor(None, self.get_instruction_prompt, resume, jd)
+        timings['prompt_construction'] = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        self.waiting_for_model += 1
+        try:
+            model = await self.model_pool.get()
+        finally:
+            self.waiting_for_model -= 1
+        timings['queue_wait'] = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        try:
+            response = await loop.run_in_executor(self.inference_pool, model.perform_inference, instruction_prompt)
+        finally:
+            self.model_pool.put_nowait(model)
+        timings['inference'] = time.perf_counter() - start_time
+
+        response = validate_label_response(response=response)
+        if cache_key is not None:
+            await loop.run_in_executor(None, self.scoring_cache.put, cache_key, response)
+        return json.loads(response), timings
+
+    async def handle_evaluate(self, request: web.Request) -> web.Response:
+        """
+        POST /evaluate with 'resume' and 'jd' as multipart form fields (text or file) or as a JSON body.
+        """
+        request_start_time = time.perf_counter()
+        try:
+            self.admit()
+        except RequestRejected as e:
+            return web.json_response({'error': str(e)}, status=503, headers={'Retry-After': '1'})
+
+        try:
+            if request.content_type == 'application/json':
+                fields = await request.json()
+            else:
+                fields = await request.post()
+            if 'resume' not in fields or 'jd' not in fields:
+                return web.json_response({'error': "Both 'resume' and 'jd' are required!"}, status=400)
+
+            try:
+                (resume, resume_extraction_time), (jd, jd_extraction_time) = await asyncio.gather(
+                    self.get_document_text(field=fields['resume']), self.get_document_text(field=fields['jd'])
+                )
+            except (ValueError, TypeError, TimeoutError) as e:
+                self.stats['failed'] += 1
+                return web.json_response({'error': str(e)}, status=400)
+            except ExtractionFailed as e:
+                self.stats['failed'] += 1
+                return web.json_response({'error': str(e)}, status=422)
+
+            try:
+                evaluation, timings = await self.evaluate(resume=resume, jd=jd)
+            except Exception as e:
+                self.stats['failed'] += 1
+                return web.json_response({'error': str(e)}, status=500)
+
+            timings['extraction'] = max(resume_extraction_time, jd_extraction_time)
+            timings['total'] = time.perf_counter() - request_start_time
+            self.stats['completed'] += 1
+            return web.json_response({
+                'evaluation': evaluation, 'cached': 'inference' not in timings, 'timings': timings
+            })
+        finally:
+            self.admitted_requests -= 1
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        """
+        GET /health with the current load of the service.
+        """
+        return web.json_response({
+            'models': self.num_models,
+            'admitted_requests': self.admitted_requests,
+            'waiting_for_model': self.waiting_for_model,
+            'max_admitted_requests': self.max_admitted_requests,
+            **self.stats,
+            'scoring_cache': self.scoring_cache.get_stats() if self.scoring_cache is not None else None
+        })
+
+    def create_app(self, max_upload_size_mb: int = 20) -> web.Application:
+        """
+        Returns the aiohttp application of the service.
+        """
+        app = web.Application(client_max_size=max_upload_size_mb * 1024 * 1024)
+        app.router.add_post('/evaluate', self.handle_evaluate)
+        app.router.add_get('/health', self.handle_health)
+        app.on_startup.append(self.start)
+        app.on_cleanup.append(self.stop)
+        return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serves resume-jd evaluations over HTTP.")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--models', type=int, default=1, help="Number of preloaded model instances.")
+    parser.add_argument('--threads-per-model', type=int, default=None, help="CPU threads used by each model.")
+    parser.add_argument('--preprocessing-workers', type=int, default=2, help="Processes used for text extraction.")
+    parser.add_argument('--max-queued-requests', type=int, default=8, help="Requests allowed to wait for a model.")
+    parser.add_argument('--fake-model', action='store_true', help="Use a simulated model (for load testing).")
+    parser.add_argument('--mlock', action='store_true', help="Lock the model weights in RAM while the service runs.")
+    args = parser.parse_args()
+
+    service = EvaluationService(
+        model_kwargs={
+            'gguf_model_path': "/home/omkanekar28/code/Resume-Evaluator/models/qwen2.5-7b-instruct-q5_k_m-00001-of-00002.gguf",
+            'system_prompt': get_label_generation_system_prompt(),
+            'context_window_size': 8000,
+            'instruction_prefix': get_label_generation_instruction_prefix(),
+            'output_schema': get_label_generation_output_schema(),
+            'n_threads': args.threads_per_model,
+            'use_mlock': args.mlock
+        },
+        num_models=args.models,
+        fake_model=args.fake_model,
+        preprocessing_workers=args.preprocessing_workers,
+        max_queued_requests=args.max_queued_requests,
+        cache_dir="/home/omkanekar28/code/Resume-Evaluator/data/extraction_cache",
+        scoring_cache_path="/home/omkanekar28/code/Resume-Evaluator/data/scoring_cache.sqlite",
+        scoring_cache_ttl_seconds=30 * 24 * 60 * 60,
+        scoring_cache_max_entries=100000
+    )
+    web.run_app(service.create_app(), host=args.host, port=args.port)
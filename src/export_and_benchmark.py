@@ -0,0 +1,302 @@
+"""
+Exports a fine-tuned checkpoint to GGUF quantizations and benchmarks every variant on CPU with the
+label generation prompts, so that the variant served behind GGUFModel is chosen on speed vs quality.
+
+For every variant: load time, prompt evaluation and generation tokens/sec, peak resident memory,
+JSON validity and agreement of the match scores with the 16-bit reference.
+
+Export and benchmark a checkpoint (saved by training.py):
+
+python export_and_benchmark.py --checkpoint outputs/<run>/checkpoint-500 --pairs dataset.parquet
+
+Benchmark existing GGUF files:
+
+python export_and_benchmark.py --gguf f16=model-f16.gguf --gguf q4_k_m=model-q4_k_m.gguf --pairs dataset.parquet
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import multiprocessing
+import numpy as np
+import training_config as config
+from datetime import datetime
+from typing import Dict, List, Optional
+from concurrent.futures import ProcessPoolExecutor
+from dataset_io import count_rows, iter_records
+from prompts import get_label_generation_system_prompt, get_label_generation_instruction_prompt, \
+    get_label_generation_output_schema
+
+
+def export_gguf(checkpoint_dir: str, output_dir: str, quantizations: List[str]) -> Dict[str, str]:
+    """
+    Loads the checkpoint with unsloth and saves every quantization in its own directory.
+
+    Returns: {quantization: GGUF file path}
+    """
+    from unsloth import FastLanguageModel
+
+    model, tokenizer = FastLanguageModel.from_pretrained(
+        model_name=checkpoint_dir,
+        max_seq_length=config.MAX_SEQ_LENGTH,
+        dtype=config.DTYPE,
+        load_in_4bit=False
+    )
+    gguf_paths = {}
+    for quantization in quantizations:
+        quantization_dir = os.path.join(output_dir, quantization)
+        os.makedirs(quantization_dir, exist_ok=True)
+        print(f"Exporting {quantization}...")
+        export_start_time = time.perf_counter()
+        model.save_pretrained_gguf(quantization_dir, tokenizer, quantization_method=quantization)
+        gguf_paths[quantization] = find_gguf_file(directory=quantization_dir, quantization=quantization)
+        print(f"Exported {gguf_paths[quantization]} in {time.perf_counter() - export_start_time:.0f} seconds")
+    return gguf_paths
+
+
+def find_gguf_file(directory: str, quantization: str) -> str:
+    """
+    Returns the GGUF file of the quantization in the export directory (unsloth also leaves the
+    16-bit intermediate file next to quantized ones).
+    """
+    gguf_files = glob.glob(os.path.join(directory, "*.gguf"))
+    matching_files = [path for path in gguf_files if quantization.upper() in os.path.basename(path).upper()]
+    if len(matching_files) == 1:
+        return matching_files[0]
+    if len(gguf_files) == 1:
+        return gguf_files[0]
+    raise FileNotFoundError(f"Could not find the {quantization} GGUF file in {directory}!")
+
+
+def get_instruction_prompts(pairs_path: str, num_prompts: int, gguf_model_path: str, context_window_size: int,
+                            seed: int = 0) -> List[str]:
+    """
+    Returns the instruction prompts of a fixed random sample of JD-Resume pairs, fitted to the
+    context window (with the tokenizer of the given model).
+    """
+    from token_budget import TokenBudgeter
+
+    num_rows = count_rows(path=pairs_path)
+    sample_indices = set(random.Random(seed).sample(range(num_rows), min(num_prompts, num_rows)))
+    token_budgeter = TokenBudgeter(gguf_model_path=gguf_model_path, max_context_size=context_window_size)
+    # SYSTEM PROMPT, INSTRUCTIONS AND A MARGIN FOR THE CHAT TEMPLATE TOKENS
+    prompt_overhead_tokens = token_budgeter.count_tokens(get_label_generation_system_prompt()) \
+        + token_budgeter.count_tokens(get_label_generation_instruction_prompt(resume="", jd="")) + 32
+
+    instruction_prompts = []
+    for index, row in enumerate(iter_records(path=pairs_path, columns=['JD', 'Resume'])):
+        if index not in sample_indices:
+            continue
+        resume, jd, _ = token_budgeter.fit(resume=row['Resume'], jd=row['JD'], prompt_overhead_tokens=prompt_overhead_tokens)
+        instruction_prompts.append(get_label_generation_instruction_prompt(resume=resume, jd=jd))
+    return instruction_prompts
+
+
+def get_match_score(response: Optional[str]) -> Optional[float]:
+    """
+    Returns the match score of a valid label response (None if the response is not a valid label).
+    """
+    from predict_scores import validate_label_response
+
+    try:
+        match_score = json.loads(validate_label_response(response=response))['match_score']
+        return float(match_score)
+    except Exception:
+        return None
+
+
+def benchmark_variant(gguf_model_path: str, instruction_prompts: List[str], context_window_size: int,
+                      n_threads: Optional[int], constrain_output: bool, speculative_decoding: Optional[str] = None,
+                      num_draft_tokens: int = 10, draft_model_path: Optional[str] = None) -> dict:
+    """
+    Loads the model on CPU (with speculative decoding if 'speculative_decoding' is given) and labels
+    every prompt once. Meant to run in a freshly spawned process, so that the peak RSS belongs to
+    this variant only.
+    """
+    from models import GGUFModel
+
+    load_start_time = time.perf_counter()
+    model = GGUFModel(
+        gguf_model_path=gguf_model_path,
+        system_prompt=get_label_generation_system_prompt(),
+        context_window_size=context_window_size,
+        device='cpu',
+        n_threads=n_threads,
+        output_schema=get_label_generation_output_schema() if constrain_output else None,
+        seed=0,
+        speculative_decoding=speculative_decoding,
+        num_draft_tokens=num_draft_tokens,
+        draft_model_path=draft_model_path
+    )
+    load_time = time.perf_counter() - load_start_time
+
+    results = []
+    for instruction_prompt in instruction_prompts:
+        try:
+            response = model.perform_inference(instruction_prompt=instruction_prompt)
+            error = None
+        except Exception as e:
+            response, error = None, str(e)
+        results.append({
+            'stats': model.last_inference_stats,
+            'match_score': get_match_score(response=response),
+            'error': error
+        })
+    return {
+        'load_time': load_time,
+        'results': results,
+        'file_size_mb': os.path.getsize(gguf_model_path) / 1024 ** 2,
+        # KILOBYTES ON LINUX, BYTES ON MACOS
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+    }
+
+
+def summarise_variant(variant: dict, reference_scores: List[Optional[float]], tolerance: float) -> dict:
+    """
+    Returns the speed, memory and quality metrics of a benchmarked variant. Agreement is measured
+    on the prompts for which both the variant and the reference returned a valid label.
+    """
+    results = variant['results']
+    timed_stats = [result['stats'] for result in results if result['stats'] is not None and 'prompt_eval_time' in result['stats']]
+    evaluated_tokens = sum(stats['prompt_tokens'] - (stats['cached_prompt_tokens'] or 0) for stats in timed_stats)
+    prompt_eval_time = sum(stats['prompt_eval_time'] for stats in timed_stats)
+    generated_tokens = sum(stats['generated_tokens'] for stats in timed_stats)
+    generation_time = sum(stats['generation_time'] for stats in timed_stats)
+    draft_tokens = sum(stats.get('draft_tokens', 0) for stats in timed_stats)
+
+    score_pairs = [
+        (result['match_score'], reference_score) for result, reference_score in zip(results, reference_scores)
+        if result['match_score'] is not None and reference_score is not None
+    ]
+    differences = [abs(score - reference_score) for score, reference_score in score_pairs]
+    correlation = None
+    if len(score_pairs) >= 2 and np.std([pair[0] for pair in score_pairs]) > 0 and np.std([pair[1] for pair in score_pairs]) > 0:
+        correlation = float(np.corrcoef([pair[0] for pair in score_pairs], [pair[1] for pair in score_pairs])[0, 1])
+
+    return {
+        'file_size_mb': variant['file_size_mb'],
+        'load_time': variant['load_time'],
+        'peak_rss_mb': variant['peak_rss_mb'],
+        'prompt_eval_tokens_per_sec': evaluated_tokens / prompt_eval_time if prompt_eval_time > 0 else 0.0,
+        'generation_tokens_per_sec': generated_tokens / generation_time if generation_time > 0 else 0.0,
+        'draft_acceptance_rate': sum(stats.get('accepted_draft_tokens', 0) for stats in timed_stats) / draft_tokens if draft_tokens else None,
+        'seconds_per_label': sum(stats['prompt_eval_time'] + stats['generation_time'] for stats in timed_stats) / len(timed_stats) if timed_stats else None,
+        'json_validity': sum(result['match_score'] is not None for result in results) / len(results) if results else 0.0,
+        'compared_scores': len(score_pairs),
+        'score_mae': float(np.mean(differences)) if differences else None,
+        'score_agreement': sum(difference <= tolerance for difference in differences) / len(differences) if differences else None,
+        'score_correlation': correlation
+    }
+
+
+def choose_variant(summary: Dict[str, dict], reference: str, min_agreement: float, max_validity_drop: float) -> Optional[str]:
+    """
+    Returns the fastest variant (seconds per label) whose JSON validity is at most 'max_validity_drop'
+    below the reference and whose score agreement is at least 'min_agreement'.
+    """
+    reference_validity = summary[reference]['json_validity']
+    candidates = [
+        name for name, metrics in summary.items()
+        if metrics['seconds_per_label'] is not None
+        and metrics['json_validity'] >= reference_validity - max_validity_drop
+        and (name == reference or (metrics['score_agreement'] is not None and metrics['score_agreement'] >= min_agreement))
+    ]
+    return min(candidates, key=lambda name: summary[name]['seconds_per_label']) if candidates else None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Exports GGUF quantizations of a checkpoint and benchmarks them on CPU.")
+    parser.add_argument('--checkpoint', default=None, help="Checkpoint (or merged model) directory to export.")
+    parser.add_argument('--quantizations', default="f16,q8_0,q5_k_m,q4_k_m", help="Comma-separated quantizations to export (f16 first).")
+    parser.add_argument('--export-dir', default=None, help="Directory of the exported files (<checkpoint>/gguf by default).")
+    parser.add_argument('--gguf', action='append', default=[], help="Existing variant to benchmark as name=path (repeatable).")
+    parser.add_argument('--reference', default=None, help="Variant used as the quality reference (the first one by default).")
+    parser.add_argument('--pairs', required=True, help="JD-Resume pairs (parquet, arrow or excel) the prompts are built from.")
+    parser.add_argument('--num-prompts', type=int, default=20, help="Number of pairs in the fixed prompt set.")
+    parser.add_argument('--context-window-size', type=int, default=config.MAX_SEQ_LENGTH, help="Context size of the benchmarked models.")
+    parser.add_argument('--threads', type=int, default=None, help="CPU threads used by the models.")
+    parser.add_argument('--unconstrained', action='store_true', help="Do not constrain decoding to the output JSON schema.")
+    parser.add_argument('--speculative-decoding', choices=['prompt_lookup', 'draft_model'], default=None,
+                        help="Also benchmark every variant with speculative decoding (as <name>+<method>).")
+    parser.add_argument('--num-draft-tokens', type=int, default=10, help="Tokens drafted per verification.")
+    parser.add_argument('--draft-model', default=None, help="Small GGUF model of the same family used as draft model.")
+    parser.add_argument('--tolerance', type=float, default=5, help="Match score difference counted as agreement.")
+    parser.add_argument('--min-agreement', type=float, default=0.8, help="Agreement required for a recommended variant.")
+    parser.add_argument('--max-validity-drop', type=float, default=0.02, help="JSON validity loss allowed for a recommended variant.")
+    parser.add_argument('--output', default="quantization_benchmark.json", help="Machine-readable results (JSON).")
+    args = parser.parse_args()
+    if args.speculative_decoding == 'draft_model' and args.draft_model is None:
+        parser.error("--draft-model is required for draft model speculative decoding!")
+
+    gguf_paths = dict(variant.split("=", 1) for variant in args.gguf)
+    if args.checkpoint is not None:
+        export_dir = args.export_dir or os.path.join(args.checkpoint, "gguf")
+        quantizations = [quantization.strip() for quantization in args.quantizations.split(",") if quantization.strip()]
+        # EXPORTED IN A SEPARATE PROCESS, SO THAT THE GPU AND RAM ARE FREED BEFORE BENCHMARKING
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            gguf_paths.update(executor.submit(export_gguf, args.checkpoint, export_dir, quantizations).result())
+    if not gguf_paths:
+        parser.error("Nothing to benchmark, provide --checkpoint or --gguf!")
+    reference = args.reference or next(iter(gguf_paths))
+
+    instruction_prompts = get_instruction_prompts(
+        pairs_path=args.pairs, num_prompts=args.num_prompts, gguf_model_path=gguf_paths[reference],
+        context_window_size=args.context_window_size
+    )
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'settings': {key: value for key, value in vars(args).items() if key != 'gguf'},
+        'gguf_paths': gguf_paths,
+        'reference': reference,
+        'variants': {},
+        'summary': {}
+    }
+    # (NAME, GGUF PATH, SPECULATIVE DECODING METHOD) OF EVERY BENCHMARKED SETUP
+    variants = [(name, path, None) for name, path in gguf_paths.items()]
+    if args.speculative_decoding is not None:
+        variants += [(f"{name}+{args.speculative_decoding}", path, args.speculative_decoding) for name, path in gguf_paths.items()]
+    variant_paths = {name: gguf_path for name, gguf_path, _ in variants}
+    # THE REFERENCE GOES FIRST, ITS SCORES ARE NEEDED FOR THE AGREEMENT OF THE OTHER VARIANTS
+    for name, gguf_path, speculative_decoding in sorted(variants, key=lambda variant: variant[0] != reference):
+        print(f"Benchmarking {name} on {len(instruction_prompts)} prompts...")
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            report['variants'][name] = executor.submit(
+                benchmark_variant, gguf_path, instruction_prompts, args.context_window_size,
+                args.threads, not args.unconstrained, speculative_decoding, args.num_draft_tokens, args.draft_model
+            ).result()
+        reference_scores = [result['match_score'] for result in report['variants'][reference]['results']]
+        report['summary'][name] = summarise_variant(
+            variant=report['variants'][name], reference_scores=reference_scores, tolerance=args.tolerance
+        )
+    report['recommended'] = choose_variant(
+        summary=report['summary'], reference=reference, min_agreement=args.min_agreement,
+        max_validity_drop=args.max_validity_drop
+    )
+
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=4)
+
+    for name, summary in report['summary'].items():
+        print(f"{name}: {summary['file_size_mb']:.0f} MB, load {summary['load_time']:.1f}s, "
+              f"peak RSS {summary['peak_rss_mb']:.0f} MB, prompt eval {summary['prompt_eval_tokens_per_sec']:.0f} tokens/sec, "
+              f"generation {summary['generation_tokens_per_sec']:.1f} tokens/sec")
+        if summary['draft_acceptance_rate'] is not None:
+            print(f"    {summary['draft_acceptance_rate']:.1%} of the draft tokens accepted")
+        agreement = f"{summary['score_agreement']:.1%}" if summary['score_agreement'] is not None else "n/a"
+        mae = f"{summary['score_mae']:.2f}" if summary['score_mae'] is not None else "n/a"
+        print(f"    valid JSON {summary['json_validity']:.1%}, agreement with {reference} (within {args.tolerance:g}) "
+              f"{agreement}, mean absolute score difference {mae}")
+    if report['recommended'] is not None:
+        print(f"Recommended variant: {report['recommended']} ({variant_paths[report['recommended']]})")
+    else:
+        print("No variant meets the quality thresholds!")
+    print(f"Results saved to {args.output}")
@@ -0,0 +1,95 @@
+import os
+import json
+import hashlib
+from typing import Optional
+
+
+class ExtractionCache:
+    """
+    Content-addressed on-disk cache for extracted document text. Entries are keyed by the hash
+    of the file contents and the extractor version, and the least recently used entries are
+    evicted once the cache grows beyond its size limit.
+    """
+
+    def __init__(self, cache_dir: str, extractor_version: str, max_size_mb: int = 512) -> None:
+        """
+        Initialises the cache directory and computes its current size.
+        """
+        self.cache_dir = cache_dir
+        self.extractor_version = extractor_version
+        self.max_size_bytes = max_size_mb * 1024 * 1024
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.current_size_bytes = sum(os.path.getsize(path) for path in self.iter_entry_paths())
+
+    def iter_entry_paths(self):
+        """
+        Yields the paths of all cache entries.
+        """
+        for root, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if filename.endswith('.json'):
+                    yield os.path.join(root, filename)
+
+    def get_key(self, file_path: str) -> str:
+        """
+        Returns the cache key of the given file (hash of its contents and the extractor version).
+        """
+        file_hash = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b''):
+                file_hash.update(block)
+        return hashlib.sha256(f"{file_hash.hexdigest()}:{self.extractor_version}".encode('utf-8')).hexdigest()
+
+    def get_entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[dict]:
+        """
+        Returns the cached entry (text and metadata) for the given key, or None on a cache miss.
+        """
+        entry_path = self.get_entry_path(key=key)
+        try:
+            with open(entry_path, 'r', encoding='utf-8') as file:
+                entry = json.load(file)
+        except (OSError, json.JSONDecodeError):
+            return None
+        # MODIFICATION TIME IS USED AS THE LAST ACCESS TIME FOR LRU EVICTION
+        os.utime(entry_path)
+        return entry
+
+    def put(self, key: str, entry: dict) -> None:
+        """
+        Saves the given entry (text and metadata) against the key and evicts old entries if needed.
+        """
+        entry_path = self.get_entry_path(key=key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        temp_path = f"{entry_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(entry, file, ensure_ascii=False)
+        os.replace(temp_path, entry_path)
+
+        self.current_size_bytes += os.path.getsize(entry_path)
+        if self.current_size_bytes > self.max_size_bytes:
+            self.evict()
+
+    def evict(self) -> None:
+        """
+        Deletes the least recently used entries until the cache fits in its size limit.
+        """
+        entries = []
+        for path in self.iter_entry_paths():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        self.current_size_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if self.current_size_bytes <= self.max_size_bytes:
+                break
+            try:
+                os.remove(path)
+                self.current_size_bytes -= size
+            except OSError:
+                continue
@@ -0,0 +1,129 @@
+import time
+import sqlite3
+import threading
+from typing import Iterable, Optional
+
+
+class LabelingManifest:
+    """
+    Persistent (SQLite) manifest of a labeled dataset, used for incremental labeling. Every source
+    JD and resume is tracked by its content hash ID, and every labeled pair by its key along with
+    the prompt version and model that produced its label. A pair has to be (re)labeled if it is
+    not in the manifest or if it was labeled with another prompt version or model.
+    """
+
+    def __init__(self, manifest_path: str, prompt_version: str, model_id: str, commit_every: int = 50) -> None:
+        """
+        Opens (or creates) the manifest database. Labeled pairs are committed once every
+        'commit_every' writes (a pair that was saved but not committed is labeled again).
+        """
+        self.manifest_path = manifest_path
+        self.prompt_version = prompt_version
+        self.model_id = model_id
+        self.commit_every = max(1, commit_every)
+        self.pending_writes = 0
+
+        # LOOKUPS HAPPEN IN THE FEEDER THREAD OF THE PARALLEL LABELING, WRITES IN THE MAIN THREAD
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.manifest_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS documents (doc_type TEXT NOT NULL, doc_id TEXT NOT NULL, "
+            "first_seen_at REAL NOT NULL, last_seen_at REAL NOT NULL, removed_at REAL, PRIMARY KEY (doc_type, doc_id))"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS pairs (pair_key TEXT PRIMARY KEY, jd_id TEXT NOT NULL, resume_id TEXT NOT NULL, "
+            "prompt_version TEXT NOT NULL, model_id TEXT NOT NULL, labeled_at REAL NOT NULL)"
+        )
+        self.connection.commit()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM pairs").fetchone()[0]
+
+    def __enter__(self) -> 'LabelingManifest':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def update_documents(self, doc_type: str, doc_ids: Iterable[str]) -> dict:
+        """
+        Records the current source documents of the given type ('jds' or 'resumes'). Documents that
+        are no longer present are marked as removed (their labeled pairs stay in the dataset).
+
+        Returns: {'total': ..., 'new': ..., 'removed': ...}
+        """
+        now = time.time()
+        doc_ids = set(doc_ids)
+        with self.lock:
+            active_ids = {
+                doc_id for (doc_id,) in self.connection.execute(
+                    "SELECT doc_id FROM documents WHERE doc_type = ? AND removed_at IS NULL", (doc_type,)
+                )
+            }
+            new_ids = doc_ids - active_ids
+            removed_ids = active_ids - doc_ids
+            # DOCUMENTS THAT WERE REMOVED AND ADDED AGAIN KEEP THEIR FIRST SEEN TIME
+            self.connection.executemany(
+                "INSERT INTO documents (doc_type, doc_id, first_seen_at, last_seen_at, removed_at) VALUES (?, ?, ?, ?, NULL) "
+                "ON CONFLICT (doc_type, doc_id) DO UPDATE SET last_seen_at = excluded.last_seen_at, removed_at = NULL",
+                ((doc_type, doc_id, now, now) for doc_id in doc_ids)
+            )
+            self.connection.executemany(
+                "UPDATE documents SET removed_at = ? WHERE doc_type = ? AND doc_id = ?",
+                ((now, doc_type, doc_id) for doc_id in removed_ids)
+            )
+            self.connection.commit()
+        return {'total': len(doc_ids), 'new': len(new_ids), 'removed': len(removed_ids)}
+
+    def get_pair_status(self, pair_key: str) -> Optional[str]:
+        """
+        Returns 'new' if the pair was never labeled, 'stale' if it was labeled with another prompt
+        version or model and None if its label is current.
+        """
+        with self.lock:
+            entry = self.connection.execute(
+                "SELECT prompt_version, model_id FROM pairs WHERE pair_key = ?", (pair_key,)
+            ).fetchone()
+        if entry is None:
+            return 'new'
+        if entry != (self.prompt_version, self.model_id):
+            return 'stale'
+        return None
+
+    def record_pair(self, pair_key: str, jd_id: str, resume_id: str) -> None:
+        """
+        Records the pair as labeled with the current prompt version and model.
+        """
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO pairs (pair_key, jd_id, resume_id, prompt_version, model_id, labeled_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (pair_key, jd_id, resume_id, self.prompt_version, self.model_id, time.time())
+            )
+            self.pending_writes += 1
+            if self.pending_writes >= self.commit_every:
+                self.connection.commit()
+                self.pending_writes = 0
+
+    def count_orphaned_pairs(self) -> int:
+        """
+        Returns the number of labeled pairs whose JD or resume has been removed from the sources.
+        """
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM pairs WHERE jd_id IN (SELECT doc_id FROM documents WHERE doc_type = 'jds' "
+                "AND removed_at IS NOT NULL) OR resume_id IN (SELECT doc_id FROM documents WHERE doc_type = 'resumes' "
+                "AND removed_at IS NOT NULL)"
+            ).fetchone()[0]
+
+    def flush(self) -> None:
+        with self.lock:
+            self.connection.commit()
+            self.pending_writes = 0
+
+    def close(self) -> None:
+        self.flush()
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,299 @@
+"""
+Per-row telemetry of dataset labeling (predict_scores.py) and a summary report of the metrics file
+that shows where to tune 'context_window_size', 'n_batch' and the prompt length.
+
+Summary report:
+
+python labeling_metrics.py dataset.metrics.jsonl
+"""
+
+import json
+import time
+import uuid
+import argparse
+import numpy as np
+from collections import deque
+from typing import List, Optional, Tuple
+
+
+class LabelingMetrics:
+    """
+    Appends one JSON line per labeled row (token counts, prompt evaluation and generation time, JSON
+    parse outcome) to the metrics file, after a line with the run configuration. A rolling window of
+    the most recent model rows gives the throughput and ETA shown while labeling.
+    """
+
+    def __init__(self, metrics_path: str, total_rows: int, run_config: Optional[dict] = None, window_size: int = 50) -> None:
+        """
+        Opens the metrics file (rows of earlier runs are kept). 'total_rows' is the (estimated)
+        number of rows this run will label.
+        """
+        self.metrics_path = metrics_path
+        self.total_rows = total_rows
+        self.run_config = run_config or {}
+        self.run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self.start_time = time.time()
+        self.completed_rows = 0
+        # (TIMESTAMP, GENERATED TOKENS) OF THE MOST RECENT MODEL ROWS
+        self.window = deque(maxlen=window_size)
+        self.file = open(metrics_path, 'a')
+        self.write({
+            'type': 'run', 'run_id': self.run_id, 'started_at': self.start_time, 'total_rows': total_rows, **self.run_config
+        })
+
+    def write(self, record: dict) -> None:
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def get_failure_reason(self, failure_reason: Optional[str], stats: Optional[dict]) -> Optional[str]:
+        """
+        Reports responses that are invalid because generation ran out of context as 'context_full'.
+        """
+        context_window_size = self.run_config.get('context_window_size')
+        if failure_reason not in ('invalid_json', 'missing_fields') or stats is None or context_window_size is None:
+            return failure_reason
+        if (stats.get('prompt_tokens') or 0) + (stats.get('generated_tokens') or 0) >= context_window_size - 1:
+            return 'context_full'
+        return failure_reason
+
+    def record_row(self, row: dict, stats: Optional[dict] = None, failure_reason: Optional[str] = None,
+                   inference_time: Optional[float] = None, source: str = 'model', worker_id: Optional[int] = None) -> dict:
+        """
+        Writes the metrics of a finished row and returns them. 'source' is 'model' for rows labeled
+        by the model, 'cache' for responses taken from the scoring cache and 'duplicate' for rows that
+        got the label of an identical row. Only model rows count towards the rolling throughput.
+        """
+        timestamp = time.time()
+        self.completed_rows += 1
+        stats = stats or {}
+        record = {
+            'type': 'row',
+            'run_id': self.run_id,
+            'index': row['index'],
+            'row_key': row['row_key'],
+            'source': source,
+            'worker_id': worker_id,
+            'timestamp': timestamp,
+            'inference_time': inference_time,
+            'prompt_tokens': stats.get('prompt_tokens'),
+            'cached_prompt_tokens': stats.get('cached_prompt_tokens'),
+            'generated_tokens': stats.get('generated_tokens'),
+            'prompt_eval_time': stats.get('prompt_eval_time'),
+            'generation_time': stats.get('generation_time'),
+            'draft_tokens': stats.get('draft_tokens'),
+            'accepted_draft_tokens': stats.get('accepted_draft_tokens'),
+            'parsed': failure_reason is None,
+            'failure_reason': self.get_failure_reason(failure_reason=failure_reason, stats=stats)
+        }
+        if source == 'model':
+            self.window.append((timestamp, record['generated_tokens'] or 0))
+        record.update(self.get_throughput(timestamp=timestamp))
+        self.write(record)
+        return record
+
+    def get_throughput(self, timestamp: float) -> dict:
+        """
+        Returns the rows/sec and generated tokens/sec over the rolling window and the ETA of the remaining rows.
+        """
+        if len(self.window) >= 2:
+            elapsed_time = self.window[-1][0] - self.window[0][0]
+            rows = len(self.window) - 1
+            generated_tokens = sum(tokens for _, tokens in list(self.window)[1:])
+        else:
+            elapsed_time = timestamp - self.start_time
+            rows = len(self.window)
+            generated_tokens = sum(tokens for _, tokens in self.window)
+        rows_per_sec = rows / elapsed_time if elapsed_time > 0 else 0.0
+        remaining_rows = max(0, self.total_rows - self.completed_rows)
+        return {
+            'rolling_rows_per_sec': rows_per_sec,
+            'rolling_generated_tokens_per_sec': generated_tokens / elapsed_time if elapsed_time > 0 else 0.0,
+            'eta_seconds': remaining_rows / rows_per_sec if rows_per_sec > 0 else None
+        }
+
+    def format_progress(self, record: dict) -> str:
+        """
+        Returns a one-line progress report of the given row record.
+        """
+        line = f"Row {record['index'] + 1} ({self.completed_rows}/{self.total_rows})"
+        if record['prompt_tokens'] is not None:
+            line += f": {record['prompt_tokens']} prompt tokens ({record['cached_prompt_tokens'] or 0} cached), " \
+                    f"{record['generated_tokens']} generated"
+        if record['prompt_eval_time'] is not None:
+            line += f" | prompt eval {record['prompt_eval_time']:.2f}s, generation {record['generation_time']:.2f}s"
+        if record['draft_tokens']:
+            line += f" | {record['accepted_draft_tokens'] / record['draft_tokens']:.0%} of {record['draft_tokens']} draft tokens accepted"
+        if record['failure_reason'] is not None:
+            line += f" | FAILED ({record['failure_reason']})"
+        line += f" | {record['rolling_rows_per_sec']:.3f} rows/sec, {record['rolling_generated_tokens_per_sec']:.1f} tokens/sec"
+        if record['eta_seconds'] is not None:
+            line += f", ETA {format_duration(seconds=record['eta_seconds'])}"
+        return line
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def format_duration(seconds: float) -> str:
+    hours, remainder = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def load_metrics(metrics_path: str) -> Tuple[dict, List[dict]]:
+    """
+    Returns the run configurations (by run ID) and the row records of the metrics file.
+    """
+    runs, rows = {}, []
+    with open(metrics_path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if record['type'] == 'run':
+                runs[record['run_id']] = record
+            else:
+                rows.append(record)
+    return runs, rows
+
+
+def get_percentiles(values: List[float]) -> str:
+    if not values:
+        return "n/a"
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return f"p50 {p50:.0f}, p90 {p90:.0f}, p99 {p99:.0f}, max {max(values):.0f}"
+
+
+def get_prompt_eval_rate(rows: List[dict]) -> float:
+    """
+    Returns the evaluated (not cached) prompt tokens per second of prompt evaluation time.
+    """
+    evaluated_tokens = sum(row['prompt_tokens'] - (row['cached_prompt_tokens'] or 0) for row in rows)
+    prompt_eval_time = sum(row['prompt_eval_time'] for row in rows)
+    return evaluated_tokens / prompt_eval_time if prompt_eval_time > 0 else 0.0
+
+
+def print_report(runs: dict, rows: List[dict], context_window_size: Optional[int]) -> None:
+    """
+    Prints the summary of the given row records and the tuning hints they suggest.
+    """
+    model_rows = [row for row in rows if row['source'] == 'model']
+    timed_rows = [row for row in model_rows if row['prompt_tokens'] is not None and row['prompt_eval_time'] is not None]
+    failure_reasons = {}
+    for row in model_rows:
+        if row['failure_reason'] is not None:
+            failure_reasons[row['failure_reason']] = failure_reasons.get(row['failure_reason'], 0) + 1
+
+    print(f"Rows: {len(rows)} ({len(model_rows)} labeled by the model, "
+          f"{sum(row['source'] == 'cache' for row in rows)} from the scoring cache, "
+          f"{sum(row['source'] == 'duplicate' for row in rows)} duplicates)")
+    if model_rows:
+        print(f"Parsed: {sum(row['parsed'] for row in model_rows) / len(model_rows):.1%} of the model rows")
+    for reason, count in sorted(failure_reasons.items(), key=lambda item: -item[1]):
+        print(f"    {reason}: {count}")
+
+    timestamps = sorted(row['timestamp'] for row in model_rows)
+    if len(timestamps) >= 2:
+        print(f"Throughput: {(len(timestamps) - 1) / (timestamps[-1] - timestamps[0]):.3f} rows/sec")
+    if not timed_rows:
+        return
+
+    prompt_eval_time = sum(row['prompt_eval_time'] for row in timed_rows)
+    generation_time = sum(row['generation_time'] for row in timed_rows)
+    generated_tokens = sum(row['generated_tokens'] for row in timed_rows)
+    prompt_eval_share = prompt_eval_time / (prompt_eval_time + generation_time) if prompt_eval_time + generation_time > 0 else 0.0
+    print(f"Prompt evaluation: {get_prompt_eval_rate(rows=timed_rows):.0f} tokens/sec ({prompt_eval_share:.1%} of the inference time)")
+    print(f"Generation: {generated_tokens / generation_time if generation_time > 0 else 0.0:.1f} tokens/sec "
+          f"({1 - prompt_eval_share:.1%} of the inference time)")
+
+    draft_rows = [row for row in timed_rows if row.get('draft_tokens') is not None]
+    draft_tokens = sum(row['draft_tokens'] for row in draft_rows)
+    if draft_tokens:
+        accepted_draft_tokens = sum(row['accepted_draft_tokens'] for row in draft_rows)
+        print(f"Speculative decoding: {accepted_draft_tokens / draft_tokens:.1%} of {draft_tokens} draft tokens accepted "
+              f"({accepted_draft_tokens / sum(row['generated_tokens'] for row in draft_rows):.1%} of the generated tokens)")
+
+    prompt_tokens = [row['prompt_tokens'] for row in timed_rows]
+    total_tokens = [row['prompt_tokens'] + row['generated_tokens'] for row in timed_rows]
+    cached_share = sum(row['cached_prompt_tokens'] or 0 for row in timed_rows) / sum(prompt_tokens) if sum(prompt_tokens) else 0.0
+    print(f"Prompt tokens: {get_percentiles(values=prompt_tokens)} ({cached_share:.1%} reused from the cached prefix)")
+    print(f"Generated tokens: {get_percentiles(values=[row['generated_tokens'] for row in timed_rows])}")
+    print(f"Prompt + generated tokens: {get_percentiles(values=total_tokens)}")
+
+    # PROMPT EVALUATION AND GENERATION TIME BY PROMPT LENGTH
+    print("Prompt tokens | rows | prompt eval (s) | generation (s)")
+    bucket_size = 1024
+    for bucket in sorted(set(tokens // bucket_size for tokens in prompt_tokens)):
+        bucket_rows = [row for row in timed_rows if row['prompt_tokens'] // bucket_size == bucket]
+        print(f"{bucket * bucket_size:>6}-{(bucket + 1) * bucket_size - 1:<6} | {len(bucket_rows):>4} | "
+              f"{np.mean([row['prompt_eval_time'] for row in bucket_rows]):>15.2f} | "
+              f"{np.mean([row['generation_time'] for row in bucket_rows]):>14.2f}")
+
+    # GENERATION SPEED OF EVERY SPECULATIVE DECODING SETUP SEEN IN THE FILE (None = DISABLED)
+    rows_by_speculative_decoding = {}
+    for row in timed_rows:
+        run = runs.get(row['run_id'], {})
+        setup = run.get('speculative_decoding')
+        if setup is not None:
+            setup = f"{setup} ({run.get('num_draft_tokens')} tokens)"
+        rows_by_speculative_decoding.setdefault(setup, []).append(row)
+    if len(rows_by_speculative_decoding) > 1:
+        print("      Speculative decoding | rows | generation tokens/sec")
+        for setup, setup_rows in sorted(rows_by_speculative_decoding.items(), key=lambda item: str(item[0])):
+            setup_generation_time = sum(row['generation_time'] for row in setup_rows)
+            setup_generated_tokens = sum(row['generated_tokens'] for row in setup_rows)
+            print(f"{str(setup):>26} | {len(setup_rows):>4} | "
+                  f"{setup_generated_tokens / setup_generation_time if setup_generation_time > 0 else 0.0:>21.1f}")
+
+    # PROMPT EVALUATION SPEED OF EVERY n_batch SEEN IN THE FILE
+    rows_by_n_batch = {}
+    for row in timed_rows:
+        rows_by_n_batch.setdefault(runs.get(row['run_id'], {}).get('n_batch'), []).append(row)
+    if len(rows_by_n_batch) > 1:
+        print("n_batch | rows | prompt eval tokens/sec")
+        for n_batch, n_batch_rows in sorted(rows_by_n_batch.items(), key=lambda item: item[0] or 0):
+            print(f"{str(n_batch):>7} | {len(n_batch_rows):>4} | {get_prompt_eval_rate(rows=n_batch_rows):>22.0f}")
+
+    print("Tuning hints:")
+    if context_window_size is not None:
+        required_tokens = max(total_tokens)
+        # CONTEXT SIZES ARE CHOSEN IN STEPS OF 1024 TOKENS (SEE TokenBudgeter)
+        suggested_size = int(np.ceil(required_tokens * 1.1 / 1024) * 1024)
+        if failure_reasons.get('context_full'):
+            print(f"    - {failure_reasons['context_full']} rows ran out of context: raise context_window_size "
+                  f"(now {context_window_size}) or shorten the prompt.")
+        elif suggested_size < context_window_size:
+            print(f"    - The longest row used {required_tokens} of {context_window_size} context tokens: "
+                  f"context_window_size={suggested_size} would fit every row with a 10% margin and a smaller KV cache.")
+    if prompt_eval_share > 0.5:
+        print("    - Prompt evaluation takes most of the inference time: raise n_batch (if memory allows), "
+              "enable prefix caching or shorten the prompt (token budgeting).")
+    else:
+        print("    - Generation takes most of the inference time: the output length (or a faster quantization) "
+              "matters more than the prompt length and n_batch.")
+    if draft_tokens and accepted_draft_tokens / draft_tokens < 0.3:
+        print("    - Most draft tokens are rejected (each costs a wasted evaluation): lower num_draft_tokens "
+              "or disable speculative decoding.")
+    if np.percentile(prompt_tokens, 99) > 2 * np.percentile(prompt_tokens, 50):
+        print("    - A few rows have much longer prompts than the rest: a lower token budget for resumes and JDs "
+              "would cut their prompt evaluation time.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Summarizes the labeling metrics file written by predict_scores.py.")
+    parser.add_argument('metrics_path', help="Path of the metrics file (.metrics.jsonl).")
+    parser.add_argument('--all-runs', action='store_true', help="Summarize all runs together instead of only the last one.")
+    args = parser.parse_args()
+
+    runs, rows = load_metrics(metrics_path=args.metrics_path)
+    if not runs:
+        raise SystemExit(f"No runs found in {args.metrics_path}!")
+    last_run = list(runs.values())[-1]
+    if not args.all_runs:
+        rows = [row for row in rows if row['run_id'] == last_run['run_id']]
+        settings = ", ".join(f"{key}={value}" for key, value in last_run.items() if key not in ('type', 'run_id', 'started_at'))
+        print(f"Run {last_run['run_id']}: {settings}")
+    else:
+        print(f"{len(runs)} runs")
+    print_report(runs=runs, rows=rows, context_window_size=last_run.get('context_window_size'))
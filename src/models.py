@@ -1,5 +1,52 @@
-import torch
-from llama_cpp import Llama
+import json
+import time
+import hashlib
+from typing import Callable, Iterator, List, Optional
+from llama_cpp import Llama, LlamaGrammar, LLAMA_DEFAULT_SEED, llama_supports_gpu_offload
+from llama_cpp.llama_chat_format import Jinja2ChatFormatter
+from batch_inference import BatchInferenceEngine
+from speculative_decoding import get_draft_model
+
+
+class JSONObjectTracker:
+    """
+    Tracks streamed model output to detect when the first top-level JSON object is closed.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initialises the parser state.
+        """
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, chunk: str) -> int:
+        """
+        Consumes the next chunk of text. Returns the index in the chunk right after the
+        closing brace of the object, or -1 if the object is still open.
+        """
+        for index, char in enumerate(chunk):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '{':
+                self.depth += 1
+                self.started = True
+            elif not self.started:
+                continue
+            elif char == '"':
+                self.in_string = True
+            elif char == '}':
+                self.depth -= 1
+                if self.depth == 0:
+                    return index + 1
+        return -1
 
 
 class GGUFModel:
@@ -7,41 +54,379 @@ class GGUFModel:
     Class to handle the GGUF model.
     """
 
-    def __init__(self, gguf_model_path: str, system_prompt: str, context_window_size: int, 
-                 verbose: bool = False, n_batch: int = 4, device = 'cuda' if torch.cuda.is_available() else 'cpu') -> None:
+    # SAME SAMPLING AS THE 'create_chat_completion' DEFAULTS
+    SAMPLING_PARAMS = {
+        'temperature': 0.2,
+        'top_p': 0.95,
+        'top_k': 40,
+        'min_p': 0.05,
+        'repeat_penalty': 1.0
+    }
+    PROMPT_SPLIT_MARKER = "<<<INSTRUCTION_PROMPT_SUFFIX>>>"
+
+    def __init__(self, gguf_model_path: str, system_prompt: str, context_window_size: int,
+                 verbose: bool = False, n_batch: int = 512, device = 'cuda' if llama_supports_gpu_offload() else 'cpu',
+                 n_threads: Optional[int] = None, instruction_prefix: Optional[str] = None,
+                 output_schema: Optional[dict] = None, n_ubatch: int = 512, n_parallel: int = 4,
+                 use_mlock: bool = False, seed: int = LLAMA_DEFAULT_SEED, speculative_decoding: Optional[str] = None,
+                 num_draft_tokens: int = 10, draft_model_path: Optional[str] = None) -> None:
         """
-        Initializes the model and its relevant parameters.
+        Initializes the model and its relevant parameters. 'n_threads' pins the number of CPU threads
+        used for both prompt processing and generation (llama.cpp default if None).
+
+        If 'instruction_prefix' is given, the system prompt and this constant start of every
+        instruction prompt are evaluated once and the resulting model state is restored for each
+        request, so that only the variable part of the prompt has to be processed.
+
+        If 'output_schema' (JSON schema) is given, decoding is constrained by the equivalent llama.cpp
+        grammar and generation stops as soon as the JSON object is closed.
+
+        'n_parallel' is the number of sequences decoded together by 'perform_batch_inference'. Its
+        context (with room for 'n_parallel' x 'context_window_size' tokens) is only created on first use.
+
+        The weights are memory-mapped (pages stay in the OS page cache between runs). 'use_mlock' locks
+        them in RAM, so that a long-running process holding the model never has them paged out.
+        A fixed 'seed' makes sampling reproducible (random by default).
+
+        'speculative_decoding' lets a draft propose up to 'num_draft_tokens' tokens that the model
+        verifies in a single evaluation: 'prompt_lookup' copies the continuation of n-grams already
+        seen in the context (JSON keys of the output format, skills from the resume and JD) and
+        'draft_model' generates them with the small GGUF model at 'draft_model_path' (same family and
+        vocabulary). Every token is still sampled from the model. Only single-sequence inference is
+        affected (not 'perform_batch_inference'). llama.cpp then keeps the logits of every context
+        position, which costs 'context_window_size' x vocabulary size x 4 bytes of RAM.
+
+        Token counts and timings of the last call are kept in 'last_inference_stats' (one dict) and
+        'last_batch_inference_stats' (one dict per prompt). With speculative decoding, the drafted
+        and accepted token counts are included.
         """
         try:
             self.system_prompt = system_prompt
+            self.draft_model = None
+            if speculative_decoding is not None:
+                self.draft_model = get_draft_model(
+                    speculative_decoding=speculative_decoding,
+                    num_draft_tokens=num_draft_tokens,
+                    draft_model_path=draft_model_path,
+                    context_window_size=context_window_size,
+                    n_threads=n_threads,
+                    n_gpu_layers=-1 if device=='cuda' else 0
+                )
             self.model = Llama(
                 model_path=gguf_model_path,
                 n_gpu_layers= -1 if device=='cuda' else 0,
                 n_batch=n_batch,
+                n_ubatch=n_ubatch,
                 n_ctx=context_window_size,
+                n_threads=n_threads,
+                n_threads_batch=n_threads,
+                use_mlock=use_mlock,
+                seed=seed,
+                draft_model=self.draft_model,
+                # LLAMA.CPP KEEPS THE LOGITS OF EVERY TOKEN WITH A DRAFT MODEL BUT ONLY SIZES 'scores' FOR
+                # THEM WITH logits_all (OTHERWISE PROMPTS LONGER THAN n_batch FAIL)
+                logits_all=self.draft_model is not None,
                 verbose=verbose
             )
+            if speculative_decoding == 'draft_model' and self.draft_model.draft_model.model.n_vocab() != self.model.n_vocab():
+                raise ValueError("The draft model does not share the vocabulary of the model!")
             if device == 'cuda':
                 print(f"Model located at {gguf_model_path} loaded successfully on GPU.")
             else:
                 print(f"Model located at {gguf_model_path} loaded successfully on CPU.")
         except Exception as e:
             raise RuntimeError(f"An unexpected error occured while trying to load the GGUF model: {str(e)}")
-    
+
+        self.context_window_size = context_window_size
+        self.n_batch = n_batch
+        self.n_ubatch = n_ubatch
+        self.n_parallel = n_parallel
+        self.seed = seed
+        self.verbose = verbose
+        self.batch_engine = None
+        self.last_inference_stats = None
+        self.last_batch_inference_stats = None
+        self.setup_chat_formatter()
+
+        self.grammar = None
+        if output_schema is not None:
+            try:
+                self.grammar = LlamaGrammar.from_json_schema(json.dumps(output_schema), verbose=verbose)
+            except Exception as e:
+                raise RuntimeError(f"An unexpected error occured while trying to build the output grammar: {str(e)}")
+
+        self.instruction_prefix = None
+        if instruction_prefix is not None:
+            self.cache_prompt_prefix(instruction_prefix=instruction_prefix)
+
+    def get_messages(self, instruction_prompt: str) -> List[dict]:
+        """
+        Returns the chat messages for the given instruction prompt.
+        """
+        messages = [
+            {"role": "user", "content": f"{instruction_prompt}"}
+        ]
+        if self.system_prompt is not None:
+            messages.insert(0, {"role": "system", "content": self.system_prompt})
+        return messages
+
+    def get_token_text(self, token_id: int) -> str:
+        """
+        Returns the text of the given special token (empty if the model does not define it).
+        """
+        if token_id < 0:
+            return ""
+        return self.model.detokenize([token_id], special=True).decode('utf-8', errors='ignore')
+
+    def setup_chat_formatter(self) -> None:
+        """
+        Initialises the formatter for the chat template stored in the GGUF file and the stop
+        strings/tokens it uses. Needed for prompt prefix caching and batch inference.
+        """
+        self.chat_formatter = None
+        self.stop = None
+        self.stop_token_ids = [self.model.token_eos()]
+        chat_template = self.model.metadata.get("tokenizer.chat_template")
+        if chat_template is None:
+            return
+        self.chat_formatter = Jinja2ChatFormatter(
+            template=chat_template,
+            eos_token=self.get_token_text(token_id=self.model.token_eos()),
+            bos_token=self.get_token_text(token_id=self.model.token_bos()),
+        )
+        self.stop = self.chat_formatter(messages=self.get_messages(instruction_prompt="")).stop
+        stop_strings = [self.stop] if isinstance(self.stop, str) else list(self.stop or [])
+        for stop_string in stop_strings:
+            stop_tokens = self.model.tokenize(stop_string.encode('utf-8'), add_bos=False, special=True)
+            if len(stop_tokens) == 1:
+                self.stop_token_ids.append(stop_tokens[0])
+
+    def get_prompt_tokens(self, instruction_prompt: str) -> List[int]:
+        """
+        Returns the tokens of the chat-formatted prompt. The cached prefix tokens are reused
+        if the instruction prompt starts with the cached instruction prefix.
+        """
+        if self.chat_formatter is None:
+            raise ValueError("The GGUF file does not contain a chat template!")
+        prompt = self.chat_formatter(messages=self.get_messages(instruction_prompt=instruction_prompt)).prompt
+        if self.instruction_prefix is not None and instruction_prompt.startswith(self.instruction_prefix):
+            if not prompt.startswith(self.prefix_text):
+                raise ValueError("Formatted prompt does not start with the cached prefix!")
+            return self.prefix_tokens + self.model.tokenize(
+                prompt[len(self.prefix_text):].encode('utf-8'), add_bos=False, special=True
+            )
+        return self.model.tokenize(prompt.encode('utf-8'), add_bos=True, special=True)
+
+    def cache_prompt_prefix(self, instruction_prefix: str) -> None:
+        """
+        Evaluates the system prompt and the given constant instruction prefix once and
+        takes a snapshot of the model state to restore before every request.
+        """
+        try:
+            if self.chat_formatter is None:
+                raise ValueError("The GGUF file does not contain a chat template!")
+            formatted_prompt = self.chat_formatter(
+                messages=self.get_messages(instruction_prompt=instruction_prefix + self.PROMPT_SPLIT_MARKER)
+            )
+            self.prefix_text = formatted_prompt.prompt.split(self.PROMPT_SPLIT_MARKER)[0]
+            self.prefix_tokens = self.model.tokenize(self.prefix_text.encode('utf-8'), add_bos=True, special=True)
+
+            self.model.reset()
+            self.model.eval(self.prefix_tokens)
+            self.prefix_state = self.model.save_state()
+            self.instruction_prefix = instruction_prefix
+            print(f"Cached model state for a prompt prefix of {len(self.prefix_tokens)} tokens.")
+        except Exception as e:
+            raise RuntimeError(f"An unexpected error occured while trying to cache the prompt prefix: {str(e)}")
+
+    def restore_prompt_prefix(self) -> None:
+        """
+        Restores the cached prefix state unless the model context still starts with the prefix.
+        """
+        n_prefix_tokens = len(self.prefix_tokens)
+        if self.model.n_tokens < n_prefix_tokens or \
+                self.model.input_ids[:n_prefix_tokens].tolist() != self.prefix_tokens:
+            self.model.load_state(self.prefix_state)
+
+    def get_cached_token_count(self, prompt_tokens: List[int]) -> int:
+        """
+        Returns the number of leading prompt tokens that are already in the model context (and are not evaluated again).
+        """
+        return Llama.longest_token_prefix(self.model.input_ids.tolist(), prompt_tokens)
+
     def perform_inference(self, instruction_prompt: str) -> str:
         """
         Performs inference on the given instruction prompt and returns the model output.
         """
         try:
-            messages = [
-                {"role": "user", "content": f"{instruction_prompt}"}
-            ]
-            if self.system_prompt is not None:
-                messages.insert(0, {"role": "system", "content": self.system_prompt})
+            self.last_inference_stats = None
+            if self.draft_model is not None:
+                self.draft_model.reset()
+            if self.instruction_prefix is not None and instruction_prompt.startswith(self.instruction_prefix):
+                return self.perform_prefix_cached_inference(instruction_prompt=instruction_prompt)
+
+            start_time = time.perf_counter()
+            prompt_tokens = None
+            if self.chat_formatter is not None:
+                prompt_tokens = self.get_prompt_tokens(instruction_prompt=instruction_prompt)
+            self.last_inference_stats = {
+                'prompt_tokens': len(prompt_tokens) if prompt_tokens is not None else None,
+                'cached_prompt_tokens': self.get_cached_token_count(prompt_tokens=prompt_tokens) if prompt_tokens is not None else None
+            }
+            # STREAMED, SO THAT PROMPT EVALUATION (UNTIL THE FIRST TOKEN) AND GENERATION CAN BE TIMED SEPARATELY
             output = self.model.create_chat_completion(
-                messages=messages,
+                messages=self.get_messages(instruction_prompt=instruction_prompt),
+                grammar=self.grammar,
+                stream=True
+            )
+            return self.collect_stream_output(
+                stream=output, get_chunk_text=lambda chunk: chunk['choices'][0]['delta'].get('content') or '',
+                start_time=start_time
             )
-            text = output['choices'][0]['message']['content']
-            return text
         except Exception as e:
             raise RuntimeError(f"An unexpected error occured while trying to perform inference: {str(e)}")
+
+    def perform_prefix_cached_inference(self, instruction_prompt: str) -> str:
+        """
+        Performs inference starting from the cached prefix state. Only the part of the
+        prompt after the prefix is evaluated.
+        """
+        start_time = time.perf_counter()
+        prompt_tokens = self.get_prompt_tokens(instruction_prompt=instruction_prompt)
+
+        self.restore_prompt_prefix()
+        self.last_inference_stats = {
+            'prompt_tokens': len(prompt_tokens),
+            'cached_prompt_tokens': self.get_cached_token_count(prompt_tokens=prompt_tokens)
+        }
+        output = self.model.create_completion(
+            prompt=prompt_tokens,
+            max_tokens=None,
+            stop=self.stop,
+            grammar=self.grammar,
+            stream=True,
+            **self.SAMPLING_PARAMS
+        )
+        return self.collect_stream_output(
+            stream=output, get_chunk_text=lambda chunk: chunk['choices'][0]['text'], start_time=start_time
+        )
+
+    def collect_stream_output(self, stream: Iterator[dict], get_chunk_text: Callable[[dict], str], start_time: float) -> str:
+        """
+        Collects the streamed output. With constrained output, generation stops as soon as the JSON
+        object is closed. The time until the first token (prompt evaluation), the generation time and
+        the number of generated tokens (streamed chunks, about one per token) are added to 'last_inference_stats'.
+        """
+        tracker = JSONObjectTracker() if self.grammar is not None else None
+        text = ""
+        first_token_time = None
+        generated_tokens = 0
+        try:
+            for output_chunk in stream:
+                chunk = get_chunk_text(output_chunk)
+                if not chunk:
+                    continue
+                if first_token_time is None:
+                    first_token_time = time.perf_counter()
+                generated_tokens += 1
+                end_index = tracker.feed(chunk) if tracker is not None else -1
+                if end_index != -1:
+                    text += chunk[:end_index]
+                    break
+                text += chunk
+        finally:
+            stream.close()
+        end_time = time.perf_counter()
+        first_token_time = first_token_time or end_time
+        self.last_inference_stats.update({
+            'generated_tokens': generated_tokens,
+            'prompt_eval_time': first_token_time - start_time,
+            'generation_time': end_time - first_token_time
+        })
+        if self.draft_model is not None:
+            self.last_inference_stats.update(self.draft_model.get_stats())
+        return text
+
+    def perform_batch_inference(self, instruction_prompts: List[str], max_tokens: Optional[int] = None) -> List[Optional[str]]:
+        """
+        Performs inference on all given instruction prompts using 'n_parallel' sequences that are
+        decoded together (continuous batching on a single shared context). Outputs are returned in
+        the order of the prompts (None for prompts that do not fit in the context window).
+        """
+        try:
+            self.last_batch_inference_stats = None
+            if self.batch_engine is None:
+                self.batch_engine = BatchInferenceEngine(
+                    llama=self.model,
+                    n_parallel=self.n_parallel,
+                    context_window_size=self.context_window_size,
+                    n_batch=self.n_batch,
+                    n_ubatch=self.n_ubatch,
+                    sampling_params=self.SAMPLING_PARAMS,
+                    grammar=self.grammar,
+                    stop_token_ids=self.stop_token_ids,
+                    json_tracker_class=JSONObjectTracker if self.grammar is not None else None,
+                    seed=self.seed,
+                    verbose=self.verbose
+                )
+                if self.instruction_prefix is not None:
+                    self.batch_engine.set_prefix(prefix_tokens=self.prefix_tokens)
+
+            prompts_tokens = [
+                self.get_prompt_tokens(instruction_prompt=instruction_prompt) for instruction_prompt in instruction_prompts
+            ]
+            results = self.batch_engine(prompts_tokens=prompts_tokens, max_tokens=max_tokens)
+            self.last_batch_inference_stats = self.batch_engine.request_stats
+            return results
+        except Exception as e:
+            raise RuntimeError(f"An unexpected error occured while trying to perform batch inference: {str(e)}")
+
+
+class FakeGGUFModel:
+    """
+    Stand-in for GGUFModel that returns a schema-valid label after a simulated delay, so that the
+    services around the model can be load-tested without real weights.
+    """
+
+    def __init__(self, prompt_tokens_per_sec: float = 2000.0, generation_seconds: float = 2.0, **kwargs) -> None:
+        """
+        Initialises the simulated speed. Prompt evaluation takes (characters / 4) / 'prompt_tokens_per_sec'
+        seconds and generation takes 'generation_seconds'. Other GGUFModel arguments are accepted and ignored.
+        """
+        self.prompt_tokens_per_sec = prompt_tokens_per_sec
+        self.generation_seconds = generation_seconds
+        self.context_window_size = kwargs.get('context_window_size')
+        self.last_inference_stats = None
+        self.last_batch_inference_stats = None
+
+    def perform_inference(self, instruction_prompt: str) -> str:
+        """
+        Sleeps for the simulated inference time and returns a label derived from the prompt hash.
+        """
+        prompt_tokens = len(instruction_prompt) // 4
+        self.last_inference_stats = {
+            'prompt_tokens': prompt_tokens,
+            'cached_prompt_tokens': 0,
+            'generated_tokens': 256,
+            'prompt_eval_time': prompt_tokens / self.prompt_tokens_per_sec,
+            'generation_time': self.generation_seconds
+        }
+        time.sleep(prompt_tokens / self.prompt_tokens_per_sec + self.generation_seconds)
+        score = int(hashlib.sha256(instruction_prompt.encode('utf-8')).hexdigest(), 16) % 101
+        category = {"score": score}
+        return json.dumps({
+            "summary": "Simulated evaluation.",
+            "match_score": score,
+            "skill_match": {"matched": [], "missing": [], **category},
+            "experience_match": {"matched_years": 0, "required_years": 0, **category},
+            "education_match": {"matched_degree": "", "required_degree": "", **category},
+            "responsibility_match": {"matched": [], "missing": [], **category},
+            "final_assessment": "Simulated evaluation."
+        })
+
+    def perform_batch_inference(self, instruction_prompts: List[str], max_tokens: Optional[int] = None) -> List[Optional[str]]:
+        results, self.last_batch_inference_stats = [], []
+        for instruction_prompt in instruction_prompts:
+            results.append(self.perform_inference(instruction_prompt=instruction_prompt))
+            self.last_batch_inference_stats.append(self.last_inference_stats)
+        return results
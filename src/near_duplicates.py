@@ -0,0 +1,232 @@
+import os
+import re
+import json
+import hashlib
+import numpy as np
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+from utils import get_pair_key, get_text_hash
+
+
+class UnionFind:
+    """
+    Disjoint sets over the integers 0..n-1 (with path compression and union by size).
+    """
+
+    def __init__(self, n: int) -> None:
+        self.parents = list(range(n))
+        self.sizes = [1] * n
+
+    def find(self, item: int) -> int:
+        root = item
+        while self.parents[root] != root:
+            root = self.parents[root]
+        while self.parents[item] != root:
+            self.parents[item], item = root, self.parents[item]
+        return root
+
+    def union(self, first: int, second: int) -> None:
+        first, second = self.find(first), self.find(second)
+        if first == second:
+            return
+        if self.sizes[first] < self.sizes[second]:
+            first, second = second, first
+        self.parents[second] = first
+        self.sizes[first] += self.sizes[second]
+
+
+class NearDuplicateDetector:
+    """
+    Clusters near-duplicate documents using MinHash signatures and locality-sensitive hashing.
+    Documents only get compared when they share an LSH bucket, so the cost grows linearly with
+    the number of documents instead of quadratically.
+    """
+
+    # MERSENNE PRIME USED BY THE UNIVERSAL HASH FUNCTIONS
+    PRIME = (1 << 61) - 1
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 128, shingle_size: int = 5, seed: int = 0) -> None:
+        """
+        Initialises 'num_perm' hash functions and the LSH bands for the given Jaccard similarity threshold.
+        """
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+
+        # A AND B BELOW 2^31 KEEP (A * X + B) FOR 32-BIT X WITHIN UINT64
+        generator = np.random.default_rng(seed)
+        self.a = generator.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self.b = generator.integers(0, 1 << 31, size=num_perm, dtype=np.uint64)
+        self.num_bands, self.rows_per_band = self.get_band_params(threshold=threshold, num_perm=num_perm)
+
+    @staticmethod
+    def get_band_params(threshold: float, num_perm: int) -> Tuple[int, int]:
+        """
+        Returns the (bands, rows per band) split of the signature whose LSH threshold
+        (1 / bands) ^ (1 / rows) is the highest one below the given Jaccard threshold. Candidates
+        are verified afterwards, so a lower LSH threshold only costs comparisons, not precision.
+        """
+        candidates = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+        below_threshold = [params for params in candidates if (1 / params[0]) ** (1 / params[1]) <= threshold]
+        return max(below_threshold or candidates[:1], key=lambda params: (1 / params[0]) ** (1 / params[1]))
+
+    def get_shingle_hashes(self, text: str) -> np.ndarray:
+        """
+        Returns the 32-bit hashes of the word shingles (lower-cased, punctuation removed) of the text.
+        """
+        words = re.findall(r'\w+', str(text).lower())
+        if len(words) < self.shingle_size:
+            shingles = {' '.join(words)}
+        else:
+            shingles = {' '.join(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+        return np.array(
+            [int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=4).digest(), 'little') for shingle in shingles],
+            dtype=np.uint64
+        )
+
+    def get_signature(self, text: str) -> np.ndarray:
+        """
+        Returns the MinHash signature (minimum of every hash function over the shingles) of the text.
+        """
+        shingle_hashes = self.get_shingle_hashes(text=text)
+        hashes = (np.outer(self.a, shingle_hashes) + self.b[:, None]) % np.uint64(self.PRIME)
+        return (hashes & np.uint64(0xFFFFFFFF)).min(axis=1).astype(np.uint32)
+
+    def get_signatures(self, texts: List[str]) -> np.ndarray:
+        """
+        Returns the MinHash signatures of all texts as a (documents x num_perm) matrix.
+        """
+        signatures = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+        for row, text in enumerate(texts):
+            signatures[row] = self.get_signature(text=text)
+        return signatures
+
+    def cluster(self, signatures: np.ndarray) -> UnionFind:
+        """
+        Groups documents that share an LSH bucket in any band and whose estimated Jaccard
+        similarity (fraction of equal signature values) is above the threshold.
+        """
+        clusters = UnionFind(n=len(signatures))
+        for band in range(self.num_bands):
+            band_signatures = signatures[:, band * self.rows_per_band:(band + 1) * self.rows_per_band]
+            buckets = {}
+            for row, band_signature in enumerate(band_signatures):
+                buckets.setdefault(band_signature.tobytes(), []).append(row)
+            for rows in buckets.values():
+                if len(rows) < 2:
+                    continue
+                # EVERY CANDIDATE PAIR OF THE BUCKET IS VERIFIED (A BUCKET CAN HOLD SEVERAL CLUSTERS)
+                for position, row in enumerate(rows[:-1]):
+                    others = [other for other in rows[position + 1:] if clusters.find(other) != clusters.find(row)]
+                    if not others:
+                        continue
+                    similarities = (signatures[others] == signatures[row]).mean(axis=1)
+                    for other, similarity in zip(others, similarities):
+                        if similarity >= self.threshold:
+                            clusters.union(row, other)
+        return clusters
+
+    def __call__(self, documents: Dict[str, str]) -> Dict[str, str]:
+        """
+        Maps every document ID to the ID of the representative of its near-duplicate cluster (the
+        longest document of the cluster). Representatives map to themselves.
+        """
+        ids = list(documents.keys())
+        texts = [documents[doc_id] for doc_id in ids]
+        clusters = self.cluster(signatures=self.get_signatures(texts=texts))
+
+        representatives = {}
+        for row in range(len(ids)):
+            root = clusters.find(row)
+            if root not in representatives or len(texts[row]) > len(texts[representatives[root]]):
+                representatives[root] = row
+        return {doc_id: ids[representatives[clusters.find(row)]] for row, doc_id in enumerate(ids)}
+
+
+class DuplicateMapping:
+    """
+    Mapping of near-duplicate JDs and resumes to their representatives, used to propagate the
+    labels of representative pairs back to every pair they stand for. The texts of the duplicates
+    (which are left out of the pair index) are stored with the mapping.
+    """
+
+    def __init__(self, mapping_path: str) -> None:
+        """
+        Loads the mapping and groups the duplicates by representative.
+        """
+        with open(mapping_path, 'r', encoding='utf-8') as file:
+            mapping = json.load(file)
+        self.threshold = mapping['threshold']
+        self.texts = mapping['texts']
+        self.members = {'jds': {}, 'resumes': {}}
+        for document_type in self.members:
+            for doc_id, rep_id in mapping[document_type].items():
+                self.members[document_type].setdefault(rep_id, []).append(doc_id)
+
+    @staticmethod
+    def get_mapping_path(pair_index_path: str) -> str:
+        """
+        Returns the path the mapping of the given pair index is saved at.
+        """
+        return f"{os.path.splitext(pair_index_path)[0]}.duplicates.json"
+
+    @staticmethod
+    def save(mapping_path: str, threshold: float, jd_representatives: Dict[str, str],
+             resume_representatives: Dict[str, str], jds: Dict[str, str], resumes: Dict[str, str]) -> None:
+        """
+        Saves the duplicate ID -> representative ID mapping of the JDs and resumes (representatives
+        themselves are left out) along with the texts of the duplicates (from 'jds' and 'resumes').
+        """
+        mapping = {
+            'threshold': threshold,
+            'jds': {doc_id: rep_id for doc_id, rep_id in jd_representatives.items() if doc_id != rep_id},
+            'resumes': {doc_id: rep_id for doc_id, rep_id in resume_representatives.items() if doc_id != rep_id}
+        }
+        mapping['texts'] = {
+            'jds': {doc_id: jds[doc_id] for doc_id in mapping['jds']},
+            'resumes': {doc_id: resumes[doc_id] for doc_id in mapping['resumes']}
+        }
+        with open(mapping_path, 'w', encoding='utf-8') as file:
+            json.dump(mapping, file, ensure_ascii=False)
+
+    def iter_propagated_pairs(self, jd_id: str, resume_id: str) -> Iterator[Tuple[str, str]]:
+        """
+        Yields every (jd_id, resume_id) pair that gets the label of the given representative pair,
+        starting with the representative pair itself.
+        """
+        for propagated_jd_id in [jd_id] + self.members['jds'].get(jd_id, []):
+            for propagated_resume_id in [resume_id] + self.members['resumes'].get(resume_id, []):
+                yield propagated_jd_id, propagated_resume_id
+
+    def iter_propagated_records(self, record: dict) -> Iterator[dict]:
+        """
+        Yields the labeled record of a representative pair followed by a copy of it (same response)
+        for every pair of duplicates it stands for, with the texts and IDs of the duplicates.
+        """
+        yield record
+        # RECORDS LABELED BEFORE THE IDS WERE STORED ARE IDENTIFIED BY THEIR CONTENT HASHES
+        rep_jd_id = record.get('jd_id') or get_text_hash(record['JD'])
+        rep_resume_id = record.get('resume_id') or get_text_hash(record['Resume'])
+        propagated_pairs = self.iter_propagated_pairs(jd_id=rep_jd_id, resume_id=rep_resume_id)
+        next(propagated_pairs)
+        for jd_id, resume_id in propagated_pairs:
+            yield {
+                **record,
+                'key': get_pair_key(jd_id=jd_id, resume_id=resume_id),
+                'JD': record['JD'] if jd_id == rep_jd_id else self.texts['jds'][jd_id],
+                'Resume': record['Resume'] if resume_id == rep_resume_id else self.texts['resumes'][resume_id],
+                'jd_id': jd_id,
+                'resume_id': resume_id
+            }
+
+
+def propagate_labels(records: Iterable[dict], duplicate_mapping: DuplicateMapping, labeled_keys: Set[str]) -> Iterator[dict]:
+    """
+    Yields the labeled records along with their copies for the near-duplicate pairs they stand for.
+    Pairs that were labeled themselves ('labeled_keys') keep their own label.
+    """
+    for record in records:
+        propagated_records = duplicate_mapping.iter_propagated_records(record=record)
+        yield next(propagated_records)
+        for propagated_record in propagated_records:
+            if propagated_record['key'] not in labeled_keys:
+                yield propagated_record
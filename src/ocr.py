@@ -0,0 +1,189 @@
+import shlex
+import threading
+import functools
+import numpy as np
+from typing import Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+
+class OCREngine:
+    """
+    OCR shared by image files and scanned PDF pages. Images are decoded (or rasterized) in grayscale,
+    scaled down to 'target_dpi' (only when their resolution is known) and binarized (Otsu) before recognition.
+
+    Tesseract runs through a persistent tesserocr API handle (one per thread, the handle is not
+    thread-safe) when tesserocr is installed, otherwise through pytesseract (a new tesseract process
+    for every image).
+    """
+
+    # CHARACTERS FOUND IN RESUMES, USED BY THE FAST MODE
+    FAST_WHITELIST = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789.,:;@/()+-_&%#|*"
+    # ASSUMED PAGE WIDTH (INCHES) TO ESTIMATE THE DPI HINT PASSED TO TESSERACT FOR IMAGES WITHOUT
+    # RESOLUTION METADATA (THE ESTIMATE IS NEVER USED TO RESIZE THEM)
+    PAGE_WIDTH_INCHES = 8.5
+    # BELOW THIS, RESOLUTION METADATA IS A PLACEHOLDER (E.G. THE 1x1 JFIF DENSITY) RATHER THAN A REAL DPI
+    MINIMUM_METADATA_DPI = 72
+
+    def __init__(self, target_dpi: int = 300, psm: int = 3, oem: int = 3, fast: bool = False, lang: str = 'eng') -> None:
+        """
+        Initialises the OCR settings. 'psm' (page segmentation mode) and 'oem' (OCR engine mode) are
+        passed to tesseract as is. The fast mode restricts recognition to FAST_WHITELIST and skips
+        the detection of inverted (light on dark) text.
+        """
+        self.target_dpi = target_dpi
+        self.psm = psm
+        self.oem = oem
+        self.fast = fast
+        self.lang = lang
+        self.variables = {}
+        if fast:
+            self.variables = {'tessedit_char_whitelist': self.FAST_WHITELIST, 'tessedit_do_invert': '0'}
+
+        try:
+            import tesserocr
+            self.tesserocr = tesserocr
+        except ImportError:
+            self.tesserocr = None
+        self.thread_data = threading.local()
+
+    @property
+    def backend(self) -> str:
+        return 'tesserocr' if self.tesserocr is not None else 'pytesseract'
+
+    def get_api(self):
+        """
+        Returns the tesserocr API handle of the current thread (created on first use).
+        """
+        api = getattr(self.thread_data, 'api', None)
+        if api is None:
+            api = self.tesserocr.PyTessBaseAPI(lang=self.lang, psm=self.psm, oem=self.oem)
+            for name, value in self.variables.items():
+                api.SetVariable(name, value)
+            self.thread_data.api = api
+        return api
+
+    def read_image(self, image_path: str) -> Tuple[np.ndarray, float]:
+        """
+        Decodes the image in grayscale. If the image has resolution metadata, it is scaled down to
+        'target_dpi' (large images are decoded at a reduced resolution of 1/2, 1/4 or 1/8 by the
+        decoder itself before the final resize). Images without it are kept at full resolution and
+        their DPI is estimated from the page width, which is only passed to tesseract as a hint.
+
+        Returns: (image, dpi)
+        """
+        import cv2
+        from PIL import Image
+
+        # ONLY THE HEADER IS READ HERE
+        with Image.open(image_path) as image:
+            source_dpi = self.get_metadata_dpi(image=image)
+            estimated_dpi = image.width / self.PAGE_WIDTH_INCHES
+
+        if source_dpi is None:
+            image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+            if image is None:
+                raise ValueError(f"Could not read the image: {image_path}!")
+            return image, estimated_dpi
+
+        reduction = 1
+        while reduction < 8 and source_dpi / (reduction * 2) >= self.target_dpi:
+            reduction *= 2
+        flags = {1: cv2.IMREAD_GRAYSCALE, 2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                 4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}[reduction]
+        image = cv2.imread(image_path, flags)
+        if image is None:
+            raise ValueError(f"Could not read the image: {image_path}!")
+        return self.scale(image=image, source_dpi=source_dpi / reduction)
+
+    def get_metadata_dpi(self, image) -> Optional[float]:
+        """
+        Returns the resolution stored in the metadata of the (PIL) image, or None if it has none.
+        """
+        dpi = image.info.get('dpi')
+        if not dpi:
+            return None
+        dpi = float(min(dpi))
+        return dpi if dpi >= self.MINIMUM_METADATA_DPI else None
+
+    def scale(self, image: np.ndarray, source_dpi: float) -> Tuple[np.ndarray, float]:
+        """
+        Downscales the image to 'target_dpi' (images at or below it are left as they are).
+
+        Returns: (image, dpi)
+        """
+        import cv2
+
+        if source_dpi <= self.target_dpi:
+            return image, source_dpi
+        scale = self.target_dpi / source_dpi
+        return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA), self.target_dpi
+
+    def binarize(self, image: np.ndarray) -> np.ndarray:
+        """
+        Converts the image to grayscale (if needed) and applies Otsu thresholding.
+        """
+        import cv2
+
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY if image.shape[2] == 3 else cv2.COLOR_RGBA2GRAY)
+        return cv2.threshold(image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+
+    def recognize(self, image: np.ndarray, dpi: float) -> str:
+        """
+        Returns the text of a (grayscale, binarized) image with the given resolution.
+        """
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        if self.tesserocr is not None:
+            api = self.get_api()
+            height, width = image.shape
+            api.SetImageBytes(image.tobytes(), width, height, 1, width)
+            api.SetSourceResolution(int(dpi))
+            return api.GetUTF8Text()
+
+        import pytesseract
+
+        config = f"--psm {self.psm} --oem {self.oem} --dpi {int(dpi)}"
+        for name, value in self.variables.items():
+            config += f" -c {name}={shlex.quote(value)}"
+        return pytesseract.image_to_string(image, lang=self.lang, config=config)
+
+    def image_to_text(self, image_path: str) -> str:
+        """
+        Returns the text of the given image file.
+        """
+        image, dpi = self.read_image(image_path=image_path)
+        return self.recognize(image=self.binarize(image=image), dpi=dpi)
+
+    def page_to_text(self, page_image, source_dpi: Optional[float] = None) -> str:
+        """
+        Returns the text of a rasterized page (PIL image or array, e.g. from pdf2image) rendered at 'source_dpi'.
+        """
+        image, dpi = self.scale(image=np.asarray(page_image), source_dpi=source_dpi or self.target_dpi)
+        return self.recognize(image=self.binarize(image=image), dpi=dpi)
+
+    def close(self) -> None:
+        """
+        Releases the tesserocr handle of the current thread.
+        """
+        api = getattr(self.thread_data, 'api', None)
+        if api is not None:
+            api.End()
+            self.thread_data.api = None
+
+
+@functools.lru_cache(maxsize=None)
+def get_ocr_engine(target_dpi: int = 300, psm: int = 3, oem: int = 3, fast: bool = False, lang: str = 'eng') -> OCREngine:
+    """
+    Returns the OCR engine for the given settings, shared by every Preprocessor of the process so
+    that its tesserocr handles are reused across files.
+    """
+    return OCREngine(target_dpi=target_dpi, psm=psm, oem=oem, fast=fast, lang=lang)
+
+
+@functools.lru_cache(maxsize=None)
+def get_ocr_executor(max_workers: int) -> ThreadPoolExecutor:
+    """
+    Returns the thread pool that OCRs PDF pages, shared by every Preprocessor of the process so that
+    its threads (and the tesserocr handles they hold) live across files.
+    """
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ocr')
@@ -1,88 +1,780 @@
 import os
 import time
 import json
-import pandas as pd
+import queue
+import argparse
+import threading
+import multiprocessing
+from typing import Iterator, List, Optional
 from models import GGUFModel
-from prompts import get_label_generation_system_prompt, get_label_generation_instruction_prompt
+from token_budget import TokenBudgeter
+from scoring_cache import ScoringCache
+from labeling_metrics import LabelingMetrics
+from labeling_manifest import LabelingManifest
+from checkpoint_store import get_checkpoint_store
+from dataset_io import LABELED_PAIR_SCHEMA, count_rows, iter_records, parse_response, write_records
+from near_duplicates import DuplicateMapping, propagate_labels
+from combine_jds_and_resumes import PairIndex
+from prompts import get_label_generation_system_prompt, get_label_generation_instruction_prompt, \
+    get_label_generation_instruction_prefix, get_label_generation_output_schema, LABEL_GENERATION_PROMPT_VERSION
+from utils import get_text_hash, get_pair_key, get_file_fingerprint
+
+
+class InvalidLabelError(Exception):
+    """
+    Raised when the model response is not a valid label. 'reason' ('no_response', 'invalid_json'
+    or 'missing_fields') is recorded in the labeling metrics.
+    """
+
+    def __init__(self, message: str, reason: str) -> None:
+        super().__init__(message)
+        self.reason = reason
+
+
+def validate_label_response(response: Optional[str]) -> str:
+    """
+    Raises an exception if the model response is not a valid JSON with the required fields.
+    """
+    if response is None:
+        raise InvalidLabelError(f"No response generated!", reason='no_response')
+    try:
+        parsed_response = json.loads(response)
+    except json.JSONDecodeError:
+        raise InvalidLabelError(f"Invalid JSON response!", reason='invalid_json')
+
+    required_keys = ["match_score", "summary", "skill_match", "experience_match"]
+    if not isinstance(parsed_response, dict) or not all(key in parsed_response for key in required_keys):
+        raise InvalidLabelError(f"Response JSON missing required fields! Response: {parsed_response}", reason='missing_fields')
+    return response
+
+
+def generate_label(model_handler: GGUFModel, instruction_prompt: str) -> str:
+    """
+    Generates the label (model response) for the instruction prompt of a JD-Resume pair and validates it.
+    """
+    response = model_handler.perform_inference(instruction_prompt=instruction_prompt)
+    return validate_label_response(response=response)
+
+
+def label_row(model_handler: GGUFModel, row: dict) -> dict:
+    """
+    Labels the row (rows found in the scoring cache keep their cached response) and returns the
+    result along with the token counts, timings and failure reason recorded in the labeling metrics.
+    """
+    inference_start_time = time.time()
+    result = {'row': row, 'response': None, 'error': None, 'failure_reason': None, 'stats': None}
+    if row.get('cached_response') is not None:
+        result['response'] = row['cached_response']
+    else:
+        try:
+            result['response'] = generate_label(model_handler=model_handler, instruction_prompt=row['instruction_prompt'])
+        except InvalidLabelError as e:
+            result['error'], result['failure_reason'] = str(e), e.reason
+        except Exception as e:
+            result['error'], result['failure_reason'] = str(e), 'inference_error'
+        result['stats'] = model_handler.last_inference_stats
+    result['inference_time'] = time.time() - inference_start_time
+    return result
+
+
+def label_generation_worker(worker_id: int, model_kwargs: dict, task_queue: multiprocessing.Queue,
+                            result_queue: multiprocessing.Queue) -> None:
+    """
+    Worker process that loads its own GGUF model and labels the rows the parent assigns to it
+    (through its own task queue) until it receives a None sentinel.
+    """
+    try:
+        model_handler = GGUFModel(**model_kwargs)
+    except Exception as e:
+        result_queue.put({'type': 'done', 'worker_id': worker_id, 'error': str(e)})
+        return
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        sequence_no, row = task
+        result_queue.put({
+            'type': 'result', 'worker_id': worker_id, 'sequence_no': sequence_no,
+            **label_row(model_handler=model_handler, row=row)
+        })
+    result_queue.put({'type': 'done', 'worker_id': worker_id, 'error': None})
 
 
 class DatasetCompleterAutomatic:
     """
-    Uses a base model to get and save resume-jd matching scores (label) 
+    Uses a base model to get and save resume-jd matching scores (label)
     on the incomplete dataset.
     """
 
-    def __init__(self, dataset_path: str, output_path: str, gguf_model_path: str, system_prompt: str, context_window_size) -> None:
+    def __init__(self, dataset_path: str, output_path: str, gguf_model_path: str, system_prompt: str, context_window_size,
+                 checkpoint_path: Optional[str] = None, fsync_every: int = 50, num_workers: int = 1,
+                 threads_per_worker: Optional[int] = None, cache_prompt_prefix: bool = True,
+                 constrain_output: bool = True, shard_index: int = 0, num_shards: int = 1,
+                 sample_fraction: float = 1.0, batch_size: int = 1, n_parallel: int = 4,
+                 token_budgeting: bool = True, scoring_cache_path: Optional[str] = None, n_batch: int = 512,
+                 metrics_path: Optional[str] = None, speculative_decoding: Optional[str] = None,
+                 num_draft_tokens: int = 10, draft_model_path: Optional[str] = None,
+                 manifest_path: Optional[str] = None, propagate_duplicates: bool = True) -> None:
         """
         Initialises the parameters needed for dataset completion.
+
+        The dataset can either be a parquet, arrow or excel file with 'JD' and 'Resume' columns (streamed
+        in batches) or a pair index (.json) saved by JDResumeCombiner, whose pairs are generated lazily.
+        Pairs of a pair index can be split into 'num_shards' shards (only 'shard_index' is labeled) and
+        sampled by 'sample_fraction'.
+
+        Labeled rows are appended to an append-only checkpoint store (.jsonl or .sqlite) and the output
+        (.parquet, .arrow or .xlsx, with the parsed response as a typed struct column in parquet/arrow)
+        is only written once at the end of the run (or on demand).
+
+        If 'num_workers' is greater than 1, each worker process loads its own copy of the model
+        with 'threads_per_worker' CPU threads (CPU count split evenly across workers by default).
+
+        If 'cache_prompt_prefix' is True, the model state after the system prompt and the constant
+        instruction prefix is cached and reused for every row.
+
+        If 'batch_size' is greater than 1 (single process only), rows are submitted to the model in
+        chunks of 'batch_size' and decoded 'n_parallel' at a time on a shared context.
+
+        'speculative_decoding' ('prompt_lookup' or 'draft_model' with 'draft_model_path'), lets a draft
+        propose 'num_draft_tokens' tokens at a time for the model to verify (see GGUFModel). It does
+        not apply to batched inference.
+
+        If 'constrain_output' is True, decoding is constrained to the JSON schema of the output format
+        so that the model cannot produce invalid JSON or text around it.
+
+        If 'token_budgeting' is True, resumes and JDs are cleaned of extraction boilerplate and
+        trimmed by section priority so that every prompt fits in 'context_window_size' tokens. The
+        model is then loaded with the smallest context size that fits the longest pending prompt.
+
+        If 'scoring_cache_path' is provided, responses are cached (SQLite) by normalized pair content,
+        prompt version and model file. Pairs found in the cache are not labeled again, and pairs that
+        repeat within the dataset are labeled once.
+
+        Token counts, prompt evaluation and generation times and the JSON parse outcome of every row
+        are appended to 'metrics_path' (<output>.metrics.jsonl by default), see labeling_metrics.py.
+
+        If 'manifest_path' is provided (incremental mode), the source JDs and resumes and the prompt
+        version and model of every labeled pair are tracked in a manifest (SQLite). Only the delta is
+        labeled: new pairs and pairs labeled with another prompt version or model. Their labels
+        replace the old ones in the checkpoint store, so the output is the merged dataset. Labels of
+        removed documents are kept.
+
+        If the pair index was saved with near-duplicate removal (a '<name>.duplicates.json' mapping
+        next to it) and 'propagate_duplicates' is True, the output also gets a row for every pair of
+        near-duplicate documents, with the label of the representative pair.
         """
-        self.model_handler = GGUFModel(
-            gguf_model_path=gguf_model_path, 
-            system_prompt=system_prompt, 
-            context_window_size=context_window_size
-        )
-        self.dataset = pd.read_excel(dataset_path)
-        
+        self.num_workers = max(1, num_workers)
+        self.model_kwargs = {
+            'gguf_model_path': gguf_model_path,
+            'system_prompt': system_prompt,
+            'context_window_size': context_window_size,
+            'instruction_prefix': get_label_generation_instruction_prefix() if cache_prompt_prefix else None,
+            'output_schema': get_label_generation_output_schema() if constrain_output else None,
+            'n_parallel': n_parallel,
+            'n_batch': n_batch,
+            'speculative_decoding': speculative_decoding,
+            'num_draft_tokens': num_draft_tokens,
+            'draft_model_path': draft_model_path
+        }
+        self.batch_size = max(1, batch_size)
+        if os.path.splitext(dataset_path.lower())[1] == '.json':
+            self.pair_index = PairIndex(index_path=dataset_path)
+            self.pair_index_kwargs = {
+                'shard_index': shard_index,
+                'num_shards': num_shards,
+                'sample_fraction': sample_fraction
+            }
+            self.num_rows = sum(1 for _ in self.pair_index.iter_pairs(**self.pair_index_kwargs))
+        else:
+            self.pair_index = None
+            self.num_rows = count_rows(path=dataset_path)
+        self.dataset_path = dataset_path
+
+        self.duplicate_mapping = None
+        mapping_path = DuplicateMapping.get_mapping_path(pair_index_path=dataset_path)
+        if propagate_duplicates and self.pair_index is not None and os.path.exists(mapping_path):
+            self.duplicate_mapping = DuplicateMapping(mapping_path=mapping_path)
+            print(f"Labels will be propagated to near-duplicate pairs using {mapping_path}")
+
         self.output_store_path = output_path
+        self.checkpoint_path = checkpoint_path or f"{os.path.splitext(output_path)[0]}.checkpoint.jsonl"
+        self.checkpoint_store = get_checkpoint_store(store_path=self.checkpoint_path, fsync_every=fsync_every)
+        self.metrics_path = metrics_path or f"{os.path.splitext(output_path)[0]}.metrics.jsonl"
+        self.labeling_metrics = None
+        self.manifest = None
+
+        # OUTPUT FILES WRITTEN BEFORE CHECKPOINT STORES EXISTED ARE IMPORTED ONCE
+        if len(self.checkpoint_store) == 0 and os.path.exists(self.output_store_path):
+            self.import_existing_output()
+
+        if len(self.checkpoint_store) > 0:
+            print(f"Resuming with {len(self.checkpoint_store)} already labeled rows...")
 
-        if os.path.exists(self.output_store_path):
-            self.output_dict = pd.read_excel(self.output_store_path).to_dict(orient="list")
-            self.starting_index = len(self.output_dict['JD'])
-            print(f"Resuming from row {self.starting_index + 1}...")
+        if manifest_path is not None:
+            self.manifest = LabelingManifest(
+                manifest_path=manifest_path, prompt_version=LABEL_GENERATION_PROMPT_VERSION,
+                model_id=get_file_fingerprint(filepath=gguf_model_path), commit_every=fsync_every
+            )
+            self.update_manifest()
+
+        self.scoring_cache = None
+        if scoring_cache_path is not None:
+            self.scoring_cache = ScoringCache(
+                cache_path=scoring_cache_path, gguf_model_path=gguf_model_path, prompt_version=LABEL_GENERATION_PROMPT_VERSION
+            )
+        # ROWS WAITING FOR THE LABEL OF AN IDENTICAL PAIR THAT IS BEING LABELED (BY CACHE KEY)
+        self.duplicate_rows = {}
+        self.duplicate_rows_lock = threading.Lock()
+        # WAITING ROWS TO LABEL THEMSELVES BECAUSE THE ROW THEY WAITED FOR FAILED
+        self.retry_rows = queue.Queue()
+
+        if token_budgeting:
+            self.token_budgeter = TokenBudgeter(gguf_model_path=gguf_model_path, max_context_size=context_window_size)
+            # SYSTEM PROMPT, INSTRUCTIONS AND A MARGIN FOR THE CHAT TEMPLATE TOKENS
+            self.prompt_overhead_tokens = self.token_budgeter.count_tokens(system_prompt) \
+                + self.token_budgeter.count_tokens(get_label_generation_instruction_prompt(resume="", jd="")) + 32
+            self.model_kwargs['context_window_size'] = self.token_budgeter.choose_context_size(
+                required_tokens=self.get_required_context_tokens()
+            )
+            print(f"Using a context window of {self.model_kwargs['context_window_size']} tokens "
+                  f"(maximum {context_window_size})...")
         else:
-            self.output_dict = {
-                'JD': [],
-                'Resume': [],
-                'Response': []
-            }
-            self.starting_index = 0
+            self.token_budgeter = None
+
+        if self.num_workers > 1:
+            self.model_kwargs['n_threads'] = threads_per_worker or max(1, (os.cpu_count() or 1) // self.num_workers)
+            self.model_handler = None
+        else:
+            self.model_kwargs['n_threads'] = threads_per_worker
+            self.model_handler = GGUFModel(**self.model_kwargs)
+
+    @staticmethod
+    def get_row(index: Optional[int], jd: str, resume: str, jd_id: Optional[str] = None,
+                resume_id: Optional[str] = None) -> dict:
+        """
+        Returns a JD-Resume row along with the content hash IDs of both texts and the checkpoint key.
+        """
+        jd_id = jd_id or get_text_hash(jd)
+        resume_id = resume_id or get_text_hash(resume)
+        return {
+            'index': index,
+            'row_key': get_pair_key(jd_id=jd_id, resume_id=resume_id),
+            'jd_id': jd_id,
+            'resume_id': resume_id,
+            'jd': jd,
+            'resume': resume
+        }
+
+    def get_row_status(self, row: dict) -> Optional[str]:
+        """
+        Returns 'new' if the row is not labeled yet, 'stale' if it was labeled with another prompt
+        version or model (incremental mode only) and None if its label is current.
+        """
+        if row['row_key'] not in self.checkpoint_store:
+            return 'new'
+        if self.manifest is None:
+            return None
+        return self.manifest.get_pair_status(pair_key=row['row_key'])
+
+    def update_manifest(self) -> None:
+        """
+        Records the current JDs and resumes in the manifest and counts the rows to label (the delta).
+        Rows labeled before the manifest existed are adopted as labeled with the current prompt
+        version and model.
+        """
+        if len(self.manifest) == 0 and len(self.checkpoint_store) > 0:
+            for record in self.checkpoint_store.iter_records():
+                self.manifest.record_pair(
+                    pair_key=record['key'],
+                    jd_id=record.get('jd_id') or get_text_hash(record['JD']),
+                    resume_id=record.get('resume_id') or get_text_hash(record['Resume'])
+                )
+            self.manifest.flush()
+            print(f"Adopted {len(self.checkpoint_store)} rows labeled before the manifest existed as labeled with "
+                  f"prompt version {LABEL_GENERATION_PROMPT_VERSION} and the current model.")
+
+        delta = {'new': 0, 'stale': 0}
+        jd_ids, resume_ids = set(), set()
+        for row in self.iter_rows():
+            jd_ids.add(row['jd_id'])
+            resume_ids.add(row['resume_id'])
+            status = self.get_row_status(row=row)
+            if status is not None:
+                delta[status] += 1
+        # THE PAIR INDEX HOLDS EVERY DOCUMENT, EVEN THOSE WITHOUT PAIRS IN THIS SHARD OR SAMPLE
+        if self.pair_index is not None:
+            jd_ids, resume_ids = set(self.pair_index.jds), set(self.pair_index.resumes)
+
+        for document_type, doc_ids in (('jds', jd_ids), ('resumes', resume_ids)):
+            changes = self.manifest.update_documents(doc_type=document_type, doc_ids=doc_ids)
+            print(f"{changes['total']} {document_type} ({changes['new']} new, {changes['removed']} removed since the last run)")
+        self.num_pending_rows = delta['new'] + delta['stale']
+        print(f"Delta: {delta['new']} new pairs and {delta['stale']} pairs labeled with another prompt version or model "
+              f"({self.manifest.count_orphaned_pairs()} labeled pairs of removed documents are kept).")
+
+    def import_existing_output(self) -> None:
+        """
+        Copies the rows of an existing output file into the checkpoint store.
+        """
+        for row in iter_records(path=self.output_store_path, columns=['JD', 'Resume', 'Response']):
+            self.save_row(row=self.get_row(index=None, jd=row['JD'], resume=row['Resume']), response=row['Response'])
+        self.checkpoint_store.flush()
+
+    def export_output(self) -> None:
+        """
+        Saves all labeled rows from the checkpoint store (with their parsed responses) to the output
+        path, along with the rows propagated to near-duplicate pairs (if any).
+        """
+        def transform(record: dict) -> dict:
+            return {**record, 'parsed_response': parse_response(response=record['Response'])}
+
+        if self.duplicate_mapping is None:
+            self.checkpoint_store.export(output_path=self.output_store_path, schema=LABELED_PAIR_SCHEMA, transform=transform)
+            return
+
+        self.checkpoint_store.flush()
+        records = propagate_labels(
+            records=self.checkpoint_store.iter_records(), duplicate_mapping=self.duplicate_mapping,
+            labeled_keys=self.checkpoint_store.completed_keys
+        )
+        write_records(path=self.output_store_path, records=records, schema=LABELED_PAIR_SCHEMA, transform=transform)
+
+    def iter_rows(self) -> Iterator[dict]:
+        """
+        Yields every row of the dataset (or pair index).
+        """
+        if self.pair_index is None:
+            for index, row in enumerate(iter_records(path=self.dataset_path, columns=['JD', 'Resume'])):
+                yield self.get_row(index=index, jd=row['JD'], resume=row['Resume'])
+            return
+
+        for index, (jd_id, resume_id) in enumerate(self.pair_index.iter_pairs(**self.pair_index_kwargs)):
+            yield self.get_row(
+                index=index, jd=self.pair_index.jds[jd_id], resume=self.pair_index.resumes[resume_id],
+                jd_id=jd_id, resume_id=resume_id
+            )
+
+    def iter_pending_rows(self) -> Iterator[dict]:
+        """
+        Yields every row that is not labeled yet, along with its instruction prompt. Rows found in
+        the scoring cache are yielded with their 'cached_response' instead, and rows identical to a
+        row that is already being labeled are held back until that row is saved (or yielded at the
+        end if that row failed, see 'release_duplicate_rows').
+        """
+        for row in self.iter_rows():
+            if self.get_row_status(row=row) is None:
+                continue
+            if self.scoring_cache is not None:
+                row['cache_key'] = self.scoring_cache.get_key(resume=row['resume'], jd=row['jd'])
+                with self.duplicate_rows_lock:
+                    if row['cache_key'] in self.duplicate_rows:
+                        self.duplicate_rows[row['cache_key']].append(row)
+                        continue
+                    row['cached_response'] = self.scoring_cache.get(key=row['cache_key'])
+                    if row['cached_response'] is None:
+                        self.duplicate_rows[row['cache_key']] = []
+                if row['cached_response'] is not None:
+                    yield row
+                    continue
+            row['instruction_prompt'] = self.get_instruction_prompt(row=row)
+            yield row
+        yield from self.iter_retry_rows()
 
-    def save_current_output_dict(self) -> None:
+    def iter_retry_rows(self) -> Iterator[dict]:
         """
-        Saves current version of the output as an excel file in the provided directory.
+        Yields the rows queued by 'release_duplicate_rows' until the queue is empty.
         """
-        output_df = pd.DataFrame(self.output_dict)
-        output_df.to_excel(self.output_store_path, index=False)
+        while not self.retry_rows.empty():
+            yield self.retry_rows.get()
+
+    def release_duplicate_rows(self, row: dict) -> None:
+        """
+        Called when the given row could not be labeled. The first row identical to it that was held
+        back is queued to be labeled instead, and the other identical rows wait for that one.
+        """
+        if self.scoring_cache is None or 'cache_key' not in row or row.get('cached_response') is not None:
+            return
+        with self.duplicate_rows_lock:
+            duplicate_rows = self.duplicate_rows.pop(row['cache_key'], [])
+            if duplicate_rows:
+                self.duplicate_rows[row['cache_key']] = duplicate_rows[1:]
+        if duplicate_rows:
+            duplicate_rows[0]['instruction_prompt'] = self.get_instruction_prompt(row=duplicate_rows[0])
+            self.retry_rows.put(duplicate_rows[0])
+
+    def get_required_context_tokens(self) -> int:
+        """
+        Returns the context size needed by the longest pending row after token budgeting.
+        """
+        required_tokens = 0
+        for row in self.iter_rows():
+            if self.get_row_status(row=row) is None:
+                continue
+            required_tokens = max(required_tokens, self.token_budgeter.get_required_context_tokens(
+                resume=row['resume'], jd=row['jd'], prompt_overhead_tokens=self.prompt_overhead_tokens,
+                resume_id=row['resume_id'], jd_id=row['jd_id']
+            ))
+        return required_tokens
+
+    def get_instruction_prompt(self, row: dict) -> str:
+        """
+        Returns the instruction prompt of the row. With token budgeting, the resume and JD are
+        normalized and truncated to fit the context window (the stored row keeps the original texts).
+        """
+        if self.token_budgeter is None:
+            return get_label_generation_instruction_prompt(resume=row['resume'], jd=row['jd'])
+        resume, jd, _ = self.token_budgeter.fit(
+            resume=row['resume'], jd=row['jd'], prompt_overhead_tokens=self.prompt_overhead_tokens,
+            resume_id=row['resume_id'], jd_id=row['jd_id']
+        )
+        return get_label_generation_instruction_prompt(resume=resume, jd=jd)
+
+    def save_row(self, row: dict, response: str) -> None:
+        """
+        Appends the labeled row (and the rows identical to it) to the checkpoint store, and the
+        response to the scoring cache.
+        """
+        self.checkpoint_store.append(
+            key=row['row_key'],
+            record={
+                'JD': row['jd'], 'Resume': row['resume'], 'Response': response,
+                'jd_id': row['jd_id'], 'resume_id': row['resume_id']
+            }
+        )
+        if self.manifest is not None:
+            self.manifest.record_pair(pair_key=row['row_key'], jd_id=row['jd_id'], resume_id=row['resume_id'])
+        if self.scoring_cache is None or 'cache_key' not in row:
+            return
+        if row.get('cached_response') is None:
+            self.scoring_cache.put(key=row['cache_key'], response=response)
+        with self.duplicate_rows_lock:
+            duplicate_rows = self.duplicate_rows.pop(row['cache_key'], [])
+        for duplicate_row in duplicate_rows:
+            duplicate_row['cached_response'] = response
+            self.save_row(row=duplicate_row, response=response)
+            if self.labeling_metrics is not None:
+                self.labeling_metrics.record_row(row=duplicate_row, source='duplicate')
 
     def __call__(self) -> None:
         """
-        Uses the specified model to predict and validate the output and 
-        store it in the excel file.
+        Uses the specified model(s) to predict and validate the output and
+        store it in the checkpoint store. Everything is exported to the output file at the end.
+        """
+        self.labeling_metrics = LabelingMetrics(
+            metrics_path=self.metrics_path,
+            total_rows=self.num_pending_rows if self.manifest is not None else max(0, self.num_rows - len(self.checkpoint_store)),
+            run_config={
+                'context_window_size': self.model_kwargs['context_window_size'],
+                'n_batch': self.model_kwargs['n_batch'],
+                'speculative_decoding': self.model_kwargs['speculative_decoding'],
+                'num_draft_tokens': self.model_kwargs['num_draft_tokens'],
+                'num_workers': self.num_workers,
+                'batch_size': self.batch_size,
+                'n_parallel': self.model_kwargs['n_parallel'],
+                'cache_prompt_prefix': self.model_kwargs['instruction_prefix'] is not None,
+                'constrain_output': self.model_kwargs['output_schema'] is not None,
+                'token_budgeting': self.token_budgeter is not None,
+                'incremental': self.manifest is not None,
+                'model': os.path.basename(self.model_kwargs['gguf_model_path'])
+            }
+        )
+        try:
+            if self.num_workers > 1:
+                self.label_rows_in_parallel()
+            elif self.batch_size > 1:
+                self.label_rows_in_batches()
+            else:
+                self.label_rows()
+        finally:
+            self.checkpoint_store.flush()
+            if self.manifest is not None:
+                self.manifest.flush()
+            self.labeling_metrics.close()
+            self.labeling_metrics = None
+            print(f"Labeling metrics saved to {self.metrics_path} (summary: python labeling_metrics.py {self.metrics_path})")
+        self.export_output()
+
+        if self.scoring_cache is not None:
+            stats = self.scoring_cache.get_stats()
+            print(f"Scoring cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate)")
+
+    def label_rows(self) -> None:
+        """
+        Labels all pending rows one after another using a single model.
+        """
+        for row in self.iter_pending_rows():
+            result = label_row(model_handler=self.model_handler, row=row)
+            self.record_metrics(result=result)
+            if result['response'] is not None and row.get('cached_response') is None:
+                print(result['response'])
+            self.save_result(result=result)
+
+    def label_rows_in_batches(self) -> None:
+        """
+        Labels all pending rows in chunks of 'batch_size' using batched inference.
+        """
+        rows = []
+        pending_rows = self.iter_pending_rows()
+        while True:
+            for row in pending_rows:
+                if row.get('cached_response') is not None:
+                    self.save_row(row=row, response=row['cached_response'])
+                    self.labeling_metrics.record_row(row=row, source='cache')
+                    continue
+                rows.append(row)
+                if len(rows) == self.batch_size:
+                    self.label_batch(rows=rows)
+                    rows = []
+            if rows:
+                self.label_batch(rows=rows)
+                rows = []
+            # ROWS RELEASED BY FAILED ROWS OF THE LAST BATCH
+            if self.retry_rows.empty():
+                break
+            pending_rows = self.iter_retry_rows()
+
+    def label_batch(self, rows: List[dict]) -> None:
         """
-        for index, row in self.dataset.iloc[self.starting_index:].iterrows():
+        Labels the given rows with a single batched inference call and saves the valid responses.
+        """
+        print(f"\n\nProcessing rows {rows[0]['index'] + 1} to {rows[-1]['index'] + 1} out of {self.num_rows}...\n\n")
+        instruction_prompts = [row['instruction_prompt'] for row in rows]
+        inference_start_time = time.time()
+        try:
+            responses = self.model_handler.perform_batch_inference(instruction_prompts=instruction_prompts)
+        except Exception as e:
+            print(f"Skipping rows {rows[0]['index'] + 1} to {rows[-1]['index'] + 1}: {str(e)}")
+            for row in rows:
+                self.labeling_metrics.record_row(row=row, failure_reason='inference_error')
+                self.release_duplicate_rows(row=row)
+            return
+        inference_time = time.time() - inference_start_time
+        print(f"Inference time taken: {inference_time:.2f} seconds ({len(rows) / inference_time:.3f} rows/sec)")
+
+        # THE INFERENCE TIME OF EVERY ROW IS THE TIME OF THE WHOLE BATCH
+        for row, response, stats in zip(rows, responses, self.model_handler.last_batch_inference_stats):
+            result = {'row': row, 'response': None, 'error': None, 'failure_reason': None, 'stats': stats,
+                      'inference_time': inference_time}
             try:
-                print(f"\n\nProcessing row {index + 1} out of {len(self.dataset)}...\n\n")
-                resume = row['Resume']
-                jd = row['JD']
-                instruction_prompt = get_label_generation_instruction_prompt(resume=resume, jd=jd)
-                inference_start_time = time.time()
-                response = self.model_handler.perform_inference(instruction_prompt=instruction_prompt)
-                print(f"Inference time taken: {(time.time() - inference_start_time):.2f} seconds")
-                print(response)
-                try:
-                    parsed_response = json.loads(response)
-                    
-                    required_keys = ["match_score", "summary", "skill_match", "experience_match"]
-                    if not all(key in parsed_response for key in required_keys):
-                        raise ValueError(f"Response JSON missing required fields! Response: {parsed_response}")
-                except json.JSONDecodeError:
-                    raise Exception(f"Invalid JSON response!")
-                
-                self.output_dict['JD'].append(jd)
-                self.output_dict['Resume'].append(resume)
-                self.output_dict['Response'].append(response)
-                self.save_current_output_dict()
-            except Exception as e:
-                print(f"Skipping row {index+1}: {str(e)}")
-                continue
+                result['response'] = validate_label_response(response=response)
+            except InvalidLabelError as e:
+                result['error'], result['failure_reason'] = str(e), e.reason
+            self.record_metrics(result=result)
+            self.save_result(result=result)
+
+    def label_rows_in_parallel(self, tasks_per_worker: int = 1) -> None:
+        """
+        Labels all pending rows using a pool of worker processes (one model each). Every row is
+        assigned to a worker by this process (at most 'tasks_per_worker' rows in flight per worker,
+        rows queued behind the row that kills a worker are lost with it) and results are written by
+        this (single writer) process in the original row order.
+
+        If a worker dies (e.g. killed for running out of memory) or fails to load its model, the
+        rows assigned to it are skipped as failed right away, so that the results of the other
+        workers keep being written. A result arriving after its row was skipped is dropped.
+        """
+        context = multiprocessing.get_context()
+        task_queues = [context.Queue() for _ in range(self.num_workers)]
+        result_queue = context.Queue()
+        workers = [
+            context.Process(
+                target=label_generation_worker,
+                args=(worker_id, self.model_kwargs, task_queues[worker_id], result_queue),
+                daemon=True
+            )
+            for worker_id in range(self.num_workers)
+        ]
+        for worker in workers:
+            worker.start()
+        print(f"Started {self.num_workers} workers with {self.model_kwargs['n_threads']} threads each...")
+
+        # TASKS WHOSE RESULT IS NOT SAVED YET (A FAILED ROW CAN STILL RELEASE IDENTICAL ROWS TO LABEL),
+        # THEIR ROWS BY SEQUENCE NUMBER AND THE SEQUENCE NUMBERS IN FLIGHT ON EVERY USABLE WORKER
+        feed_state = {
+            'outstanding_tasks': 0, 'rows': {}, 'assigned': {worker_id: set() for worker_id in range(self.num_workers)}
+        }
+        feed_condition = threading.Condition()
+
+        def assign_task(sequence_no: int, row: dict) -> bool:
+            # THE ASSIGNMENT IS RECORDED BEFORE THE WORKER CAN SEE THE TASK, SO A DEAD WORKER NEVER TAKES A TASK UNNOTICED
+            with feed_condition:
+                assigned = feed_state['assigned']
+                while assigned and min(len(sequence_nos) for sequence_nos in assigned.values()) >= tasks_per_worker:
+                    feed_condition.wait()
+                if not assigned:
+                    return False
+                worker_id = min(assigned, key=lambda worker_id: len(assigned[worker_id]))
+                assigned[worker_id].add(sequence_no)
+                feed_state['rows'][sequence_no] = row
+                feed_state['outstanding_tasks'] += 1
+            task_queues[worker_id].put((sequence_no, row))
+            return True
+
+        def feed_tasks() -> None:
+            sequence_no = 0
+            for row in self.iter_pending_rows():
+                if not assign_task(sequence_no=sequence_no, row=row):
+                    return
+                sequence_no += 1
+            while True:
+                with feed_condition:
+                    if self.retry_rows.empty() and feed_state['outstanding_tasks'] == 0:
+                        break
+                    if self.retry_rows.empty():
+                        feed_condition.wait(timeout=0.5)
+                        continue
+                    row = self.retry_rows.get()
+                if not assign_task(sequence_no=sequence_no, row=row):
+                    return
+                sequence_no += 1
+            for task_queue in task_queues:
+                task_queue.put(None)
+
+        feeder = threading.Thread(target=feed_tasks, daemon=True)
+        feeder.start()
+
+        start_time = time.time()
+        worker_rows = {worker_id: 0 for worker_id in range(self.num_workers)}
+        finished_workers = set()
+        pending_results = {}
+        next_sequence_no = 0
+        # SEQUENCE NUMBERS SKIPPED BECAUSE THEIR WORKER DIED OR COULD NOT LOAD ITS MODEL
+        lost_sequence_nos = set()
+
+        def skip_worker_tasks(worker_id: int, error: str) -> None:
+            with feed_condition:
+                sequence_nos = feed_state['assigned'].pop(worker_id, set())
+                rows = {sequence_no: feed_state['rows'][sequence_no] for sequence_no in sequence_nos}
+                feed_condition.notify_all()
+            for sequence_no in sorted(sequence_nos):
+                lost_sequence_nos.add(sequence_no)
+                result = {
+                    'row': rows[sequence_no], 'response': None, 'error': error, 'failure_reason': 'worker_died',
+                    'stats': None, 'inference_time': None, 'worker_id': worker_id
+                }
+                self.record_metrics(result=result)
+                pending_results[sequence_no] = result
+
+        while len(finished_workers) < self.num_workers:
+            try:
+                message = result_queue.get(timeout=1)
+            except queue.Empty:
+                message = None
+
+            if message is None:
+                pass
+            elif message['type'] == 'done':
+                finished_workers.add(message['worker_id'])
+                if message['error'] is not None:
+                    print(f"Worker {message['worker_id']} failed: {message['error']}")
+                    skip_worker_tasks(worker_id=message['worker_id'], error=f"Worker {message['worker_id']} failed: {message['error']}")
+            elif message['sequence_no'] in lost_sequence_nos:
+                # THE ROW WAS ALREADY SKIPPED (AND ITS IDENTICAL ROWS POSSIBLY RELEASED TO BE LABELED)
+                print(f"Dropping the late result of row {message['row']['index'] + 1} from worker {message['worker_id']}")
+            else:
+                with feed_condition:
+                    feed_state['assigned'].get(message['worker_id'], set()).discard(message['sequence_no'])
+                    feed_condition.notify_all()
+                worker_rows[message['worker_id']] += 1
+                # METRICS ARE RECORDED WHEN RESULTS ARRIVE, ROWS ARE SAVED IN ROW ORDER
+                self.record_metrics(result=message)
+                pending_results[message['sequence_no']] = message
+
+            # WORKERS THAT DIED WITHOUT SAYING GOODBYE (A CLEAN EXIT ALWAYS SENDS 'done' FIRST)
+            for worker_id, worker in enumerate(workers):
+                if worker_id in finished_workers or worker.exitcode is None or worker.exitcode == 0:
+                    continue
+                finished_workers.add(worker_id)
+                print(f"Worker {worker_id} died (exit code {worker.exitcode})!")
+                skip_worker_tasks(worker_id=worker_id, error=f"Worker {worker_id} died while labeling the row!")
+
+            # WRITING RESULTS IN ROW ORDER
+            while next_sequence_no in pending_results:
+                self.save_result(pending_results.pop(next_sequence_no))
+                with feed_condition:
+                    feed_state['outstanding_tasks'] -= 1
+                    feed_state['rows'].pop(next_sequence_no, None)
+                    feed_condition.notify_all()
+                next_sequence_no += 1
+
+            if message is None and not any(worker.is_alive() for worker in workers):
+                print("All workers exited unexpectedly!")
+                break
+
+        # RESULTS STUCK BEHIND ROWS THAT NO WORKER LABELED (ALL WORKERS DIED)
+        for sequence_no in sorted(pending_results):
+            self.save_result(pending_results[sequence_no])
+
+        for worker in workers:
+            worker.join(timeout=5)
+
+        elapsed_time = time.time() - start_time
+        for worker_id, rows in worker_rows.items():
+            print(f"Worker {worker_id}: {rows} rows ({rows / elapsed_time:.3f} rows/sec)")
+        print(f"Total: {sum(worker_rows.values())} rows ({sum(worker_rows.values()) / elapsed_time:.3f} rows/sec)")
+
+    def record_metrics(self, result: dict) -> None:
+        """
+        Records the metrics of a labeling result and prints the progress of rows labeled by the model.
+        """
+        source = 'cache' if result['row'].get('cached_response') is not None else 'model'
+        record = self.labeling_metrics.record_row(
+            row=result['row'], stats=result['stats'], failure_reason=result['failure_reason'],
+            inference_time=result['inference_time'], source=source, worker_id=result.get('worker_id')
+        )
+        if source == 'model':
+            worker = f"Worker {result['worker_id']}: " if result.get('worker_id') is not None else ""
+            print(worker + self.labeling_metrics.format_progress(record=record))
+
+    def save_result(self, result: dict) -> None:
+        """
+        Appends a labeling result to the checkpoint store (or reports why the row was skipped).
+        """
+        if result['error'] is not None:
+            print(f"Skipping row {result['row']['index'] + 1}: {result['error']}")
+            self.release_duplicate_rows(row=result['row'])
+            return
+        self.save_row(row=result['row'], response=result['response'])
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generates resume-jd matching score labels for the dataset.")
+    parser.add_argument('--workers', type=int, default=1, help="Number of worker processes (one model each).")
+    parser.add_argument('--threads-per-worker', type=int, default=None, help="CPU threads pinned to each worker.")
+    parser.add_argument('--shard-index', type=int, default=0, help="Shard of the pair index to label.")
+    parser.add_argument('--num-shards', type=int, default=1, help="Number of shards the pair index is split into.")
+    parser.add_argument('--sample-fraction', type=float, default=1.0, help="Fraction of the pairs to label.")
+    parser.add_argument('--batch-size', type=int, default=1, help="Rows submitted to batched inference at once.")
+    parser.add_argument('--n-parallel', type=int, default=4, help="Sequences decoded together in batched inference.")
+    parser.add_argument('--n-batch', type=int, default=512, help="Prompt tokens evaluated per llama.cpp batch.")
+    parser.add_argument('--speculative-decoding', choices=['prompt_lookup', 'draft_model'], default=None,
+                        help="Draft tokens for the model to verify (by prompt lookup or with --draft-model).")
+    parser.add_argument('--num-draft-tokens', type=int, default=10, help="Tokens drafted per verification.")
+    parser.add_argument('--draft-model', default=None, help="Small GGUF model of the same family used as draft model.")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only label new pairs and pairs labeled with another prompt version or model (tracked in a manifest).")
+    args = parser.parse_args()
+
     dataset_completer = DatasetCompleterAutomatic(
-        dataset_path="/home/omkanekar28/code/Resume-Evaluator/data/dataset_without_labels.xlsx",
-        output_path="dataset.xlsx",
+        dataset_path="/home/omkanekar28/code/Resume-Evaluator/data/pair_index.json",
+        output_path="dataset.parquet",
         gguf_model_path="/home/omkanekar28/code/Resume-Evaluator/models/qwen2.5-7b-instruct-q5_k_m-00001-of-00002.gguf",
         system_prompt=get_label_generation_system_prompt(),
-        context_window_size=8000
+        context_window_size=8000,
+        num_workers=args.workers,
+        threads_per_worker=args.threads_per_worker,
+        shard_index=args.shard_index,
+        num_shards=args.num_shards,
+        sample_fraction=args.sample_fraction,
+        batch_size=args.batch_size,
+        n_parallel=args.n_parallel,
+        n_batch=args.n_batch,
+        speculative_decoding=args.speculative_decoding,
+        num_draft_tokens=args.num_draft_tokens,
+        draft_model_path=args.draft_model,
+        scoring_cache_path="/home/omkanekar28/code/Resume-Evaluator/data/scoring_cache.sqlite",
+        manifest_path="/home/omkanekar28/code/Resume-Evaluator/data/labeling_manifest.sqlite" if args.incremental else None
     )
     dataset_completer()
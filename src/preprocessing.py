@@ -1,24 +1,54 @@
-import re
 import os 
-import pytesseract
-import cv2
-import pymupdf4llm
-import pdf2image
-from docx import Document
-from typing import Tuple
+import time
+import threading
+from typing import Iterator, Optional, Tuple
+from contextlib import contextmanager
+from extraction_cache import ExtractionCache
+from ocr import get_ocr_engine, get_ocr_executor
+
+# FORM FEED BETWEEN THE PAGES OF EXTRACTED PDFS (USED TO DETECT HEADERS/FOOTERS, SEE TokenBudgeter)
+PAGE_SEPARATOR = "\f"
 
 
 class Preprocessor:
     """
     Handles preprocessing of various input types (text, file paths) 
     for the resume evaluator. Detects input type, validates it, and extracts text accordingly.
+
+    The extraction libraries (pymupdf4llm, pdf2image, python-docx and the OCR libraries, see ocr.py)
+    are imported by the methods that use them, so that only the libraries needed for a file type are loaded.
     """
 
-    def __init__(self, minimum_input_threshold: int = 400) -> None:
+    # BUMP WHENEVER EXTRACTION LOGIC CHANGES SO THAT CACHED TEXTS ARE NOT REUSED
+    EXTRACTOR_VERSION = "6"
+
+    def __init__(self, minimum_input_threshold: int = 400, cache_dir: Optional[str] = None,
+                 cache_max_size_mb: int = 512, minimum_page_text_threshold: int = 50,
+                 ocr_dpi: int = 300, ocr_workers: Optional[int] = None, ocr_psm: int = 3,
+                 ocr_oem: int = 3, ocr_fast: bool = False) -> None:
         """
-        Initialises constants to be used in preprocessing.
+        Initialises constants to be used in preprocessing. If 'cache_dir' is provided, extracted
+        texts are cached on disk by file content hash.
+
+        PDF pages with less than 'minimum_page_text_threshold' characters of editable text are
+        rasterized at 'ocr_dpi' and OCRed by up to 'ocr_workers' threads (a pool shared by every
+        Preprocessor of the process). Images are scaled down to 'ocr_dpi' before OCR only if their
+        resolution metadata says they are larger, images without it are OCRed at full resolution. 'ocr_psm', 'ocr_oem' and 'ocr_fast' configure the OCR engine (see OCREngine).
         """
         self.minimum_input_threshold = minimum_input_threshold
+        self.minimum_page_text_threshold = minimum_page_text_threshold
+        self.ocr_dpi = ocr_dpi
+        self.ocr_workers = ocr_workers or min(4, os.cpu_count() or 1)
+        self.ocr_settings = {'target_dpi': ocr_dpi, 'psm': ocr_psm, 'oem': ocr_oem, 'fast': ocr_fast}
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = ExtractionCache(
+                cache_dir=cache_dir, extractor_version=self.EXTRACTOR_VERSION, max_size_mb=cache_max_size_mb
+            )
+        self.extraction_method = None
+        self.page_count = None
+        self.stage_timings = {}
+        self.stage_timings_lock = threading.Lock()
         self.file_extensions = {
             'Image': ('.jpg', '.jpeg', '.png', '.webp'),
             'Docx': ('.docx',),
@@ -31,6 +61,7 @@ class Preprocessor:
         Uses the input-type relevant function to return the text present inside.
         """
         print("Performing input preprocessing...")
+        self.stage_timings = {}
         is_valid, input_type = self.validate_input(input_str=input_str)
 
         # VALIDATING THE INPUT
@@ -51,6 +82,16 @@ class Preprocessor:
 
         print(f"Detected file type: {self.file_type}")
 
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.get_key(file_path=self.input)
+            cached_entry = self.cache.get(key=cache_key)
+            if cached_entry is not None:
+                print(f"Using cached text (extracted using {cached_entry['method']})")
+                self.extraction_method = cached_entry['method']
+                self.page_count = cached_entry['page_count']
+                return cached_entry['text']
+
         if self.file_type == 'PDF':
             text = self.pdf_to_text(pdf_path=self.input)
         
@@ -63,9 +104,29 @@ class Preprocessor:
         if len(text) < self.minimum_input_threshold:
             raise ValueError(f"Insufficient text found! Only {len(text)} characters of text were detected in the {self.file_type} file!")
         
-        text = self.remove_illegal_chars(value=text)
+        if cache_key is not None:
+            self.cache.put(key=cache_key, entry={
+                'text': text,
+                'method': self.extraction_method,
+                'page_count': self.page_count,
+                'file_type': self.file_type
+            })
         return text
 
+    @contextmanager
+    def time_stage(self, stage: str) -> Iterator[None]:
+        """
+        Adds the time taken by the enclosed block to the total of the given stage in 'stage_timings'. 
+        Stages running in parallel threads (page OCR) add up their individual durations.
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_time = time.perf_counter() - start_time
+            with self.stage_timings_lock:
+                self.stage_timings[stage] = self.stage_timings.get(stage, 0.0) + elapsed_time
+
     def validate_file_type(self, file_path: str) -> Tuple[bool, str]:
         """
         Checks the type of file and if it is valid or not.
@@ -99,57 +160,80 @@ class Preprocessor:
     
     def pdf_to_text(self, pdf_path: str) -> str:
         """
-        Uses pytesseract (non-editable) or pymupdf4llm (editable) to extract text 
-        from the given PDF.
-        """
-        text = pymupdf4llm.to_markdown(doc=pdf_path)
-
-        # IF ENOUGH EDITABLE TEXT
-        if len(text) > self.minimum_input_threshold:
-            return text
-        
-        print("Not enough editable text detected. Performing OCR...")
-        pages = pdf2image.convert_from_path(pdf_path=pdf_path)
-        ocr_text = ""
-
-        # PERFORMING OCR FOR EACH PAGE
-        for page_no, page in enumerate(pages):
-            print(f"Processing page {page_no + 1} out of {len(pages)}...")
-            current_page_text = pytesseract.image_to_string(page)
-            ocr_text += current_page_text
-
-        return ocr_text
+        Uses pymupdf4llm (editable) to extract text from the given PDF page by page. Only pages 
+        without a usable text layer are rasterized (one at a time) and passed to the OCR engine. 
+        OCR of those pages runs in parallel and the page order is kept. Pages are separated by PAGE_SEPARATOR.
+        """
+        import pymupdf4llm
+
+        with self.time_stage(stage='pymupdf4llm'):
+            page_chunks = pymupdf4llm.to_markdown(doc=pdf_path, page_chunks=True)
+        self.page_count = len(page_chunks)
+        page_texts = [page_chunk['text'] for page_chunk in page_chunks]
+
+        # PAGES WITHOUT ENOUGH EDITABLE TEXT
+        ocr_page_numbers = [
+            page_no for page_no, page_text in enumerate(page_texts)
+            if len(page_text.strip()) < self.minimum_page_text_threshold
+        ]
+        if not ocr_page_numbers:
+            self.extraction_method = 'pymupdf4llm'
+            return PAGE_SEPARATOR.join(page_texts)
+
+        print(f"Not enough editable text detected on {len(ocr_page_numbers)} out of {self.page_count} pages. Performing OCR...")
+        executor = get_ocr_executor(max_workers=self.ocr_workers)
+        ocr_texts = executor.map(lambda page_no: self.ocr_pdf_page(pdf_path=pdf_path, page_no=page_no), ocr_page_numbers)
+        for page_no, ocr_text in zip(ocr_page_numbers, ocr_texts):
+            page_texts[page_no] = ocr_text
+
+        self.extraction_method = 'ocr' if len(ocr_page_numbers) == self.page_count else 'pymupdf4llm+ocr'
+        return PAGE_SEPARATOR.join(page_texts)
+
+    def ocr_pdf_page(self, pdf_path: str, page_no: int) -> str:
+        """
+        Rasterizes a single page (0-indexed) of the given PDF in grayscale and returns its text using the OCR engine.
+        """
+        import pdf2image
+
+        print(f"Processing page {page_no + 1} out of {self.page_count}...")
+        ocr_engine = get_ocr_engine(**self.ocr_settings)
+        with self.time_stage(stage='pdf2image'):
+            pages = pdf2image.convert_from_path(
+                pdf_path=pdf_path, dpi=self.ocr_dpi, first_page=page_no + 1, last_page=page_no + 1, grayscale=True
+            )
+        with self.time_stage(stage='ocr'):
+            return ocr_engine.page_to_text(page_image=pages[0], source_dpi=self.ocr_dpi)
         
     def image_to_text(self, image_path: str) -> str:
         """
-        Uses pytesseract to detect and return the text that is present in the given image.
+        Uses the OCR engine to detect and return the text that is present in the given image.
         """
-        image = cv2.imread(image_path)
-
-        # PREPROCESS FOR BETTER OCR ACCURACY
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        processed_image = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+        ocr_engine = get_ocr_engine(**self.ocr_settings)
+        with self.time_stage(stage='cv2'):
+            # GRAYSCALE, SCALED TO THE OCR DPI AND BINARIZED FOR BETTER OCR ACCURACY
+            image, dpi = ocr_engine.read_image(image_path=image_path)
+            processed_image = ocr_engine.binarize(image=image)
         
-        print("Performing OCR using PyTesseract...")
-        text = pytesseract.image_to_string(processed_image)
+        print(f"Performing OCR using {ocr_engine.backend}...")
+        with self.time_stage(stage='ocr'):
+            text = ocr_engine.recognize(image=processed_image, dpi=dpi)
+        self.extraction_method = 'ocr'
+        self.page_count = 1
         return text
         
     def docx_to_text(self, docx_path: str) -> str:
         """
         Uses python-docx library to extract text from a .docx file.
         """
-        doc = Document(docx_path)
-        text = "\n".join([para.text for para in doc.paragraphs])
+        from docx import Document
+
+        with self.time_stage(stage='python-docx'):
+            doc = Document(docx_path)
+            text = "\n".join([para.text for para in doc.paragraphs])
+        self.extraction_method = 'python-docx'
+        self.page_count = None
         return text
     
-    def remove_illegal_chars(self, value: str) -> str:
-        """
-        Removes illegal characters from the string while preserving newlines.
-        """
-        if isinstance(value, str):
-            return re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', value)  # Excludes \n (\x0A) and \r (\x0D)
-        return value
-
 if __name__ == '__main__':
     ##############################
     # USE BELOW CODE FOR TESTING #
@@ -0,0 +1,255 @@
+"""
+Offline step that tokenizes the training dataset once (with the chat template used for training),
+packs the conversations into sequences of up to MAX_SEQ_LENGTH tokens and saves them as a
+memory-mapped cache that training.py loads directly.
+
+Run before training:
+
+python pretokenize.py
+"""
+
+import os
+import json
+import bisect
+import numpy as np
+import torch
+import training_config as config
+from typing import List, Optional
+from datasets import load_dataset
+from transformers import AutoTokenizer
+from utils import get_text_hash, get_file_fingerprint
+
+
+def get_cache_key(tokenizer, max_seq_length: int, pack_sequences: bool) -> str:
+    """
+    Returns the key of the tokenized cache. It changes with the tokenizer, the chat template, the
+    dataset file and every config value that affects the tokenized splits.
+    """
+    return get_text_hash(json.dumps({
+        'tokenizer': tokenizer.name_or_path,
+        'vocab_size': tokenizer.vocab_size,
+        'chat_template': get_text_hash(tokenizer.chat_template or ''),
+        'chat_template_name': config.CHAT_TEMPLATE,
+        'dataset': get_file_fingerprint(filepath=config.DATASET_PATH, sample_size=os.path.getsize(config.DATASET_PATH)),
+        'dataset_shuffle_seed': config.DATASET_SHUFFLE_SEED,
+        'split_shuffle_seed': config.SPLIT_SHUFFLE_SEED,
+        'validation_split_size': config.VALIDATION_SPLIT_SIZE,
+        'max_seq_length': max_seq_length,
+        'pack_sequences': pack_sequences
+    }, sort_keys=True))[:16]
+
+
+def get_cache_dir(tokenizer) -> str:
+    return os.path.join(
+        config.PRETOKENIZED_CACHE_DIR,
+        get_cache_key(tokenizer=tokenizer, max_seq_length=config.MAX_SEQ_LENGTH, pack_sequences=config.PACK_SEQUENCES)
+    )
+
+
+def tokenize_conversations(tokenizer, conversations: List[list], max_seq_length: int) -> List[List[int]]:
+    """
+    Applies the chat template to every conversation and returns the token IDs (truncated to 'max_seq_length').
+    """
+    return [
+        list(tokenizer.apply_chat_template(conversation, tokenize=True, add_generation_prompt=False))[:max_seq_length]
+        for conversation in conversations
+    ]
+
+
+def pack_sequences(lengths: List[int], max_seq_length: int) -> List[List[int]]:
+    """
+    Groups sequences (by index) into packs of at most 'max_seq_length' tokens using best-fit
+    decreasing bin packing (every sequence goes to the fullest pack it still fits in).
+    """
+    packs = []
+    # (REMAINING CAPACITY, PACK INDEX) SORTED BY REMAINING CAPACITY
+    capacities = []
+    for index in sorted(range(len(lengths)), key=lambda index: lengths[index], reverse=True):
+        position = bisect.bisect_left(capacities, (lengths[index], -1))
+        if position == len(capacities):
+            packs.append([index])
+            pack_index, remaining = len(packs) - 1, max_seq_length
+        else:
+            remaining, pack_index = capacities.pop(position)
+            packs[pack_index].append(index)
+        bisect.insort(capacities, (remaining - lengths[index], pack_index))
+    return packs
+
+
+def save_split(split_dir: str, sequences: List[List[int]], packs: List[List[int]]) -> None:
+    """
+    Saves the packed split as flat memory-mapped arrays: the token IDs, the position IDs (restarting
+    at 0 for every sequence, which marks the attention boundaries) and the offsets of every pack.
+    """
+    os.makedirs(split_dir, exist_ok=True)
+    pack_lengths = [sum(len(sequences[index]) for index in pack) for pack in packs]
+    offsets = np.zeros(len(packs) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(pack_lengths)
+
+    input_ids = np.lib.format.open_memmap(os.path.join(split_dir, "input_ids.npy"), mode='w+', dtype=np.int32, shape=(int(offsets[-1]),))
+    position_ids = np.lib.format.open_memmap(os.path.join(split_dir, "position_ids.npy"), mode='w+', dtype=np.int32, shape=(int(offsets[-1]),))
+    position = 0
+    for pack in packs:
+        for index in pack:
+            sequence_length = len(sequences[index])
+            input_ids[position:position + sequence_length] = sequences[index]
+            position_ids[position:position + sequence_length] = np.arange(sequence_length, dtype=np.int32)
+            position += sequence_length
+    input_ids.flush()
+    position_ids.flush()
+    np.save(os.path.join(split_dir, "offsets.npy"), offsets)
+
+
+def get_padding_report(lengths: List[int], packs: List[List[int]], max_seq_length: int, batch_size: int,
+                       gradient_accumulation_steps: int) -> dict:
+    """
+    Compares padding waste and tokens per optimizer step of the packed split with batching the
+    unpacked sequences (padded to the longest sequence of every batch).
+    """
+    real_tokens = sum(lengths)
+    padded_tokens = sum(
+        max(lengths[start:start + batch_size]) * len(lengths[start:start + batch_size])
+        for start in range(0, len(lengths), batch_size)
+    )
+    pack_lengths = [sum(lengths[index] for index in pack) for pack in packs]
+    packed_padded_tokens = sum(
+        max(pack_lengths[start:start + batch_size]) * len(pack_lengths[start:start + batch_size])
+        for start in range(0, len(pack_lengths), batch_size)
+    )
+    sequences_per_step = batch_size * gradient_accumulation_steps
+    return {
+        'sequences': len(lengths),
+        'packs': len(packs),
+        'real_tokens': real_tokens,
+        'max_seq_length': max_seq_length,
+        'unpacked_padding_ratio': 1 - real_tokens / padded_tokens if padded_tokens else 0.0,
+        'packed_padding_ratio': 1 - real_tokens / packed_padded_tokens if packed_padded_tokens else 0.0,
+        'unpacked_steps': int(np.ceil(len(lengths) / sequences_per_step)),
+        'packed_steps': int(np.ceil(len(packs) / sequences_per_step)),
+        'unpacked_tokens_per_step': real_tokens / max(1, int(np.ceil(len(lengths) / sequences_per_step))),
+        'packed_tokens_per_step': real_tokens / max(1, int(np.ceil(len(packs) / sequences_per_step)))
+    }
+
+
+class PackedDataset(torch.utils.data.Dataset):
+    """
+    Memory-mapped tokenized split saved by this script. Every item is one pack of sequences.
+    """
+
+    def __init__(self, split_dir: str) -> None:
+        self.input_ids = np.load(os.path.join(split_dir, "input_ids.npy"), mmap_mode='r')
+        self.position_ids = np.load(os.path.join(split_dir, "position_ids.npy"), mmap_mode='r')
+        self.offsets = np.load(os.path.join(split_dir, "offsets.npy"))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def get_length(self, index: int) -> int:
+        return int(self.offsets[index + 1] - self.offsets[index])
+
+    def __getitem__(self, index: int) -> dict:
+        start, end = self.offsets[index], self.offsets[index + 1]
+        input_ids = torch.from_numpy(np.array(self.input_ids[start:end], dtype=np.int64))
+        position_ids = torch.from_numpy(np.array(self.position_ids[start:end], dtype=np.int64))
+        labels = input_ids.clone()
+        # NO LOSS ON THE FIRST TOKEN OF A SEQUENCE (IT WOULD BE PREDICTED FROM THE PREVIOUS SEQUENCE)
+        labels[position_ids == 0] = -100
+        return {'input_ids': input_ids, 'position_ids': position_ids, 'labels': labels}
+
+
+class PackedDataCollator:
+    """
+    Pads packs to the longest pack of the batch. No attention mask is passed, so attention is
+    limited to each sequence by the restarting position IDs (padding forms its own sequence), which
+    only holds with flash attention 2. Unpacked rows only need causal attention (padding comes last).
+    """
+
+    def __init__(self, pad_token_id: int) -> None:
+        self.pad_token_id = pad_token_id
+
+    def __call__(self, features: List[dict]) -> dict:
+        max_length = max(len(feature['input_ids']) for feature in features)
+        batch = {'input_ids': [], 'position_ids': [], 'labels': []}
+        for feature in features:
+            padding = max_length - len(feature['input_ids'])
+            batch['input_ids'].append(torch.cat([feature['input_ids'], torch.full((padding,), self.pad_token_id)]))
+            batch['position_ids'].append(torch.cat([feature['position_ids'], torch.arange(padding)]))
+            batch['labels'].append(torch.cat([feature['labels'], torch.full((padding,), -100)]))
+        return {key: torch.stack(values) for key, values in batch.items()}
+
+
+def supports_packed_attention(model) -> bool:
+    """
+    Returns True if the model attends through flash attention 2 (varlen), the only attention path on
+    which the restarting position IDs keep packed sequences apart. On any other path (eager, SDPA,
+    e.g. on a T4) every sequence of a pack would attend to the sequences packed before it.
+    """
+    from transformers.utils import is_flash_attn_2_available
+
+    return is_flash_attn_2_available() and getattr(model.config, '_attn_implementation', None) == 'flash_attention_2'
+
+
+def load_packed_splits(tokenizer, model) -> Optional[tuple]:
+    """
+    Returns the (train, eval) packed datasets for the current tokenizer and config, or None if they
+    were not saved yet or if they contain packs of several sequences and the model does not support
+    packed attention (see 'supports_packed_attention').
+    """
+    cache_dir = get_cache_dir(tokenizer=tokenizer)
+    if not os.path.exists(os.path.join(cache_dir, "report.json")):
+        return None
+    with open(os.path.join(cache_dir, "report.json"), 'r') as file:
+        report = json.load(file)
+    is_packed = any(split_report['packs'] < split_report['sequences'] for split_report in report.values())
+    if is_packed and not supports_packed_attention(model=model):
+        print("The dataset cache packs several sequences per row but the model does not use flash attention 2, "
+              "tokenizing the dataset on the fly instead (set PACK_SEQUENCES = False and rerun pretokenize.py).")
+        return None
+    return PackedDataset(split_dir=os.path.join(cache_dir, "train")), PackedDataset(split_dir=os.path.join(cache_dir, "eval"))
+
+
+if __name__ == '__main__':
+    from unsloth.chat_templates import get_chat_template
+
+    tokenizer = AutoTokenizer.from_pretrained(config.MODEL_NAME)
+    tokenizer = get_chat_template(tokenizer, chat_template=config.CHAT_TEMPLATE)
+    cache_dir = get_cache_dir(tokenizer=tokenizer)
+
+    # SAME SHUFFLING AND SPLIT AS training.py
+    dataset = load_dataset("json", data_files=config.DATASET_PATH, split='train')
+    dataset = dataset.shuffle(seed=config.DATASET_SHUFFLE_SEED)
+    dataset = dataset.train_test_split(test_size=config.VALIDATION_SPLIT_SIZE, shuffle=True, seed=config.SPLIT_SHUFFLE_SEED)
+
+    if config.PACK_SEQUENCES:
+        from transformers.utils import is_flash_attn_2_available
+
+        if not is_flash_attn_2_available():
+            print("WARNING: flash attention 2 is not available, training will not use packed rows "
+                  "(set PACK_SEQUENCES = False for an unpacked cache).")
+
+    report = {}
+    for split, split_dataset in (('train', dataset['train']), ('eval', dataset['test'])):
+        sequences = tokenize_conversations(
+            tokenizer=tokenizer, conversations=split_dataset['conversations'], max_seq_length=config.MAX_SEQ_LENGTH
+        )
+        lengths = [len(sequence) for sequence in sequences]
+        if config.PACK_SEQUENCES:
+            packs = pack_sequences(lengths=lengths, max_seq_length=config.MAX_SEQ_LENGTH)
+        else:
+            packs = [[index] for index in range(len(sequences))]
+        save_split(split_dir=os.path.join(cache_dir, split), sequences=sequences, packs=packs)
+        report[split] = get_padding_report(
+            lengths=lengths, packs=packs, max_seq_length=config.MAX_SEQ_LENGTH,
+            batch_size=config.PER_DEVICE_TRAIN_BATCH_SIZE if split == 'train' else config.PER_DEVICE_EVAL_BATCH_SIZE,
+            gradient_accumulation_steps=config.GRADIENT_ACCUMULATION_STEPS if split == 'train' else 1
+        )
+
+    # THE REPORT IS WRITTEN LAST, SO IT ALSO MARKS THE CACHE AS COMPLETE
+    with open(os.path.join(cache_dir, "report.json"), 'w') as file:
+        json.dump(report, file, indent=4)
+
+    for split, split_report in report.items():
+        print(f"{split}: {split_report['sequences']} sequences packed into {split_report['packs']} rows")
+        print(f"    padding: {split_report['unpacked_padding_ratio']:.1%} unpacked -> {split_report['packed_padding_ratio']:.1%} packed")
+        print(f"    tokens/step: {split_report['unpacked_tokens_per_step']:.0f} unpacked -> {split_report['packed_tokens_per_step']:.0f} packed")
+    print(f"Tokenized cache saved to {cache_dir}")
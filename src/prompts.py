@@ -1,6 +1,9 @@
 ############################
 # DATASET LABEL GENERATION #
 ############################
+# CHANGE WHENEVER THE LABEL GENERATION PROMPTS OR OUTPUT SCHEMA CHANGE (INVALIDATES CACHED SCORES)
+LABEL_GENERATION_PROMPT_VERSION = "1"
+
 def get_label_generation_system_prompt() -> str:
     """
     Gives system prompt for dataset label (resume match score) generation.
@@ -17,11 +20,12 @@ def get_label_generation_system_prompt() -> str:
     Your primary role is to generate structured resume-job fit assessments that help automate candidate evaluation efficiently.
     """
 
-def get_label_generation_instruction_prompt(resume: str, jd: str) -> str:
+def get_label_generation_instruction_prefix() -> str:
     """
-    Gives instruction prompt for dataset label (resume match score) generation.
+    Gives the constant part of the label generation instruction prompt. Every instruction 
+    prompt starts with this text, which lets the model cache its evaluated state.
     """
-    return f"""
+    return """
     You are an AI-powered Resume Evaluator, tasked with analyzing how well a given resume matches a specific job description. Your response must be structured and contain a detailed breakdown of the match. 
 
     **Instructions:**  
@@ -30,31 +34,31 @@ def get_label_generation_instruction_prompt(resume: str, jd: str) -> str:
     - Provide a structured JSON output with the following fields:  
 
     **Output Format:**  
-    {{
+    {
         "summary": "A brief summary of how well the resume matches the job description.",
         "match_score": "A percentage (0-100) indicating the overall match strength.",
-        "skill_match": {{
+        "skill_match": {
             "matched": ["List of skills from the JD found in the resume"],
             "missing": ["List of important skills from the JD missing in the resume"],
             "score": "A percentage score (0-100) based on skill relevance."
-        }},
-        "experience_match": {{
+        },
+        "experience_match": {
             "matched_years": "Number of years of relevant experience found in the resume.",
             "required_years": "Number of years required as per the JD.",
             "score": "A percentage score (0-100) indicating experience match."
-        }},
-        "education_match": {{
+        },
+        "education_match": {
             "matched_degree": "Degree(s) from the resume that match the JD requirements.",
             "required_degree": "Degree(s) specified in the JD.",
             "score": "A percentage score (0-100) for education match."
-        }},
-        "responsibility_match": {{
+        },
+        "responsibility_match": {
             "matched": ["Key responsibilities from the JD found in the resume"],
             "missing": ["Key responsibilities missing from the resume"],
             "score": "A percentage score (0-100) indicating responsibility match."
-        }},
+        },
         "final_assessment": "A brief verdict on whether the candidate is a strong, moderate, or weak fit."
-    }}
+    }
 
     **Evaluation Guidelines:**  
     - Consider exact and semantic similarity while matching skills, experience, and responsibilities.  
@@ -64,11 +68,58 @@ def get_label_generation_instruction_prompt(resume: str, jd: str) -> str:
 
     **Now, evaluate the following resume against the job description:**  
     **Resume:**  
-    {resume}  
+"""
+
+def get_label_generation_instruction_prompt(resume: str, jd: str) -> str:
+    """
+    Gives instruction prompt for dataset label (resume match score) generation.
+    """
+    return get_label_generation_instruction_prefix() + f"""    {resume}  
 
     **Job Description:**  
     {jd}  
 
     Provide your structured JSON response accordingly.
     """
-    
\ No newline at end of file
+
+def get_label_generation_output_schema() -> dict:
+    """
+    Gives the JSON schema of the output format described in the label generation instruction prompt. 
+    Used to constrain the model output during decoding.
+    """
+    score = {"type": "integer", "minimum": 0, "maximum": 100}
+    string_list = {"type": "array", "items": {"type": "string"}}
+
+    def get_object_schema(properties: dict) -> dict:
+        return {
+            "type": "object",
+            "properties": properties,
+            "required": list(properties.keys()),
+            "additionalProperties": False
+        }
+
+    return get_object_schema({
+        "summary": {"type": "string"},
+        "match_score": score,
+        "skill_match": get_object_schema({
+            "matched": string_list,
+            "missing": string_list,
+            "score": score
+        }),
+        "experience_match": get_object_schema({
+            "matched_years": {"type": ["number", "string"]},
+            "required_years": {"type": ["number", "string"]},
+            "score": score
+        }),
+        "education_match": get_object_schema({
+            "matched_degree": {"type": "string"},
+            "required_degree": {"type": "string"},
+            "score": score
+        }),
+        "responsibility_match": get_object_schema({
+            "matched": string_list,
+            "missing": string_list,
+            "score": score
+        }),
+        "final_assessment": {"type": "string"}
+    })
\ No newline at end of file
@@ -0,0 +1,124 @@
+import time
+import sqlite3
+import threading
+from typing import Optional
+from utils import get_text_hash, get_normalized_text_hash, get_file_fingerprint
+
+
+class ScoringCache:
+    """
+    Persistent (SQLite) cache of model responses for JD-Resume pairs. Entries are keyed by the
+    normalized resume and JD texts, the prompt version and the model file, so a change to any of
+    them never returns a stale score. Entries expire after 'ttl_seconds' and the least recently
+    used entries are evicted beyond 'max_entries'.
+    """
+
+    def __init__(self, cache_path: str, gguf_model_path: str, prompt_version: str,
+                 ttl_seconds: Optional[float] = None, max_entries: Optional[int] = None) -> None:
+        """
+        Opens (or creates) the cache database and fingerprints the model file.
+        """
+        self.cache_path = cache_path
+        self.model_id = get_file_fingerprint(filepath=gguf_model_path)
+        self.prompt_version = prompt_version
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0}
+
+        # SHARED BETWEEN THE THREADS OF THE EVALUATION SERVICE
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.cache_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_accessed_at REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS scores_last_accessed_at ON scores (last_accessed_at)")
+        self.connection.commit()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+
+    def __enter__(self) -> 'ScoringCache':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def get_key(self, resume: str, jd: str) -> str:
+        """
+        Returns the cache key of the JD-Resume pair.
+        """
+        return get_text_hash(
+            f"{get_normalized_text_hash(resume)}:{get_normalized_text_hash(jd)}:{self.prompt_version}:{self.model_id}"
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the cached response for the key, or None on a miss (or an expired entry).
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.connection.execute("SELECT response, created_at FROM scores WHERE key = ?", (key,)).fetchone()
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            response, created_at = entry
+            if self.ttl_seconds is not None and now - created_at > self.ttl_seconds:
+                self.connection.execute("DELETE FROM scores WHERE key = ?", (key,))
+                self.connection.commit()
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+            self.connection.execute("UPDATE scores SET last_accessed_at = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+            self.stats['hits'] += 1
+            return response
+
+    def put(self, key: str, response: str) -> None:
+        """
+        Saves the response against the key and evicts the least recently used entries if needed.
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO scores (key, response, created_at, last_accessed_at) VALUES (?, ?, ?, ?)",
+                (key, response, now, now)
+            )
+            if self.max_entries is not None:
+                evicted = self.connection.execute(
+                    "DELETE FROM scores WHERE key IN (SELECT key FROM scores ORDER BY last_accessed_at DESC "
+                    "LIMIT -1 OFFSET ?)", (self.max_entries,)
+                ).rowcount
+                self.stats['evicted'] += max(0, evicted)
+            self.connection.commit()
+
+    def remove_expired(self) -> int:
+        """
+        Deletes all expired entries and returns their count.
+        """
+        if self.ttl_seconds is None:
+            return 0
+        with self.lock:
+            removed = self.connection.execute(
+                "DELETE FROM scores WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            ).rowcount
+            self.connection.commit()
+        self.stats['expired'] += removed
+        return removed
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups > 0 else 0.0
+
+    def get_stats(self) -> dict:
+        """
+        Returns the hit/miss/eviction counters and the hit rate.
+        """
+        return {**self.stats, 'hit_rate': self.hit_rate}
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,122 @@
+import numpy as np
+from typing import List, Optional
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+
+
+class SmallModelDraft(LlamaDraftModel):
+    """
+    Drafts tokens greedily with a small GGUF model of the same family (same vocabulary) as the
+    main model. The draft model keeps its evaluated context between calls and only evaluates the
+    tokens that changed since the previous call.
+
+    The draft model is loaded without 'logits_all' (which would keep n_ctx x n_vocab logits), so
+    'Llama.scores' is never filled by eval(). The logits of the last evaluated token are read from
+    the llama.cpp context instead.
+    """
+
+    def __init__(self, draft_model_path: str, context_window_size: int, num_pred_tokens: int = 10,
+                 n_threads: Optional[int] = None, n_gpu_layers: int = 0) -> None:
+        """
+        Loads the draft model with the same context size as the main model.
+        """
+        self.num_pred_tokens = num_pred_tokens
+        self.model = Llama(
+            model_path=draft_model_path,
+            n_ctx=context_window_size,
+            n_threads=n_threads,
+            n_threads_batch=n_threads,
+            n_gpu_layers=n_gpu_layers,
+            verbose=False
+        )
+
+    def __call__(self, input_ids: np.ndarray, /, **kwargs) -> np.ndarray:
+        input_ids = input_ids.tolist()
+        # THE LAST INPUT TOKEN IS ALWAYS EVALUATED TO GET LOGITS FOR THE FIRST DRAFT TOKEN
+        n_reused = min(Llama.longest_token_prefix(self.model.input_ids.tolist(), input_ids), len(input_ids) - 1)
+        self.model.n_tokens = n_reused
+        self.model._ctx.kv_cache_seq_rm(-1, n_reused, -1)
+        self.model.eval(input_ids[n_reused:])
+
+        draft_tokens = []
+        while len(draft_tokens) < self.num_pred_tokens and self.model.n_tokens < self.model.n_ctx():
+            token = int(np.argmax(self.get_last_logits()))
+            if token == self.model.token_eos():
+                break
+            draft_tokens.append(token)
+            if len(draft_tokens) < self.num_pred_tokens:
+                self.model.eval([token])
+        return np.array(draft_tokens, dtype=np.intc)
+
+    def get_last_logits(self) -> np.ndarray:
+        """
+        Returns the logits of the last token of the last eval() (the only output of its batch).
+        """
+        return np.ctypeslib.as_array(self.model._ctx.get_logits(), shape=(self.model.n_vocab(),))
+
+
+class CountingDraftModel(LlamaDraftModel):
+    """
+    Wraps a draft model and counts the drafted tokens verified by the main model and how many of
+    them were accepted. llama.cpp calls the draft model again after every verification, with the
+    accepted draft tokens (and the token sampled after them) appended to the input.
+    """
+
+    def __init__(self, draft_model: LlamaDraftModel) -> None:
+        self.draft_model = draft_model
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Resets the counts (called before every completion).
+        """
+        self.draft_tokens = 0
+        self.accepted_draft_tokens = 0
+        self.pending_draft = None
+        self.input_length = 0
+
+    def __call__(self, input_ids: np.ndarray, /, **kwargs) -> np.ndarray:
+        # THE PREVIOUS DRAFT HAS BEEN VERIFIED, ITS ACCEPTED TOKENS START THE NEW PART OF THE INPUT
+        if self.pending_draft is not None:
+            new_tokens = input_ids[self.input_length:].tolist()
+            self.draft_tokens += len(self.pending_draft)
+            self.accepted_draft_tokens += get_common_prefix_length(self.pending_draft, new_tokens)
+
+        draft_tokens = self.draft_model(input_ids, **kwargs)
+        self.pending_draft = draft_tokens.tolist()
+        self.input_length = len(input_ids)
+        return draft_tokens
+
+    def get_stats(self) -> dict:
+        return {'draft_tokens': self.draft_tokens, 'accepted_draft_tokens': self.accepted_draft_tokens}
+
+
+def get_common_prefix_length(first: List[int], second: List[int]) -> int:
+    length = 0
+    for first_token, second_token in zip(first, second):
+        if first_token != second_token:
+            break
+        length += 1
+    return length
+
+
+def get_draft_model(speculative_decoding: str, num_draft_tokens: int = 10, draft_model_path: Optional[str] = None,
+                    context_window_size: Optional[int] = None, n_threads: Optional[int] = None,
+                    n_gpu_layers: int = 0) -> CountingDraftModel:
+    """
+    Returns the (counting) draft model for the given method: 'prompt_lookup' drafts by matching
+    the last n-grams of the context against earlier spans (the resume and JD in the prompt), and
+    'draft_model' drafts with the small model at 'draft_model_path'.
+    """
+    if speculative_decoding == 'prompt_lookup':
+        draft_model = LlamaPromptLookupDecoding(num_pred_tokens=num_draft_tokens)
+    elif speculative_decoding == 'draft_model':
+        if draft_model_path is None:
+            raise ValueError("'draft_model_path' is required for draft model speculative decoding!")
+        draft_model = SmallModelDraft(
+            draft_model_path=draft_model_path, context_window_size=context_window_size,
+            num_pred_tokens=num_draft_tokens, n_threads=n_threads, n_gpu_layers=n_gpu_layers
+        )
+    else:
+        raise ValueError(f"Unsupported speculative decoding method: {speculative_decoding}!")
+    return CountingDraftModel(draft_model=draft_model)
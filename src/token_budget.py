@@ -0,0 +1,287 @@
+import re
+import math
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from llama_cpp import Llama
+
+
+class TokenBudgeter:
+    """
+    Fits resume and JD texts into a token budget before prompt construction. Texts that do not fit
+    are first cleaned of OCR/markdown boilerplate and duplicated whitespace, then (if still too
+    long) trimmed section by section, keeping the most relevant sections first.
+    """
+
+    # LOWER VALUE = KEPT FIRST
+    SECTION_PRIORITIES = {
+        'skill': 0, 'experience': 0, 'employment': 0, 'work history': 0, 'requirement': 0,
+        'qualification': 0, 'responsibilit': 0, 'summary': 1, 'profile': 1, 'objective': 1,
+        'about': 1, 'education': 1, 'project': 2, 'certification': 2, 'achievement': 2,
+        'accomplishment': 2, 'publication': 3, 'award': 3, 'language': 3, 'volunteer': 4,
+        'interest': 4, 'hobbies': 4, 'reference': 5, 'benefit': 5, 'perks': 5, 'equal opportunity': 5
+    }
+    DEFAULT_SECTION_PRIORITY = 2
+
+    def __init__(self, gguf_model_path: str, max_context_size: int, reserved_output_tokens: int = 1024,
+                 context_size_step: int = 1024) -> None:
+        """
+        Loads only the vocabulary of the GGUF model (no weights) for token counting.
+        """
+        self.tokenizer = Llama(model_path=gguf_model_path, vocab_only=True, verbose=False)
+        self.max_context_size = max_context_size
+        self.reserved_output_tokens = reserved_output_tokens
+        self.context_size_step = context_size_step
+        # TEXT AND TOKEN COUNT OF EVERY DOCUMENT SEEN SO FAR (BY DOCUMENT ID), AS IS AND NORMALIZED
+        self.documents: Dict[str, Tuple[str, int]] = {}
+        self.normalized_documents: Dict[str, Tuple[str, int]] = {}
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Returns the number of tokens in the given text.
+        """
+        return len(self.tokenizer.tokenize(str(text).encode('utf-8'), add_bos=False, special=False))
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """
+        Removes boilerplate from OCR and pymupdf4llm markdown output (horizontal rules, image
+        placeholders, table separators, page numbers, repeated headers/footers) and collapses
+        duplicated whitespace.
+
+        Headers and footers are only detected in extracted PDFs, whose pages are separated by form
+        feeds (see Preprocessor.pdf_to_text): a line within the first or last lines of a page that
+        is repeated at the edge of another page only keeps its first occurrence. Repeated lines
+        elsewhere (e.g. a "Responsibilities:" heading under every job) are kept.
+        """
+        text = str(text).replace('\r\n', '\n').replace('\r', '\n')
+        text = re.sub(r'!\[[^\]]*\]\([^)]*\)', '', text)
+        text = re.sub(r'[ \t\u00a0]+', ' ', text)
+
+        pages = [[line.strip() for line in page.split('\n')] for page in text.split('\f')]
+        edge_lines = [TokenBudgeter.get_page_edge_lines(lines=lines) for lines in pages] if len(pages) > 1 else []
+        edge_line_counts = Counter(line for lines in edge_lines for line in lines)
+        seen_repeated_lines = set()
+        cleaned_lines = []
+        for page_no, lines in enumerate(pages):
+            for line in lines:
+                # HORIZONTAL RULES, TABLE SEPARATORS AND PAGE NUMBERS
+                if re.fullmatch(r'[-_=*|:# ]{3,}', line) or re.fullmatch(r'(page\s*)?\d{1,3}(\s*(of|/)\s*\d{1,3})?', line, re.IGNORECASE):
+                    continue
+                # SHORT LINES REPEATED AT THE TOP OR BOTTOM OF PAGES (HEADERS/FOOTERS)
+                if edge_lines and line in edge_lines[page_no] and edge_line_counts[line] >= 2:
+                    if line in seen_repeated_lines:
+                        continue
+                    seen_repeated_lines.add(line)
+                # CONSECUTIVE DUPLICATES
+                if line and cleaned_lines and cleaned_lines[-1] == line:
+                    continue
+                cleaned_lines.append(line)
+
+        text = '\n'.join(cleaned_lines)
+        text = re.sub(r'\n{3,}', '\n\n', text)
+        return text.strip()
+
+    @staticmethod
+    def get_page_edge_lines(lines: List[str], num_lines: int = 3) -> set:
+        """
+        Returns the short non-empty lines among the first and last 'num_lines' non-empty lines of a page.
+        """
+        lines = [line for line in lines if line]
+        return {line for line in lines[:num_lines] + lines[-num_lines:] if len(line) < 80}
+
+    def prepare_document(self, text: str, document_id: Optional[str] = None) -> Tuple[str, int]:
+        """
+        Returns the text and its token count. Results are memoized when a document ID is given,
+        since the same resume or JD appears in many pairs.
+        """
+        if document_id is not None and document_id in self.documents:
+            return self.documents[document_id]
+        # PAGE SEPARATORS ARE ONLY NEEDED BY NORMALIZATION
+        text = str(text).replace('\f', '\n')
+        document = (text, self.count_tokens(text))
+        if document_id is not None:
+            self.documents[document_id] = document
+        return document
+
+    def normalize_document(self, text: str, document_id: Optional[str] = None) -> Tuple[str, int]:
+        """
+        Returns the normalized text and its token count (memoized like prepare_document).
+        """
+        if document_id is not None and document_id in self.normalized_documents:
+            return self.normalized_documents[document_id]
+        text = self.normalize_text(text)
+        document = (text, self.count_tokens(text))
+        if document_id is not None:
+            self.normalized_documents[document_id] = document
+        return document
+
+    def get_section_priority(self, heading: str) -> int:
+        """
+        Returns the priority of a section based on keywords in its heading.
+        """
+        heading = heading.lower()
+        for keyword, priority in self.SECTION_PRIORITIES.items():
+            if keyword in heading:
+                return priority
+        return self.DEFAULT_SECTION_PRIORITY
+
+    @staticmethod
+    def is_heading(line: str) -> bool:
+        """
+        Detects section headings (markdown headings, bold lines, short upper-case lines or lines ending with ':').
+        """
+        stripped = line.strip().strip('*').strip()
+        if not stripped or len(stripped) > 60:
+            return False
+        return line.lstrip().startswith('#') or (line.strip().startswith('**') and line.strip().endswith('**')) \
+            or (stripped.isupper() and len(stripped.split()) <= 5) or stripped.endswith(':')
+
+    def split_sections(self, text: str) -> List[Tuple[str, str]]:
+        """
+        Splits the text into (heading, section text) tuples. Text before the first heading gets an empty heading.
+        """
+        sections = []
+        heading, section_lines = "", []
+        for line in text.split('\n'):
+            if self.is_heading(line) and section_lines:
+                sections.append((heading, '\n'.join(section_lines)))
+                heading, section_lines = line, []
+            elif self.is_heading(line):
+                heading = line
+            section_lines.append(line)
+        if section_lines:
+            sections.append((heading, '\n'.join(section_lines)))
+        return sections
+
+    def truncate(self, text: str, budget_tokens: int) -> str:
+        """
+        Trims the (normalized) text to the token budget by keeping whole sections in order of
+        priority. A section that does not fit is cut line by line (the line that does not fit is cut
+        at token level) and lower priority sections that still fit are kept. Kept sections stay in
+        their original order.
+        """
+        if self.count_tokens(text) <= budget_tokens:
+            return text
+
+        sections = self.split_sections(text)
+        ordered = sorted(
+            range(len(sections)),
+            # TEXT BEFORE THE FIRST HEADING (NAME, CONTACT, TITLE) IS KEPT WITH THE HIGHEST PRIORITY
+            key=lambda position: (0 if position == 0 and not sections[0][0] else self.get_section_priority(sections[position][0]), position)
+        )
+        kept = {}
+        remaining_tokens = budget_tokens
+        for position in ordered:
+            section_text = sections[position][1]
+            section_tokens = self.count_tokens(section_text) + 1
+            if section_tokens <= remaining_tokens:
+                kept[position] = section_text
+                remaining_tokens -= section_tokens
+                continue
+            partial_lines = []
+            for line in section_text.split('\n'):
+                line_tokens = self.count_tokens(line) + 1
+                if line_tokens > remaining_tokens:
+                    # A SINGLE LONG LINE (E.G. A JD WITHOUT LINE BREAKS) IS CUT TO THE REMAINING TOKENS
+                    partial_line = self.truncate_line(line=line, max_tokens=remaining_tokens - 1)
+                    if partial_line:
+                        partial_lines.append(partial_line)
+                        remaining_tokens -= self.count_tokens(partial_line) + 1
+                    break
+                partial_lines.append(line)
+                remaining_tokens -= line_tokens
+            if partial_lines:
+                kept[position] = '\n'.join(partial_lines)
+        return '\n'.join(kept[position] for position in sorted(kept))
+
+    def truncate_line(self, line: str, max_tokens: int) -> str:
+        """
+        Returns the text of the first 'max_tokens' tokens of the line.
+        """
+        if max_tokens <= 0:
+            return ""
+        tokens = self.tokenizer.tokenize(str(line).encode('utf-8'), add_bos=False, special=False)[:max_tokens]
+        # DETOKENIZED TEXT CAN TOKENIZE DIFFERENTLY AT THE CUT, SO IT IS CHECKED AGAIN
+        while tokens:
+            partial_line = self.tokenizer.detokenize(tokens).decode('utf-8', errors='ignore').strip()
+            if self.count_tokens(partial_line) <= max_tokens:
+                return partial_line
+            tokens = tokens[:-1]
+        return ""
+
+    def get_document_budgets(self, resume_tokens: int, jd_tokens: int, available_tokens: int) -> Tuple[int, int]:
+        """
+        Splits the available tokens between the resume and the JD. Each gets half, and whatever
+        one of them does not need goes to the other.
+        """
+        half = available_tokens // 2
+        if resume_tokens <= half:
+            return resume_tokens, available_tokens - resume_tokens
+        if jd_tokens <= half:
+            return available_tokens - jd_tokens, jd_tokens
+        return available_tokens - half, half
+
+    def get_fitted_documents(self, resume: str, jd: str, available_tokens: int, resume_id: Optional[str] = None,
+                             jd_id: Optional[str] = None) -> Tuple[str, int, str, int]:
+        """
+        Returns the resume and JD with their token counts, normalizing only the documents that do
+        not fit their share of the available tokens (documents that fit are left untouched).
+
+        Returns: (resume, resume_tokens, jd, jd_tokens)
+        """
+        prepared_resume, resume_tokens = self.prepare_document(text=resume, document_id=resume_id)
+        prepared_jd, jd_tokens = self.prepare_document(text=jd, document_id=jd_id)
+        if resume_tokens + jd_tokens <= available_tokens:
+            return prepared_resume, resume_tokens, prepared_jd, jd_tokens
+
+        resume_budget, jd_budget = self.get_document_budgets(
+            resume_tokens=resume_tokens, jd_tokens=jd_tokens, available_tokens=available_tokens
+        )
+        if resume_tokens > resume_budget:
+            prepared_resume, resume_tokens = self.normalize_document(text=resume, document_id=resume_id)
+        if jd_tokens > jd_budget:
+            prepared_jd, jd_tokens = self.normalize_document(text=jd, document_id=jd_id)
+        return prepared_resume, resume_tokens, prepared_jd, jd_tokens
+
+    def fit(self, resume: str, jd: str, prompt_overhead_tokens: int, resume_id: Optional[str] = None,
+            jd_id: Optional[str] = None) -> Tuple[str, str, int]:
+        """
+        Normalizes and (if needed) truncates the resume and JD so that the full prompt and the
+        reserved output tokens fit in the maximum context size.
+
+        Returns: (resume, jd, required_context_tokens)
+        """
+        available_tokens = self.max_context_size - prompt_overhead_tokens - self.reserved_output_tokens
+        resume, resume_tokens, jd, jd_tokens = self.get_fitted_documents(
+            resume=resume, jd=jd, available_tokens=available_tokens, resume_id=resume_id, jd_id=jd_id
+        )
+
+        if resume_tokens + jd_tokens > available_tokens:
+            resume_budget, jd_budget = self.get_document_budgets(
+                resume_tokens=resume_tokens, jd_tokens=jd_tokens, available_tokens=available_tokens
+            )
+            resume = self.truncate(text=resume, budget_tokens=resume_budget)
+            jd = self.truncate(text=jd, budget_tokens=jd_budget)
+            resume_tokens, jd_tokens = self.count_tokens(resume), self.count_tokens(jd)
+
+        return resume, jd, prompt_overhead_tokens + resume_tokens + jd_tokens + self.reserved_output_tokens
+
+    def get_required_context_tokens(self, resume: str, jd: str, prompt_overhead_tokens: int,
+                                     resume_id: Optional[str] = None, jd_id: Optional[str] = None) -> int:
+        """
+        Returns the context size the pair will need after fitting, without truncating anything.
+        """
+        available_tokens = self.max_context_size - prompt_overhead_tokens - self.reserved_output_tokens
+        _, resume_tokens, _, jd_tokens = self.get_fitted_documents(
+            resume=resume, jd=jd, available_tokens=available_tokens, resume_id=resume_id, jd_id=jd_id
+        )
+        return prompt_overhead_tokens + min(resume_tokens + jd_tokens, available_tokens) + self.reserved_output_tokens
+
+    def choose_context_size(self, required_tokens: int) -> int:
+        """
+        Returns the smallest context size (multiple of 'context_size_step') that fits the required
+        tokens, capped at the maximum context size.
+        """
+        context_size = math.ceil(required_tokens / self.context_size_step) * self.context_size_step
+        return min(max(context_size, self.context_size_step), self.max_context_size)
+
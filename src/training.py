@@ -11,12 +11,23 @@ NOTES:
 from 2 to 1, we run a risk of the notebook crashing while training is 
 going on.
 
-2. Once the training is over, the script automatically stores both the 
+2. Run 'python pretokenize.py' once to tokenize and pack the dataset. If the 
+cache for the current tokenizer and config is missing, the dataset is 
+tokenized on the fly instead. Packing (PACK_SEQUENCES) needs flash attention 2, 
+a packed cache is not used without it (e.g. on T4).
+
+3. Once the training is over, the script automatically stores both the 
 adapters as well as gguf_version of the finetuned model. So make sure 
 sufficient space is available.
+
+4. To choose the GGUF variant to serve, run 'python export_and_benchmark.py 
+--checkpoint <checkpoint dir> --pairs <pairs dataset>'. It exports the chosen 
+quantizations and compares their speed, memory and score agreement with the 
+16-bit model on CPU (SAVE_Q4_K_M and SAVE_QUANTIZED can then be disabled).
 """
 
 import os
+from typing import Optional
 from datetime import datetime
 import training_config as config
 from datasets import load_dataset
@@ -24,7 +35,77 @@ from unsloth import FastLanguageModel, is_bfloat16_supported
 from unsloth.chat_templates import get_chat_template
 from transformers import TrainingArguments
 from trl import SFTTrainer
+from torch.utils.data import DataLoader
 from utils import fancy_print
+from pretokenize import PackedDataCollator, load_packed_splits
+from batch_sampling import TokenBudgetBatchSampler, get_dataset_lengths
+from training_metrics import InstrumentedDataCollator, ThroughputCallback
+
+
+class TokenBudgetSFTTrainer(SFTTrainer):
+    """
+    SFTTrainer whose train and eval dataloaders use TokenBudgetBatchSampler instead of fixed batch
+    sizes. Without a token budget it behaves exactly like SFTTrainer.
+
+    Every training batch is passed to the 'count_batch' method of the data collator, if it has one
+    (see InstrumentedDataCollator), from the main process.
+    """
+
+    def __init__(self, *args, max_tokens_per_train_batch: Optional[int] = None,
+                 max_tokens_per_eval_batch: Optional[int] = None, num_length_buckets: int = 8,
+                 max_batch_size: Optional[int] = None, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.max_tokens_per_train_batch = max_tokens_per_train_batch
+        self.max_tokens_per_eval_batch = max_tokens_per_eval_batch
+        self.num_length_buckets = num_length_buckets
+        self.max_batch_size = max_batch_size
+
+    def get_token_budget_dataloader(self, dataset, max_tokens: int, shuffle: bool, description: str) -> DataLoader:
+        """
+        Returns a dataloader that batches the dataset by token budget.
+        """
+        batch_sampler = TokenBudgetBatchSampler(
+            lengths=get_dataset_lengths(dataset=dataset),
+            max_tokens=max_tokens,
+            num_buckets=self.num_length_buckets,
+            max_batch_size=self.max_batch_size,
+            shuffle=shuffle,
+            seed=self.args.seed
+        )
+        print(f"{description.capitalize()}: {len(batch_sampler)} token-budget batches "
+              f"({batch_sampler.get_padding_ratio():.1%} padding)")
+        if hasattr(dataset, 'column_names'):
+            dataset = self._remove_unused_columns(dataset, description=description)
+        dataloader = DataLoader(
+            dataset,
+            batch_sampler=batch_sampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory
+        )
+        return self.accelerator.prepare(dataloader)
+
+    def training_step(self, model, inputs, *args, **kwargs):
+        # THE COLLATOR MAY RUN IN DATALOADER WORKERS, WHOSE COUNTS NEVER REACH THIS PROCESS
+        if hasattr(self.data_collator, 'count_batch'):
+            self.data_collator.count_batch(inputs)
+        return super().training_step(model, inputs, *args, **kwargs)
+
+    def get_train_dataloader(self) -> DataLoader:
+        if self.max_tokens_per_train_batch is None:
+            return super().get_train_dataloader()
+        return self.get_token_budget_dataloader(
+            dataset=self.train_dataset, max_tokens=self.max_tokens_per_train_batch, shuffle=True, description='training'
+        )
+
+    def get_eval_dataloader(self, eval_dataset=None) -> DataLoader:
+        if self.max_tokens_per_eval_batch is None:
+            return super().get_eval_dataloader(eval_dataset)
+        return self.get_token_budget_dataloader(
+            dataset=eval_dataset if eval_dataset is not None else self.eval_dataset,
+            max_tokens=self.max_tokens_per_eval_batch, shuffle=False, description='evaluation'
+        )
+
 
 fancy_print("Unsloth Training")
 
@@ -62,12 +143,22 @@ def formatting_prompts_func(examples):
     texts = [tokenizer.apply_chat_template(convo, tokenize = False, add_generation_prompt = False) for convo in convos]
     return { "text" : texts, }
 
-dataset = load_dataset("json", data_files=config.DATASET_PATH, split='train')
-dataset = dataset.shuffle(seed=config.DATASET_SHUFFLE_SEED)
-dataset = dataset.map(formatting_prompts_func, batched = True,)
-dataset = dataset.train_test_split(test_size=config.VALIDATION_SPLIT_SIZE, shuffle=True, seed=config.SPLIT_SHUFFLE_SEED)
-train_dataset = dataset['train']
-eval_dataset = dataset['test']
+packed_splits = load_packed_splits(tokenizer=tokenizer, model=model)
+if packed_splits is not None:
+    print("Using the pre-tokenized (packed) dataset cache...")
+    train_dataset, eval_dataset = packed_splits
+    trainer_dataset_kwargs = {
+        'data_collator': PackedDataCollator(pad_token_id=tokenizer.pad_token_id),
+        'dataset_kwargs': {'skip_prepare_dataset': True}
+    }
+else:
+    dataset = load_dataset("json", data_files=config.DATASET_PATH, split='train')
+    dataset = dataset.shuffle(seed=config.DATASET_SHUFFLE_SEED)
+    dataset = dataset.map(formatting_prompts_func, batched = True,)
+    dataset = dataset.train_test_split(test_size=config.VALIDATION_SPLIT_SIZE, shuffle=True, seed=config.SPLIT_SHUFFLE_SEED)
+    train_dataset = dataset['train']
+    eval_dataset = dataset['test']
+    trainer_dataset_kwargs = {'dataset_text_field': "text"}
 
 # CREATING DIRECTORY STRUCTURE TO STORE ALL MODEL VERSIONS
 model_store_dir = os.path.join(config.MODEL_STORE_DIR, str(datetime.now()).replace(' ', '-'))
@@ -79,13 +170,17 @@ os.makedirs(q4_k_m_dir)
 os.makedirs(quantized_dir)
 
 # INITIALISING TRAINING PARAMETERS (IMPORTANT)
-trainer = SFTTrainer(
+trainer = TokenBudgetSFTTrainer(
     model=model,
     tokenizer=tokenizer,
     train_dataset=train_dataset,
     eval_dataset=eval_dataset,
-    dataset_text_field="text",
     max_seq_length=config.MAX_SEQ_LENGTH,
+    **trainer_dataset_kwargs,
+    max_tokens_per_train_batch=config.MAX_TOKENS_PER_TRAIN_BATCH,
+    max_tokens_per_eval_batch=config.MAX_TOKENS_PER_EVAL_BATCH,
+    num_length_buckets=config.NUM_LENGTH_BUCKETS,
+    max_batch_size=config.MAX_BATCH_SIZE,
     args=TrainingArguments(
         per_device_train_batch_size=config.PER_DEVICE_TRAIN_BATCH_SIZE,
         per_device_eval_batch_size=config.PER_DEVICE_EVAL_BATCH_SIZE,
@@ -105,10 +200,19 @@ trainer = SFTTrainer(
         logging_strategy=config.LOGGING_STRATEGY,
         logging_steps=config.LOGGING_STEPS,
         save_strategy=config.SAVE_STRATEGY,
-        save_steps=config.SAVE_STEPS
+        save_steps=config.SAVE_STEPS,
+        remove_unused_columns=packed_splits is None
     ),
 )
 
+# THROUGHPUT AND MEMORY INSTRUMENTATION (SAVED IN 'model_store_dir')
+trainer.data_collator = InstrumentedDataCollator(data_collator=trainer.data_collator, pad_token_id=tokenizer.pad_token_id)
+trainer.add_callback(ThroughputCallback(
+    output_dir=model_store_dir,
+    data_collator=trainer.data_collator,
+    run_config={key: value for key, value in vars(config).items() if key.isupper()}
+))
+
 # TRAINING
 trainer_stats = trainer.train()    # ADAPTERS ARE SAVED DURING THIS STEP
 
@@ -24,11 +24,17 @@ DATASET_PATH = "dataset.json"
 DATASET_SHUFFLE_SEED = 65
 SPLIT_SHUFFLE_SEED = 42
 VALIDATION_SPLIT_SIZE = 0.2
+PRETOKENIZED_CACHE_DIR = "tokenized_cache"          # Packed dataset cache saved by 'pretokenize.py'. Falls back to tokenizing on the fly if missing.
+PACK_SEQUENCES = False                              # Pack several conversations per row. Attention is split by position IDs only, so it needs flash attention 2 (not on T4).
 
 # TRAINING PARAMETERS
 PER_DEVICE_TRAIN_BATCH_SIZE = 1                     # Number of training examples processed by each device (GPU/CPU) in one forward/backward pass.
 PER_DEVICE_EVAL_BATCH_SIZE = 1                      # Number of evaluation examples processed per device in one forward pass. Lower values reduce memory usage during evaluation.
 GRADIENT_ACCUMULATION_STEPS = 4                     # Effective batch size = PER_DEVICE_TRAIN_BATCH_SIZE * GRADIENT_ACCUMULATION_STEPS
+MAX_TOKENS_PER_TRAIN_BATCH = None                   # Token budget (padded) per training batch. Replaces PER_DEVICE_TRAIN_BATCH_SIZE if set, e.g. 9000.
+MAX_TOKENS_PER_EVAL_BATCH = None                    # Token budget (padded) per evaluation batch. Replaces PER_DEVICE_EVAL_BATCH_SIZE if set.
+NUM_LENGTH_BUCKETS = 8                              # Examples are batched together with others of the same length quantile.
+MAX_BATCH_SIZE = None                               # Upper limit on examples per token-budget batch (None for no limit).
 EVAL_ACCUMULATION_STEPS = 1                         # Number of steps to accumulate evaluation data before processing. Helps manage memory during evaluation without affecting training.
 WARMUP_STEPS = 5                                    # Number of steps to gradually increase the learning rate from 0 to the initial value (LEARNING_RATE).
 NUM_TRAIN_EPOCHS = 5                                # Total number of passes over the entire dataset.
@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import torch
+from typing import Optional
+from transformers import TrainerCallback
+
+
+class InstrumentedDataCollator:
+    """
+    Wraps a data collator to time it and counts the real (non-padding) tokens, padded tokens and
+    samples of the training batches. Counts are collected by ThroughputCallback at the end of each step.
+
+    With dataloader_num_workers > 0 the collator runs in the dataloader worker processes (on copies
+    of this object), so batches are counted by count_batch, which the trainer calls from the main
+    process for every batch it trains on (see TokenBudgetSFTTrainer.training_step). The collate
+    time is only measured without dataloader workers.
+    """
+
+    def __init__(self, data_collator, pad_token_id: Optional[int]) -> None:
+        self.data_collator = data_collator
+        self.pad_token_id = pad_token_id
+        self.reset()
+
+    def reset(self) -> None:
+        self.real_tokens = 0
+        self.padded_tokens = 0
+        self.samples = 0
+        self.collate_time = 0.0
+
+    def __call__(self, features) -> dict:
+        start_time = time.perf_counter()
+        batch = self.data_collator(features)
+        self.collate_time += time.perf_counter() - start_time
+        return batch
+
+    def count_batch(self, batch: dict) -> None:
+        """
+        Adds the tokens and samples of a collated batch to the counts (called from the main process).
+        """
+        input_ids = batch['input_ids']
+        if 'attention_mask' in batch:
+            real_tokens = int(batch['attention_mask'].sum())
+        elif self.pad_token_id is not None:
+            real_tokens = int((input_ids != self.pad_token_id).sum())
+        else:
+            real_tokens = input_ids.numel()
+        self.real_tokens += real_tokens
+        self.padded_tokens += input_ids.numel()
+        # PACKED ROWS CONTAIN SEVERAL SAMPLES (ONE PER POSITION ID RESET, PADDING EXCLUDED)
+        if 'position_ids' in batch and self.pad_token_id is not None:
+            self.samples += int(((batch['position_ids'] == 0) & (input_ids != self.pad_token_id)).sum())
+        else:
+            self.samples += input_ids.shape[0]
+
+
+class ThroughputCallback(TrainerCallback):
+    """
+    Records tokens/sec, samples/sec, the split of every optimizer step into data loading,
+    forward/backward and optimizer time, peak allocated GPU memory and the padding ratio. One
+    JSON line is written per step and a summary is saved at the end of training.
+
+    Token and sample counts come from the InstrumentedDataCollator, which counts the batches the
+    trainer trains on during the step. The collate time is None with dataloader workers (the
+    collator then runs in other processes).
+    """
+
+    def __init__(self, output_dir: str, data_collator: InstrumentedDataCollator, run_config: Optional[dict] = None) -> None:
+        """
+        Initialises the output files in the given directory. 'run_config' is saved with the summary
+        so that runs with different settings can be compared.
+        """
+        self.metrics_path = os.path.join(output_dir, "training_metrics.jsonl")
+        self.summary_path = os.path.join(output_dir, "training_metrics_summary.json")
+        self.data_collator = data_collator
+        self.run_config = run_config or {}
+        self.use_cuda = torch.cuda.is_available()
+        self.records = []
+        self.step_start_time = None
+        self.forward_backward_start_time = None
+        self.forward_backward_time = 0.0
+        self.optimizer_start_time = None
+        self.optimizer_time = 0.0
+        self.collate_in_workers = False
+
+    def get_time(self) -> float:
+        # CUDA KERNELS RUN ASYNCHRONOUSLY, SO TIMINGS ARE ONLY MEANINGFUL AFTER SYNCHRONISING
+        if self.use_cuda:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def on_train_begin(self, args, state, control, **kwargs) -> None:
+        open(self.metrics_path, 'w').close()
+        self.collate_in_workers = args.dataloader_num_workers > 0
+        if self.use_cuda:
+            torch.cuda.reset_peak_memory_stats()
+        self.data_collator.reset()
+        self.step_start_time = self.get_time()
+
+    def on_step_begin(self, args, state, control, **kwargs) -> None:
+        self.forward_backward_start_time = self.get_time()
+
+    def on_substep_end(self, args, state, control, **kwargs) -> None:
+        # END OF A GRADIENT ACCUMULATION MICRO-STEP
+        self.forward_backward_time += self.get_time() - self.forward_backward_start_time
+        self.forward_backward_start_time = self.get_time()
+
+    def on_pre_optimizer_step(self, args, state, control, **kwargs) -> None:
+        self.optimizer_start_time = self.get_time()
+        self.forward_backward_time += self.optimizer_start_time - self.forward_backward_start_time
+
+    def on_optimizer_step(self, args, state, control, **kwargs) -> None:
+        if self.optimizer_start_time is not None:
+            self.optimizer_time += self.get_time() - self.optimizer_start_time
+
+    def on_step_end(self, args, state, control, **kwargs) -> None:
+        step_end_time = self.get_time()
+        step_time = step_end_time - self.step_start_time
+        collator = self.data_collator
+        record = {
+            'step': state.global_step,
+            'epoch': state.epoch,
+            'step_time': step_time,
+            'data_loading_time': max(0.0, step_time - self.forward_backward_time - self.optimizer_time),
+            'collate_time': None if self.collate_in_workers else collator.collate_time,
+            'forward_backward_time': self.forward_backward_time,
+            'optimizer_time': self.optimizer_time,
+            'tokens': collator.real_tokens,
+            'samples': collator.samples,
+            'tokens_per_sec': collator.real_tokens / step_time if step_time > 0 else 0.0,
+            'samples_per_sec': collator.samples / step_time if step_time > 0 else 0.0,
+            'padding_ratio': 1 - collator.real_tokens / collator.padded_tokens if collator.padded_tokens else 0.0,
+            'peak_memory_allocated_mb': torch.cuda.max_memory_allocated() / 1024 ** 2 if self.use_cuda else None
+        }
+        self.records.append(record)
+        with open(self.metrics_path, 'a') as file:
+            file.write(json.dumps(record) + "\n")
+
+        collator.reset()
+        if self.use_cuda:
+            torch.cuda.reset_peak_memory_stats()
+        self.forward_backward_time, self.optimizer_time = 0.0, 0.0
+        self.optimizer_start_time = None
+        self.step_start_time = self.get_time()
+
+    def on_evaluate(self, args, state, control, **kwargs) -> None:
+        # EVALUATION (AND THE COLLATION OF ITS BATCHES) DOES NOT COUNT TOWARDS THE NEXT TRAINING STEP
+        self.data_collator.reset()
+        self.step_start_time = self.get_time()
+
+    def on_save(self, args, state, control, **kwargs) -> None:
+        self.step_start_time = self.get_time()
+
+    def get_summary(self) -> dict:
+        """
+        Returns run-level totals and averages over all recorded steps.
+        """
+        records = self.records
+        total_time = sum(record['step_time'] for record in records)
+        total_tokens = sum(record['tokens'] for record in records)
+        peak_memory = [record['peak_memory_allocated_mb'] for record in records if record['peak_memory_allocated_mb'] is not None]
+
+        def get_share(key: str) -> float:
+            return sum(record[key] for record in records) / total_time if total_time > 0 else 0.0
+
+        return {
+            'steps': len(records),
+            'total_time': total_time,
+            'total_tokens': total_tokens,
+            'total_samples': sum(record['samples'] for record in records),
+            'tokens_per_sec': total_tokens / total_time if total_time > 0 else 0.0,
+            'samples_per_sec': sum(record['samples'] for record in records) / total_time if total_time > 0 else 0.0,
+            'data_loading_share': get_share('data_loading_time'),
+            'forward_backward_share': get_share('forward_backward_time'),
+            'optimizer_share': get_share('optimizer_time'),
+            'mean_padding_ratio': sum(record['padding_ratio'] for record in records) / len(records) if records else 0.0,
+            'peak_memory_allocated_mb': max(peak_memory) if peak_memory else None,
+            'config': self.run_config
+        }
+
+    def on_train_end(self, args, state, control, **kwargs) -> None:
+        summary = self.get_summary()
+        with open(self.summary_path, 'w') as file:
+            json.dump(summary, file, indent=4, default=str)
+        print(f"Training throughput: {summary['tokens_per_sec']:.0f} tokens/sec, {summary['samples_per_sec']:.2f} samples/sec "
+              f"(data {summary['data_loading_share']:.1%}, forward/backward {summary['forward_backward_share']:.1%}, "
+              f"optimizer {summary['optimizer_share']:.1%}), padding {summary['mean_padding_ratio']:.1%}")
+        if summary['peak_memory_allocated_mb'] is not None:
+            print(f"Peak allocated memory: {summary['peak_memory_allocated_mb']:.0f} MB")
+        print(f"Training metrics saved to {self.metrics_path}")
@@ -1,60 +1,219 @@
 import os
-import pandas as pd
+import time
+import signal
+from typing import List, Optional
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from utils import get_file_hash
 from preprocessing import Preprocessor
+from checkpoint_store import get_checkpoint_store
+from dataset_io import EXTRACTED_TEXT_SCHEMA
 
 
+def raise_file_timeout(signum, frame) -> None:
+    raise TimeoutError("Text extraction timed out!")
+
+
+def extract_file_text(filepath: str, timeout: Optional[int] = None, cache_dir: Optional[str] = None) -> str:
+    """
+    Extracts the text of the given file using the Preprocessor (with the extraction cache at
+    'cache_dir', if provided). Raises TimeoutError if the extraction takes longer than 'timeout' seconds.
+    The alarm only fires between Python bytecodes (not inside C extensions such as pymupdf or
+    tesseract), callers that need a hard limit enforce it from another process.
+    """
+    if timeout:
+        signal.signal(signal.SIGALRM, raise_file_timeout)
+        signal.alarm(timeout)
+    try:
+        return Preprocessor(cache_dir=cache_dir)(input_str=filepath)
+    finally:
+        if timeout:
+            signal.alarm(0)
+
+
+def kill_pool(executor: ProcessPoolExecutor) -> None:
+    """
+    Kills the worker processes of the pool (a hung C extension call ignores everything else) and shuts it down.
+    """
+    # THE POOL HAS NO PUBLIC API TO TERMINATE ITS WORKERS
+    for process in list((executor._processes or {}).values()):
+        process.kill()
+    executor.shutdown(wait=False, cancel_futures=True)
+
 class ResumeFormatter:
     """
-    Class that handles operations related to formatting the given input resume files into 
-    structured excel format.
+    Class that handles operations related to formatting the given input resume files into
+    a structured dataset (parquet, arrow or excel).
     """
 
-    def __init__(self, input_dir: str, output_store_path: str) -> None:
+    def __init__(self, input_dir: str, output_store_path: str, num_workers: int = 1,
+                 file_timeout: Optional[int] = None, checkpoint_path: Optional[str] = None,
+                 cache_dir: Optional[str] = None) -> None:
         """
         Initialises directories and classes that will be used during resume formatting.
+
+        Extracted texts are appended to a checkpoint store (.jsonl or .sqlite) as they complete and
+        exported at the end in the format of the output store path (.parquet, .arrow or .xlsx). If 'num_workers' is greater than 1, files are processed by a
+        process pool. Extraction of a single file is stopped after 'file_timeout' seconds.
+
+        If 'cache_dir' is provided, extracted texts are cached by file content, which makes
+        re-ingesting unchanged files near-instant.
+
+        With 'file_timeout', files are always extracted in worker processes (even with a single
+        worker), so that a hung extraction can be killed from this process.
+
+        The content hash of every file is stored with its text, so that files changed since the last
+        run are extracted again. Files removed from the input directory are left out of the output.
         """
         self.input_dir = input_dir
-        self.preprocessor = Preprocessor()
-        self.output_dict = {
-            "filename": [],
-            "text": [],
-        }
+        self.num_workers = max(1, num_workers)
+        self.file_timeout = file_timeout
+        self.cache_dir = cache_dir
         self.output_store_path = output_store_path
+        self.checkpoint_path = checkpoint_path or f"{os.path.splitext(output_store_path)[0]}.checkpoint.jsonl"
+        self.checkpoint_store = get_checkpoint_store(store_path=self.checkpoint_path)
+        self.file_hashes = {}
 
-    def save_current_output_dict(self) -> None:
+    def export_output(self) -> None:
         """
-        Saves current version of the output as an excel file in the provided directory.
+        Saves all extracted texts from the checkpoint store to the output store path.
+        """
+        self.checkpoint_store.export(
+            output_path=self.output_store_path, schema=EXTRACTED_TEXT_SCHEMA, keys=set(self.file_hashes)
+        )
+
+    def save_text(self, filename: str, text: str) -> None:
         """
-        output_df = pd.DataFrame(self.output_dict)
-        output_df.to_excel(self.output_store_path, index=False)
-    
+        Appends the extracted text of the file to the checkpoint store.
+        """
+        self.checkpoint_store.append(
+            key=filename, record={'filename': filename, 'text': text, 'file_hash': self.file_hashes[filename]}
+        )
+
     def __call__(self) -> None:
         """
-        Iterates through the files, extracts text and stores the results as 
-        an excel file in the specified output directory.
+        Iterates through the files, extracts text and stores the results as
+        a dataset file in the specified output directory.
+        """
+        self.file_hashes = {
+            filename: get_file_hash(filepath=os.path.join(self.input_dir, filename))
+            for filename in os.listdir(self.input_dir) if os.path.isfile(os.path.join(self.input_dir, filename))
+        }
+        # FILES PROCESSED BEFORE FILE HASHES WERE STORED ARE TREATED AS UNCHANGED
+        stored_hashes = {record['key']: record.get('file_hash') for record in self.checkpoint_store.iter_records()}
+        changed_filenames = [
+            filename for filename, file_hash in self.file_hashes.items()
+            if filename in stored_hashes and stored_hashes[filename] not in (None, file_hash)
+        ]
+        filenames = [filename for filename in self.file_hashes if filename not in stored_hashes] + changed_filenames
+        if len(self.checkpoint_store) > 0:
+            print(f"Skipping {len(self.file_hashes) - len(filenames)} already processed files "
+                  f"({len(changed_filenames)} changed files are processed again)...")
+
+        try:
+            if self.num_workers > 1 or self.file_timeout:
+                self.process_files_in_parallel(filenames=filenames)
+            else:
+                self.process_files(filenames=filenames)
+        finally:
+            self.checkpoint_store.flush()
+        self.export_output()
+
+    def process_files(self, filenames: List[str]) -> None:
+        """
+        Extracts the text of the given files one after another.
         """
-        for count, filename in enumerate(os.listdir(self.input_dir)):
+        for count, filename in enumerate(filenames):
             try:
-                print(f"\n\nProcessing file {count + 1} out of {len(os.listdir(self.input_dir))}...\n\n")
-                
+                print(f"\n\nProcessing file {count + 1} out of {len(filenames)}...\n\n")
+
                 filepath = os.path.join(self.input_dir, filename)
-                text = self.preprocessor(input_str=filepath)
-                
-                self.output_dict['filename'].append(filename)
-                self.output_dict['text'].append(text)
-                self.save_current_output_dict()
+                text = extract_file_text(filepath=filepath, timeout=self.file_timeout, cache_dir=self.cache_dir)
+                self.save_text(filename=filename, text=text)
 
                 print(f"file {count + 1} processed successfully")
             except Exception as e:
                 print(f"An error occured while trying to process file {count + 1}: {str(e)}")
                 continue
 
+    def process_files_in_parallel(self, filenames: List[str]) -> None:
+        """
+        Extracts the text of the given files using a process pool, with at most 'num_workers' files
+        in flight. Results are stored as soon as they complete and failures only affect their own file:
+
+        - 'file_timeout' is enforced from this process. The pool is killed and recreated when a file
+          exceeds it, and the other files that were in flight are submitted again.
+        - If a worker dies (e.g. a segfault in a C extension), the files in flight are marked as
+          failed and the pool is recreated.
+        """
+        start_time = time.time()
+        processed_count, failed_count = 0, 0
+        pending_filenames = deque(filenames)
+        # FUTURE -> (FILENAME, SUBMISSION TIME), THE FILE STARTS RIGHT AWAY AS THERE IS A FREE WORKER
+        in_flight = {}
+        executor = ProcessPoolExecutor(max_workers=self.num_workers)
+        try:
+            while pending_filenames or in_flight:
+                while pending_filenames and len(in_flight) < self.num_workers:
+                    filename = pending_filenames.popleft()
+                    future = executor.submit(
+                        extract_file_text, os.path.join(self.input_dir, filename), self.file_timeout, self.cache_dir
+                    )
+                    in_flight[future] = (filename, time.time())
+
+                done, _ = wait(in_flight, timeout=1, return_when=FIRST_COMPLETED)
+                pool_broken = False
+                for future in done:
+                    filename, _ = in_flight.pop(future)
+                    try:
+                        self.save_text(filename=filename, text=future.result())
+                        processed_count += 1
+                    except BrokenProcessPool:
+                        failed_count += 1
+                        pool_broken = True
+                        print(f"A worker crashed while processing file {filename}!")
+                    except Exception as e:
+                        failed_count += 1
+                        print(f"An error occured while trying to process file {filename}: {str(e)}")
+
+                timed_out = [
+                    future for future, (_, submit_time) in in_flight.items()
+                    if self.file_timeout and time.time() - submit_time > self.file_timeout
+                ]
+                if pool_broken or timed_out:
+                    for future in timed_out:
+                        filename, _ = in_flight.pop(future)
+                        failed_count += 1
+                        print(f"Processing file {filename} timed out after {self.file_timeout} seconds!")
+                    for future, (filename, _) in reversed(list(in_flight.items())):
+                        if pool_broken:
+                            failed_count += 1
+                            print(f"A worker crashed while processing file {filename}!")
+                        else:
+                            # INTERRUPTED BY THE RESTART, NOT FAILED
+                            pending_filenames.appendleft(filename)
+                    in_flight = {}
+                    kill_pool(executor=executor)
+                    executor = ProcessPoolExecutor(max_workers=self.num_workers)
+
+                completed_count = processed_count + failed_count
+                if done or pool_broken or timed_out:
+                    files_per_second = completed_count / (time.time() - start_time)
+                    print(f"Completed {completed_count} out of {len(filenames)} files "
+                          f"({failed_count} failed, {files_per_second:.2f} files/sec)")
+        finally:
+            kill_pool(executor=executor)
+
 
 if __name__ == '__main__':
     INPUT_DIR = "/home/om/code/Resume-Evaluator/data/resumes"
-    OUTPUT_STORE_PATH = "files_dataset.xlsx"
+    OUTPUT_STORE_PATH = "files_dataset.parquet"
     resume_formatter = ResumeFormatter(
         input_dir=INPUT_DIR,
-        output_store_path=OUTPUT_STORE_PATH
+        output_store_path=OUTPUT_STORE_PATH,
+        num_workers=os.cpu_count() or 1,
+        file_timeout=300,
+        cache_dir="/home/om/code/Resume-Evaluator/data/extraction_cache"
     )
     resume_formatter()
@@ -1,4 +1,6 @@
+import os
 import json
+import hashlib
 import pyfiglet    
 
 def get_json_data(filepath: str) -> dict:
@@ -8,6 +10,43 @@ def get_json_data(filepath: str) -> dict:
     with open(filepath, 'r') as file:
         return json.load(file)
 
+def get_text_hash(text: str) -> str:
+    """
+    Returns the SHA-256 hex digest of the given text. Used as a content-based ID.
+    """
+    return hashlib.sha256(str(text).encode('utf-8')).hexdigest()
+
+def get_pair_key(jd_id: str, resume_id: str) -> str:
+    """
+    Returns the key identifying a JD-Resume pair, given the IDs (content hashes) of both documents.
+    """
+    return get_text_hash(f"{jd_id}:{resume_id}")
+
+def get_normalized_text_hash(text: str) -> str:
+    """
+    Returns the hash of the text with whitespace collapsed, so that texts differing only in
+    spacing or line breaks (re-extractions, re-submissions) get the same hash.
+    """
+    return get_text_hash(' '.join(str(text).split()))
+
+def get_file_hash(filepath: str) -> str:
+    """
+    Returns the SHA-256 hex digest of the file contents. Used to detect changed source files.
+    """
+    file_hash = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+def get_file_fingerprint(filepath: str, sample_size: int = 1024 * 1024) -> str:
+    """
+    Returns a cheap fingerprint of a (large) file: its name, size and the hash of its first 'sample_size' bytes.
+    """
+    with open(filepath, 'rb') as file:
+        sample_hash = hashlib.sha256(file.read(sample_size)).hexdigest()
+    return get_text_hash(f"{os.path.basename(filepath)}:{os.path.getsize(filepath)}:{sample_hash}")
+
 def fancy_print(text: str) -> None:
     """
     Uses pyfiglet library to print given text in a fancy manner.
@@ -0,0 +1,70 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+# THE MODULES IN src/ IMPORT EACH OTHER BY THEIR FLAT NAMES
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+
+def write_tiny_gguf(path: str, n_embd: int = 32, n_layers: int = 2, n_ff: int = 64, n_heads: int = 4,
+                    context_length: int = 2048, seed: int = 0) -> None:
+    """
+    Writes a tiny llama GGUF with random weights and a byte-level SentencePiece vocabulary (every
+    text can be tokenized). The EOS row of the output layer is zero, so greedy decoding never stops early.
+    """
+    gguf = pytest.importorskip('gguf')
+    rng = np.random.default_rng(seed)
+    tokens = [b"<unk>", b"<s>", b"</s>"] + [f"<0x{byte:02X}>".encode() for byte in range(256)] + \
+        [f"▁{word}".encode() for word in ("the", "and", "skills", "python", "experience")]
+    token_types = [2, 3, 3] + [6] * 256 + [1] * 5
+    n_vocab = len(tokens)
+
+    writer = gguf.GGUFWriter(path, 'llama')
+    writer.add_context_length(context_length)
+    writer.add_embedding_length(n_embd)
+    writer.add_block_count(n_layers)
+    writer.add_feed_forward_length(n_ff)
+    writer.add_head_count(n_heads)
+    writer.add_head_count_kv(n_heads)
+    writer.add_rope_dimension_count(n_embd // n_heads)
+    writer.add_layer_norm_rms_eps(1e-5)
+    writer.add_tokenizer_model('llama')
+    writer.add_token_list(tokens)
+    writer.add_token_scores([0.0] * n_vocab)
+    writer.add_token_types(token_types)
+    writer.add_bos_token_id(1)
+    writer.add_eos_token_id(2)
+    writer.add_unk_token_id(0)
+
+    def add_weight(name: str, *shape: int) -> None:
+        writer.add_tensor(name, (rng.standard_normal(shape) * 0.5).astype(np.float32))
+
+    add_weight('token_embd.weight', n_vocab, n_embd)
+    writer.add_tensor('output_norm.weight', np.ones(n_embd, dtype=np.float32))
+    output = (rng.standard_normal((n_vocab, n_embd)) * 0.5).astype(np.float32)
+    output[:3] = 0
+    writer.add_tensor('output.weight', output)
+    for layer in range(n_layers):
+        writer.add_tensor(f'blk.{layer}.attn_norm.weight', np.ones(n_embd, dtype=np.float32))
+        writer.add_tensor(f'blk.{layer}.ffn_norm.weight', np.ones(n_embd, dtype=np.float32))
+        for name in ('attn_q', 'attn_k', 'attn_v', 'attn_output'):
+            add_weight(f'blk.{layer}.{name}.weight', n_embd, n_embd)
+        add_weight(f'blk.{layer}.ffn_gate.weight', n_ff, n_embd)
+        add_weight(f'blk.{layer}.ffn_up.weight', n_ff, n_embd)
+        add_weight(f'blk.{layer}.ffn_down.weight', n_embd, n_ff)
+
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    writer.write_tensors_to_file()
+    writer.close()
+
+
+@pytest.fixture(scope='session')
+def tiny_gguf_path(tmp_path_factory) -> str:
+    # A REAL SMALL GGUF CAN BE USED INSTEAD OF THE RANDOM ONE
+    if os.environ.get('TINY_GGUF_PATH'):
+        return os.environ['TINY_GGUF_PATH']
+    path = str(tmp_path_factory.mktemp('models') / 'tiny.gguf')
+    write_tiny_gguf(path=path)
+    return path
@@ -0,0 +1,36 @@
+import pytest
+
+llama_cpp = pytest.importorskip('llama_cpp')
+
+from batch_inference import BatchInferenceEngine
+
+
+def get_engine(model_path: str, n_parallel: int, n_batch: int, seed: int) -> BatchInferenceEngine:
+    llama = llama_cpp.Llama(model_path=model_path, n_ctx=256, n_batch=n_batch, n_threads=1, verbose=False)
+    return BatchInferenceEngine(
+        llama=llama, n_parallel=n_parallel, context_window_size=128, n_batch=n_batch, n_ubatch=n_batch,
+        sampling_params={'temperature': 1.0}, seed=seed
+    )
+
+
+def get_prompts_tokens(engine: BatchInferenceEngine, num_prompts: int) -> list:
+    return [
+        engine.llama.tokenize(f"the python skills {index}".encode('utf-8')) for index in range(num_prompts)
+    ]
+
+
+def test_more_sequences_than_n_batch_stay_within_the_batch(tiny_gguf_path):
+    # EVERY GENERATING SEQUENCE ADDS A TOKEN TO EACH DECODE CALL, SO n_batch CAPS THE PARALLEL SEQUENCES
+    engine = get_engine(model_path=tiny_gguf_path, n_parallel=12, n_batch=8, seed=1)
+    assert engine.n_parallel == 8
+    results = engine(get_prompts_tokens(engine=engine, num_prompts=12), max_tokens=6)
+    assert all(result is not None for result in results)
+    assert all(stats['generated_tokens'] > 0 for stats in engine.request_stats)
+
+
+def test_sampling_is_reproducible_with_a_fixed_seed(tiny_gguf_path):
+    outputs = []
+    for _ in range(2):
+        engine = get_engine(model_path=tiny_gguf_path, n_parallel=2, n_batch=64, seed=7)
+        outputs.append(engine(get_prompts_tokens(engine=engine, num_prompts=4), max_tokens=16))
+    assert outputs[0] == outputs[1]
@@ -0,0 +1,85 @@
+import random
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from torch.utils.data import DataLoader
+from batch_sampling import TokenBudgetBatchSampler
+
+
+MAX_TOKENS = 9000
+
+
+def get_lengths(num_examples: int = 2000, seed: int = 0) -> list:
+    generator = random.Random(seed)
+    return [generator.randint(300, 4500) for _ in range(num_examples)]
+
+
+def test_batches_cover_every_example_within_the_token_budget():
+    lengths = get_lengths()
+    batch_sampler = TokenBudgetBatchSampler(lengths=lengths, max_tokens=MAX_TOKENS)
+    batches = list(batch_sampler)
+    assert sorted(index for batch in batches for index in batch) == list(range(len(lengths)))
+    assert all(max(lengths[index] for index in batch) * len(batch) <= MAX_TOKENS or len(batch) == 1 for batch in batches)
+
+
+def test_batch_count_is_the_same_in_every_epoch():
+    lengths = get_lengths()
+    batch_sampler = TokenBudgetBatchSampler(lengths=lengths, max_tokens=MAX_TOKENS, shuffle=True)
+    num_batches = len(batch_sampler)
+    epochs = []
+    for epoch in range(3):
+        batch_sampler.set_epoch(epoch)
+        epochs.append(list(batch_sampler))
+    assert all(len(batches) == num_batches == len(batch_sampler) for batches in epochs)
+    assert epochs[0] != epochs[1]
+    assert sorted(map(tuple, epochs[0])) == sorted(map(tuple, epochs[1]))
+
+
+def test_batch_order_only_depends_on_the_epoch():
+    # A RESUMED RUN (NEW SAMPLER, set_epoch WITH THE RESUMED EPOCH) SEES THE SAME ORDER AS THE ORIGINAL RUN
+    lengths = get_lengths()
+    batch_sampler = TokenBudgetBatchSampler(lengths=lengths, max_tokens=MAX_TOKENS, shuffle=True)
+    batch_sampler.set_epoch(2)
+    assert list(batch_sampler) == list(batch_sampler)
+
+    resumed_batch_sampler = TokenBudgetBatchSampler(lengths=lengths, max_tokens=MAX_TOKENS, shuffle=True)
+    resumed_batch_sampler.set_epoch(2)
+    assert list(resumed_batch_sampler) == list(batch_sampler)
+
+
+def test_tiny_model_trains_on_cpu_for_the_planned_number_of_steps():
+    # THE TRAINER DERIVES max_steps AND THE LR SCHEDULE FROM len(dataloader) BEFORE THE FIRST EPOCH
+    torch.manual_seed(0)
+    vocab_size, num_epochs = 32, 3
+    lengths = get_lengths(num_examples=64, seed=1)
+    lengths = [length // 100 for length in lengths]
+    examples = [torch.randint(1, vocab_size, (length,)) for length in lengths]
+
+    def collate(batch):
+        return torch.nn.utils.rnn.pad_sequence(batch, batch_first=True, padding_value=0)
+
+    batch_sampler = TokenBudgetBatchSampler(lengths=lengths, max_tokens=MAX_TOKENS // 100, num_buckets=4, shuffle=True)
+    dataloader = DataLoader(examples, batch_sampler=batch_sampler, collate_fn=collate)
+    model = torch.nn.Sequential(torch.nn.Embedding(vocab_size, 8), torch.nn.Linear(8, vocab_size))
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    max_steps = len(dataloader) * num_epochs
+    scheduler = torch.optim.lr_scheduler.LambdaLR(optimizer, lambda step: 1 - step / max_steps)
+
+    steps = 0
+    for epoch in range(num_epochs):
+        batch_sampler.set_epoch(epoch)
+        for input_ids in dataloader:
+            logits = model(input_ids[:, :-1])
+            loss = torch.nn.functional.cross_entropy(
+                logits.reshape(-1, vocab_size), input_ids[:, 1:].reshape(-1), ignore_index=0
+            )
+            loss.backward()
+            optimizer.step()
+            scheduler.step()
+            optimizer.zero_grad()
+            steps += 1
+            assert torch.isfinite(loss)
+
+    assert steps == max_steps
+    assert scheduler.get_last_lr()[0] == pytest.approx(0.0)
@@ -0,0 +1,30 @@
+import json
+from checkpoint_store import JSONLCheckpointStore
+
+
+def test_partial_last_line_does_not_swallow_the_next_record(tmp_path):
+    store_path = str(tmp_path / 'checkpoint.jsonl')
+    with JSONLCheckpointStore(store_path=store_path) as store:
+        store.append(key='k1', record={'value': 1})
+    # A RUN KILLED WHILE WRITING A RECORD
+    with open(store_path, 'a', encoding='utf-8') as file:
+        file.write('{"key": "k2", "val')
+
+    with JSONLCheckpointStore(store_path=store_path) as store:
+        assert store.completed_keys == {'k1'}
+        store.append(key='k3', record={'value': 3})
+
+    with JSONLCheckpointStore(store_path=store_path) as store:
+        assert store.completed_keys == {'k1', 'k3'}
+
+
+def test_complete_last_record_without_line_break_is_kept(tmp_path):
+    store_path = str(tmp_path / 'checkpoint.jsonl')
+    with open(store_path, 'w', encoding='utf-8') as file:
+        file.write(json.dumps({'key': 'k1', 'value': 1}))
+
+    with JSONLCheckpointStore(store_path=store_path) as store:
+        store.append(key='k2', record={'value': 2})
+
+    with JSONLCheckpointStore(store_path=store_path) as store:
+        assert store.completed_keys == {'k1', 'k2'}
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+from utils import get_pair_key, get_text_hash
+from near_duplicates import NearDuplicateDetector, DuplicateMapping, propagate_labels
+from combine_jds_and_resumes import JDResumeCombiner, PairIndex
+
+
+def test_bucket_candidates_are_verified_against_every_member():
+    detector = NearDuplicateDetector(threshold=0.8)
+    rows_per_band = detector.rows_per_band
+    generator = np.random.default_rng(0)
+    signatures = generator.integers(0, 1 << 32, size=(3, detector.num_perm), dtype=np.uint64).astype(np.uint32)
+    # DOCUMENTS 1 AND 2 ARE NEAR-DUPLICATES THAT ONLY SHARE A BUCKET (THE FIRST BAND) WITH DOCUMENT 0
+    signatures[2] = signatures[1]
+    signatures[2, rows_per_band::rows_per_band] += 1
+    signatures[1:, :rows_per_band] = signatures[0, :rows_per_band]
+    assert (signatures[1] == signatures[2]).mean() >= detector.threshold
+
+    clusters = detector.cluster(signatures=signatures)
+    assert clusters.find(1) == clusters.find(2)
+    assert clusters.find(0) != clusters.find(1)
+
+
+def test_labels_are_propagated_to_near_duplicate_pairs(tmp_path):
+    jd = " ".join(f"requirement{i}" for i in range(200))
+    near_duplicate_jd = jd + " apply now"
+    other_jd = " ".join(f"benefit{i}" for i in range(200))
+    resumes = [" ".join(f"skill{i}" for i in range(200)), " ".join(f"project{i}" for i in range(200))]
+    pd.DataFrame({'Job Description': [jd, near_duplicate_jd, other_jd]}).to_parquet(tmp_path / 'jds.parquet')
+    pd.DataFrame({'Resume': resumes}).to_parquet(tmp_path / 'resumes.parquet')
+    pair_index_path = str(tmp_path / 'pair_index.json')
+    JDResumeCombiner(
+        jd_excel_filepath=str(tmp_path / 'jds.parquet'), resume_excel_filepath=str(tmp_path / 'resumes.parquet'),
+        output_store_path=pair_index_path, dedup_threshold=0.8
+    )()
+
+    pair_index = PairIndex(index_path=pair_index_path)
+    assert len(pair_index) == 4
+    records = [
+        {'key': get_pair_key(jd_id=jd_id, resume_id=resume_id), 'JD': pair_index.jds[jd_id],
+         'Resume': pair_index.resumes[resume_id], 'Response': f"label of {jd_id[:8]}", 'jd_id': jd_id, 'resume_id': resume_id}
+        for jd_id, resume_id in pair_index.iter_pairs()
+    ]
+    duplicate_mapping = DuplicateMapping(mapping_path=DuplicateMapping.get_mapping_path(pair_index_path=pair_index_path))
+    propagated = list(propagate_labels(
+        records=records, duplicate_mapping=duplicate_mapping, labeled_keys={record['key'] for record in records}
+    ))
+
+    expected_keys = {
+        get_pair_key(jd_id=get_text_hash(text), resume_id=get_text_hash(resume))
+        for text in (jd, near_duplicate_jd, other_jd) for resume in resumes
+    }
+    assert {record['key'] for record in propagated} == expected_keys
+    labels = {(record['JD'], record['Resume']): record['Response'] for record in propagated}
+    representative_jd = jd if get_text_hash(jd) in pair_index.jds else near_duplicate_jd
+    for resume in resumes:
+        assert labels[(jd, resume)] == labels[(near_duplicate_jd, resume)] == labels[(representative_jd, resume)]
@@ -0,0 +1,29 @@
+import pytest
+
+llama_cpp = pytest.importorskip('llama_cpp')
+
+from speculative_decoding import get_draft_model
+
+
+@pytest.mark.parametrize('prompt_repeats', [2, 20])
+def test_draft_model_tokens_are_accepted(tiny_gguf_path, prompt_repeats):
+    # THE MODEL DRAFTING FOR ITSELF PROPOSES THE TOKENS GREEDY DECODING PICKS (PROMPTS LONGER THAN n_batch INCLUDED)
+    context_window_size = 2048
+    draft_model = get_draft_model(
+        speculative_decoding='draft_model', num_draft_tokens=4, draft_model_path=tiny_gguf_path,
+        context_window_size=context_window_size, n_threads=1
+    )
+    model = llama_cpp.Llama(
+        model_path=tiny_gguf_path, n_ctx=context_window_size, n_batch=512, n_threads=1,
+        draft_model=draft_model, logits_all=True, verbose=False
+    )
+    prompt = " ".join(["the python skills and experience"] * prompt_repeats)
+    prompt_tokens = len(model.tokenize(prompt.encode('utf-8')))
+    assert prompt_tokens < context_window_size - 64
+    if prompt_repeats > 2:
+        assert prompt_tokens > 512
+
+    model.create_completion(prompt, max_tokens=32, temperature=0.0)
+    stats = draft_model.get_stats()
+    assert stats['draft_tokens'] > 0
+    assert stats['accepted_draft_tokens'] / stats['draft_tokens'] > 0.8